@@ -4,6 +4,10 @@ API Documentation
 
 All API requests must contain an Authorization cookie obtained from /api/authenticate. All query string parameters are required unless otherwise indicated. Page numbers start at 1. The standard way to display a user's name is "display name (@handle) | nickname if it exists". Because top-level JSON arrays constitute a security risk, arrays returned by these endpoints will be wrapped in an object with the key "results" pointing to the payload.
 
+The listings of conversations and users also accept a `cursor` parameter in place of `page`. Their responses contain a "cursor" key alongside "results", which holds an opaque token that can be passed as `cursor=[token]` to get the next page (or null if there are no more pages.) Cursors are cheaper than page numbers for pages far from the start, since the server can jump straight to them instead of counting through every page before them.
+
+Since the archive doesn't change, the server keeps the responses to most GET requests (all but /api/messages/random, media, and avatars) in memory and sends them again for later requests with the same query parameters, in any order. The POST endpoints that set nicknames and notes drop the responses that they make out of date, so changes show up in the very next response.
+
 Authorization
 -------------
 
@@ -20,11 +24,11 @@ Get/Set Conversations Data
 
 These endpoints return up to 20 serialized `ArchiveAccess.DBRead.Conversation` objects.
 
-### `GET /api/conversations?first=[oldest|newest|mostused|mostusedbyme]&page=[1|2|3|...]&types=[group-individual]`
+### `GET /api/conversations?first=[oldest|newest|mostused|mostusedbyme]&page=[1|2|3|...]&types=[group-individual]` or `...&cursor=[cursor]&types=...`
 
 Gets conversations sorted by time. If you specify first=oldest, the conversations with the oldest first message will be returned first; if you specify first=newest, the conversations with the most recent last message will be returned first; the other options sort by the number of messages or the number of messages sent by you (descending.) The types parameter should be a dash-delimited list of the conversation types ("group" and "individual") that will be included in the results.
 
-### `GET /api/conversations/withuser?id=[user_id]&page=[1|2|3]...`
+### `GET /api/conversations/withuser?id=[user_id]&page=[1|2|3]...` or `...&cursor=[cursor]`
 
 Gets the conversations that a specific user has appeared in, ordered by the number of messages they sent in that conversation in descending order.
 
@@ -58,13 +62,21 @@ Search clause (optional): `search=[query]`
 
 The main endpoint for obtaining messages from the API. This endpoint's payload includes all messagelike objects; in other words, any that inherit from `ArchiveAccess.DBRead.MessageLike`. You can tell which type each object has by looking at the "schema" field in the serialized result, which contains the name of the original object's class. This endpoint returns 40 normal messages at a time; the name update and joining and leaving events are additional to that. Messavelikes are always sorted oldest to newest (ascending.)
 
-Note that the html_contents field in normal messages contains links presented as HTML `<a>` tags.
+Note that the html_contents field in normal messages contains links presented as HTML `<a>` tags and line breaks presented as `<br />` tags; everything else in it is escaped, so it can be inserted into a page as-is.
 
 The filter clause is fairly self explanatory; pick either a conversation= or a byuser= parameter to send in. If it is omitted, any and all messages can come through, and if displayed to an end user, conversation events will need to be presented with their conversation name to make things clear.
 
 The timezone clause's first two options can be either "beginning" or "end" respectively, to retrieve messages from the very beginning or very end of the conversation; the "at" option will return the 20 messages from immediately before the timestamp and 20 messages after; if a message was sent at that exact timestamp, it will count as being before it. Events are included if they happened after the given timestamp but before the 40th message if the first option is used and vice versa for the second; for the third, only events that happened after the first returned message and before the last returned message are included. The exception is when you are at the very beginning or very end of the conversation, in which case all the events before the first message/after the last message are returned. Don't overthink the logic of retrieving a complete set of messages and events as you move in either direction in time; if you want to retrieve messages from before the ones you currently have loaded, just use the before option with the oldest timestamp you have in the messages and events you have; if you want to populate messages from after, use the after option with the newest timestamp you have. You can tell your traversal in each direction is done when this endpoint returns 0 messages or messagelikes.
 
-The search clause allows you to further filter message results by their contents. It takes a URL-encoded string containing words that will be searched for individually and quotation mark-surrounded phrases that will be searched for as a unit. Words that are searched for individually will use a "stemmed" index so that searches for "walk" will also match "walking", for example.
+The search clause allows you to further filter message results by their contents. It takes a URL-encoded string containing words that will be searched for individually and quotation mark-surrounded phrases that will be searched for as a unit. Words that are searched for individually will use a "stemmed" index so that searches for "walk" will also match "walking", for example. Phrases are only matched as a unit in databases that were imported with the default `--search_index full` setting; with the smaller "column" and "content" indexes, the words in a phrase are each searched for individually.
+
+If the archive was imported with the --substring_search flag, you can also pass `substring=true` to search for messages that contain the search text anywhere, even in the middle of a word or a link (ignoring case); substring searches must be at least 3 characters long. Searches that contain text from languages that aren't written with spaces between words, like Chinese and Japanese, use this automatically if it's available. Substring searches that are too short or that are made for an archive without the substring index get a 400 response.
+
+### `GET /api/search?search=[query]` or `...&cursor=[cursor]`
+
+Filter clause (optional): `conversation=[conversation_id]|byuser=[user_id]`
+
+Searches messages like the search clause of /api/messages does (including the optional `substring=true` parameter), but returns the best matches first instead of going through them in chronological order. Each page contains up to 40 messages in "results", with "users" and "conversations" arrays as with /api/messages, plus a "highlights" array of `ArchiveAccess.DBRead.SearchHighlight` objects (one per message, in the same order) that contain each message's rank (lower is better), a short snippet of the message around the words that matched, and the message's whole content with the matching words wrapped in `<mark>` tags. Pass the "cursor" from the response back as `cursor=[cursor]` along with the same search and filter to get the next page; it's null after the last page. No conversation events are included.
 
 ### `GET /api/message?id=[message_id]`
 
@@ -78,12 +90,14 @@ Gets 40 random messages (no conversation events) from the database. Follows the
 
 Retrieves media from the folder in the Twitter archive where it is stored. Media objects returned with messages already include the /group/ or /individual/ components in their "file_path" fields, so to get a url to retrieve media based on those, just append their file_path to "/api/media".
 
+Files are streamed in chunks. Single-range `Range` requests get `206 Partial Content` responses so that videos can be seeked through without downloading them first; requests for more than one range get the whole file, and ranges that start past the end of the file get `416 Range Not Satisfiable`. Responses have `ETag` and `Last-Modified` headers, and requests with a matching `If-None-Match` or a later `If-Modified-Since` get `304 Not Modified`.
+
 Get/Set User Data
 -----------------
 
 This endpoint returns serialized `ArchiveAccess.DBRead.ArchivedUser` objects; 20 are returned per page.
 
-### `GET /api/users?conversation=[conversation_id]&page=[1|2|3|...]`
+### `GET /api/users?conversation=[conversation_id]&page=[1|2|3|...]` or `...&cursor=[cursor]`
 
 Retrieves an array of users sorted by the number of messages that they have sent. The conversation parameter is optional; if it's supplied, only users with messages in the specified conversation will be returned they'll be ordered by the number of messages they sent in that conversation, and the `ArchiveAccess.DBRead.ArchivedParticipant` class will be used instead of the `ArchiveAccess.DBRead.ArchivedUser` class.
 
@@ -97,7 +111,7 @@ Retrieves an array of users that were known to be present in a certain conversat
 
 ### `GET /api/avatar/[user_id][.optional_file_extension]`
 
-Retrieves a user's avatar as an image file. The exact type of image file will be specified in the Content-Type header and can also be part of the url (although that is Optional; the correct file will be returned regardless.)
+Retrieves a user's avatar as an image file. The exact type of image file will be specified in the Content-Type header and can also be part of the url (although that is Optional; the correct file will be returned regardless.) Responses have an `ETag` header based on a hash of the image, and requests with a matching `If-None-Match` header get `304 Not Modified`. Users without avatars get a 404.
 
 ### `POST /api/user/nickname?id=[user_id]`
 
@@ -114,4 +128,8 @@ Misc
 
 Returns a JSON object with fields number_of_conversations, number_of_users, number_of_messages, (numbers) and earliest_message and latest_message (datestrings).
 
+### `GET /api/activity`
+
+Returns how many messages were sent on each day and in each hour of the week, for drawing activity charts. By default, all messages are counted; you can add `conversation=[conversation id]` or `byuser=[user id]` to only count the messages in a conversation or from a user. The response is a JSON object with three fields: `first_day`, a yyyy-mm-dd datestring (or null if there are no messages); `daily`, an array of message counts with one number for each day starting from `first_day` and ending on the last day with any messages; and `weekly`, an array of 168 message counts, one for each hour of the week starting from midnight on Sunday. Days and hours are in UTC.
+
 """
\ No newline at end of file
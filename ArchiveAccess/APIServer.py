@@ -1,38 +1,142 @@
-from tornado.web import RequestHandler, Application, StaticFileHandler
+from tornado.web import (
+    RequestHandler,
+    Application,
+    StaticFileHandler,
+    HTTPError,
+    GZipContentEncoding,
+)
+from tornado.escape import json_encode
 from tornado.template import Template, Loader
-from tornado.ioloop import IOLoop
-from ArchiveAccess.DBRead import TwitterDataReader, DBRow
-from typing import Union, Iterable
+from tornado.ioloop import IOLoop, PeriodicCallback
+from ArchiveAccess.DBRead import TwitterDataReader, DBRow, Page, decode_cursor
+from ArchiveAccess.ReaderPool import ReaderPool
+from ArchiveAccess.LRUCache import LRUCache
+from typing import Union, Iterable, ClassVar, Hashable
+from dataclasses import dataclass
+from tornado.iostream import StreamClosedError
 from mimetypes import guess_type
 from pathlib import Path
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import gzip
 import json
 import subprocess
 import re
 import secrets
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
 from tornado.log import enable_pretty_logging
 import logging
 
 enable_pretty_logging()
 
+CACHED_RESPONSE_BYTES = 32 * 1024 * 1024
+AUTHENTICATION_DAYS = 365
+
+
+async def run_query(
+    reader: Union[TwitterDataReader, ReaderPool], method: str, *args, **kwargs
+):
+    """calls a reader method without blocking the IOLoop by running it in one of the
+    reader pool's threads. a lone TwitterDataReader can only be used by the thread
+    that opened it, so it's just called directly."""
+    if isinstance(reader, ReaderPool):
+        return await reader.run(method, *args, **kwargs)
+    return getattr(reader, method)(*args, **kwargs)
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    content_type: str
+    # gzipped if `compressed` is True
+    body: bytes
+    compressed: bool
+    # the parts of the archive that the response was made from
+    tags: frozenset
+
+
+class ResponseCache:
+    """keeps the bodies of api responses so that requests for listings that have
+    already been made (which, since the archive doesn't change, are usually the
+    same for every visitor) don't need to touch the database. each response is
+    tagged with the kinds of data it contains, like "user names", or with specific
+    objects, like ("user", 12345), and `invalidate` drops every response with any of
+    the given tags when that data is changed by a POST request.
+
+    bodies that are long enough to be worth it are stored gzipped, the same way
+    that tornado's compress_response setting would gzip them, so that they take up
+    less memory and don't need to be compressed again for each request."""
+
+    def __init__(self, max_bytes: int, compress: bool = True):
+        self.responses = LRUCache(max_bytes=max_bytes, sizeof=lambda x: len(x.body))
+        self.compress = compress
+        # incremented by each invalidation so that responses that were being made
+        # from the old data while it changed aren't stored
+        self.generation = 0
+
+    def get(self, key: Hashable) -> Union[CachedResponse, None]:
+        return self.responses.get(key)
+
+    def put(
+        self,
+        key: Hashable,
+        content_type: str,
+        body: bytes,
+        tags: Iterable,
+        generation: int,
+    ) -> CachedResponse:
+        """stores a response that was made from the data as it was at `generation`
+        and returns it, so that it can be sent in the same way as responses that
+        come from the cache."""
+        compressed = self.compress and len(body) >= GZipContentEncoding.MIN_LENGTH
+        if compressed:
+            body = gzip.compress(body, GZipContentEncoding.GZIP_LEVEL)
+        response = CachedResponse(content_type, body, compressed, frozenset(tags))
+        with self.responses.lock:
+            if generation == self.generation:
+                self.responses.put(key, response)
+        return response
+
+    def invalidate(self, *tags: Hashable) -> int:
+        """removes the responses that have any of the tags; returns how many."""
+        with self.responses.lock:
+            self.generation += 1
+            return self.responses.pop_where(lambda x: not x.tags.isdisjoint(tags))
+
+    def clear(self):
+        with self.responses.lock:
+            self.generation += 1
+            self.responses.clear()
+
+    def stats(self) -> dict:
+        return self.responses.stats()
+
+
+def authenticated(handler: RequestHandler) -> bool:
+    """checks for the cookie that Authenticator gives out. it's signed with the
+    application's cookie_secret instead of being looked up in a list of tokens, so
+    that every worker process that has the same secret accepts it."""
+    return (
+        handler.get_secure_cookie("Authentication", max_age_days=AUTHENTICATION_DAYS)
+        is not None
+    )
+
 
 class ServeFrontend(RequestHandler):
     def initialize(
         self,
-        reader: TwitterDataReader,
+        reader: Union[TwitterDataReader, ReaderPool],
         titles: dict,
         db_owner: str,
-        tokens: Union[set, None],
+        require_password: bool,
     ):
         self.db = reader
         self.titles = titles
         self.db_owner = db_owner
-        self.authenticated_tokens = tokens
+        self.require_password = require_password
 
-    def get(self, path):
-        if (
-            self.authenticated_tokens
-            and self.get_cookie("Authentication") not in self.authenticated_tokens
-        ):
+    async def get(self, path):
+        if self.require_password and not authenticated(self):
             self.render(
                 "index.html",
                 title="Twitter Data Archive",
@@ -47,7 +151,7 @@ class ServeFrontend(RequestHandler):
             title = self.titles[self.request.path]
         elif m := re.match(r"/user/(info|messages)/(\d+)", self.request.path):
             id = int(m[2])
-            users = self.db.get_users_by_id([int(id)])
+            users = await run_query(self.db, "get_users_by_id", [int(id)])
             if users:
                 user = users[0]
                 title = (
@@ -58,7 +162,7 @@ class ServeFrontend(RequestHandler):
         elif m := re.match(
             r"/conversation/(info|messages)/((?:\d|-)+)", self.request.path
         ):
-            conversation = self.db.get_conversation_by_id(m[2])
+            conversation = await run_query(self.db, "get_conversation_by_id", m[2])
             title = conversation.name + (
                 " - Conversation Info" if m[1] == "info" else ""
             )
@@ -66,7 +170,7 @@ class ServeFrontend(RequestHandler):
             title = "Twitter Data Archive"
 
         if m := re.search(r"/messages/(?:(?:\d|-)+)/(\d+)", self.request.path):
-            message = self.db.get_message_by_id(int(m[1]))
+            message = await run_query(self.db, "get_message_by_id", int(m[1]))
             if message["results"]:
                 user = next(
                     x
@@ -98,18 +202,16 @@ class ServeFrontend(RequestHandler):
 
 
 class Authenticator(RequestHandler):
-    def initialize(self, token_store, password):
-        self.token_store: set = token_store
+    def initialize(self, password):
         self.password: str = password
 
     def post(self):
-        if (
-            str(self.request.body, "utf-8") == self.password
-            or self.get_cookie("Authentication") in self.token_store
-        ):
-            new_token = secrets.token_urlsafe(32)
-            self.token_store.add(new_token)
-            self.set_cookie("Authentication", new_token, expires_days=365)
+        if str(self.request.body, "utf-8") == self.password or authenticated(self):
+            self.set_secure_cookie(
+                "Authentication",
+                secrets.token_urlsafe(32),
+                expires_days=AUTHENTICATION_DAYS,
+            )
             self.finish()
         elif not self.password:
             self.set_status(200)
@@ -125,14 +227,21 @@ class ArchiveAPIServer:
 
     def __init__(
         self,
-        reader: TwitterDataReader,
+        reader: Union[TwitterDataReader, ReaderPool],
         individual_media_path: str,
         group_media_path: str,
         port: int,
         build_mode: str,
         password: str = "",
+        cached_response_bytes: int = CACHED_RESPONSE_BYTES,
+        cookie_secret: str = None,
     ):
+        """cached_response_bytes limits the size of the response cache; 0 turns it
+        off. authentication cookies are signed with cookie_secret, which has to be
+        the same for every process serving the archive; by default, a new one is
+        made, so cookies from previous runs of the server aren't accepted."""
         self.build_mode = build_mode
+        self.reader = reader
         logging.getLogger("tornado.access").addHandler(
             logging.FileHandler("logs/tornado.access.txt")
         )
@@ -144,13 +253,15 @@ class ArchiveAPIServer:
         )
         self.port = port
         db_owner = "@" + reader.get_main_user().handle
-        authenticated_tokens = set()
+        self.response_cache = (
+            ResponseCache(cached_response_bytes) if cached_response_bytes else None
+        )
         initializer = {
             "reader": reader,
             "group_media": group_media_path,
             "individual_media": individual_media_path,
             "require_password": bool(password),
-            "tokens": authenticated_tokens,
+            "response_cache": self.response_cache,
         }
         assets_handler = (
             r"/assets/(.*)",
@@ -166,13 +277,13 @@ class ArchiveAPIServer:
                 "reader": reader,
                 "titles": titles,
                 "db_owner": db_owner,
-                "tokens": authenticated_tokens if password else None,
+                "require_password": bool(password),
             },
         )
         authenticator = (
             "/api/authenticate",
             Authenticator,
-            {"token_store": authenticated_tokens, "password": password},
+            {"password": password},
         )
         self.application = Application(
             [assets_handler, frontend_handler, authenticator]
@@ -181,25 +292,58 @@ class ArchiveAPIServer:
             static_path="./frontend/assets/",
             template_path="./frontend/",
             static_hash_cache=False,
+            cookie_secret=cookie_secret or secrets.token_urlsafe(32),
         )
 
-    def start(self):
-        if self.build_mode == "dev":
-            subprocess.Popen(
-                "npx webpack --mode=development --watch --stats minimal",
-                shell=True,
-            )
-        elif self.build_mode == "single_build":
-            print("building frontend...")
-            subprocess.run("npx webpack --mode=production", shell=True)
-        print("starting server at http://localhost:" + str(self.port))
-        self.application.listen(self.port)
+    def start(self, reuse_port: bool = False):
+        """builds the frontend according to the build mode and serves the archive
+        until the process is stopped. with reuse_port, several processes can serve
+        the same port at once (where the platform supports SO_REUSEPORT), with the
+        kernel spreading connections between them."""
+        build_frontend(self.build_mode)
+        if reuse_port:
+            server = HTTPServer(self.application)
+            server.add_sockets(bind_sockets(self.port, reuse_port=True))
+        else:
+            print("starting server at http://localhost:" + str(self.port))
+            self.application.listen(self.port)
         IOLoop.current().start()
 
+    def watch_for_changes(self, interval: float = 1.0):
+        """checks every `interval` seconds whether the archive or its annotations
+        have been written to by another process (or by this one's writer
+        connection, which looks the same) and, if they have, empties the reader's
+        caches and the response cache, since they could be out of date. this is only
+        needed when more than one process serves the same archive; otherwise, each
+        write invalidates exactly what it changes."""
+        version = self.reader.get_data_version()
+
+        def check():
+            nonlocal version
+            if (current := self.reader.get_data_version()) != version:
+                version = current
+                self.reader.clear_caches()
+                if self.response_cache is not None:
+                    self.response_cache.clear()
+
+        PeriodicCallback(check, interval * 1000).start()
+
+
+def build_frontend(build_mode: str):
+    if build_mode == "dev":
+        subprocess.Popen(
+            "npx webpack --mode=development --watch --stats minimal",
+            shell=True,
+        )
+    elif build_mode == "single_build":
+        print("building frontend...")
+        subprocess.run("npx webpack --mode=production", shell=True)
+
 
 def handles(url):
     def register_handler(handler_class):
         ArchiveAPIServer.handlers.append((url, handler_class))
+        return handler_class
 
     return register_handler
 
@@ -207,28 +351,61 @@ def handles(url):
 class APIRequestHandler(RequestHandler):
     """abstract base class"""
 
+    # tags for the data that the handler's GET responses are made from (see
+    # ResponseCache); responses are only cached for handlers that have them
+    cache_tags: ClassVar[Union[tuple, None]] = None
+
     def initialize(
         self,
-        reader: TwitterDataReader,
+        reader: Union[TwitterDataReader, ReaderPool],
         group_media: str,
         individual_media: str,
         require_password: bool,
-        tokens: set,
+        response_cache: Union[ResponseCache, None] = None,
     ):
         self.db = reader
         self.group_media = group_media
         self.individual_media = individual_media
         self.require_password = require_password
-        self.tokens = tokens
+        self.response_cache = response_cache
+        self.cache_key = None
 
     def prepare(self):
         super().prepare()
-        if (
-            self.require_password
-            and self.get_cookie("Authentication") not in self.tokens
-        ):
+        if self.require_password and not authenticated(self):
             self.set_status(403, "Not authenticated >:(")
             self.finish()
+        elif (
+            self.response_cache is not None
+            and self.cache_tags is not None
+            and self.request.method == "GET"
+        ):
+            # the order of the query arguments doesn't change the response
+            self.cache_key = (
+                self.request.path,
+                tuple(
+                    sorted(
+                        (k, tuple(v)) for k, v in self.request.query_arguments.items()
+                    )
+                ),
+            )
+            self.cache_generation = self.response_cache.generation
+            if cached := self.response_cache.get(self.cache_key):
+                self.finish_cached(cached)
+
+    def response_tags(self) -> Iterable:
+        """returns the cache tags for the current request's response; handlers
+        whose responses depend on a specific object add a tag for it here."""
+        return self.cache_tags
+
+    def invalidate(self, *tags):
+        """drops responses that were made from data that a POST request changed."""
+        if self.response_cache is not None:
+            self.response_cache.invalidate(*tags)
+
+    async def query(self, method: str, *args):
+        """runs a reader method with `run_query`."""
+        return await run_query(self.db, method, *args)
 
     @classmethod
     def recursive_serialize(cls, item):
@@ -246,7 +423,9 @@ class APIRequestHandler(RequestHandler):
     @classmethod
     def process_chunk(cls, chunk):
         serialized_chunk = cls.recursive_serialize(chunk)
-        if isinstance(chunk, list):
+        if isinstance(chunk, Page):
+            return {"results": serialized_chunk, "cursor": chunk.cursor}
+        elif isinstance(chunk, list):
             return {"results": serialized_chunk}
         return serialized_chunk
 
@@ -254,14 +433,60 @@ class APIRequestHandler(RequestHandler):
         return super().write(self.process_chunk(chunk))
 
     def finish(self, chunk: Union[str, bytes, dict, DBRow, list, None] = None):
-        return super().finish(self.process_chunk(chunk))
+        chunk = self.process_chunk(chunk)
+        if isinstance(chunk, dict):
+            return self.finish_json(json_encode(chunk))
+        return super().finish(chunk)
+
+    def finish_json(self, json_text: str):
+        """sends json that has already been encoded (by the database, usually) as
+        the response, escaping it the same way that tornado escapes dicts, and
+        stores it in the response cache if the handler's responses are cached."""
+        content_type = "application/json; charset=UTF-8"
+        body = json_text.replace("</", "<\\/").encode()
+        if self.cache_key is not None and self.get_status() == 200:
+            return self.finish_cached(
+                self.response_cache.put(
+                    self.cache_key,
+                    content_type,
+                    body,
+                    self.response_tags(),
+                    self.cache_generation,
+                )
+            )
+        self.set_header("Content-Type", content_type)
+        return super().finish(body)
+
+    def finish_cached(self, response: CachedResponse):
+        """sends a response from the cache, as is if it's gzipped and the client
+        accepts that (tornado doesn't compress responses that already have a
+        Content-Encoding) and otherwise after decompressing it."""
+        self.set_header("Content-Type", response.content_type)
+        body = response.body
+        if response.compressed:
+            if self.settings.get("compress_response") and "gzip" in (
+                self.request.headers.get("Accept-Encoding", "")
+            ):
+                self.set_header("Content-Encoding", "gzip")
+            else:
+                body = gzip.decompress(body)
+        return super().finish(body)
 
     def get_query_argument(self, name, *args):
         if name == "page":
-            page = int(super().get_query_argument(name, *args))
+            # requests that use a cursor don't need a page number
+            page = int(super().get_query_argument(name, "1"))
             if page == 0:
                 self.set_status(404, "page numbers start from 1")
             return page
+        elif name == "cursor":
+            cursor = super().get_query_argument(name, *args)
+            if cursor:
+                try:
+                    decode_cursor(cursor)
+                except ValueError:
+                    raise HTTPError(400, "invalid cursor")
+            return cursor
         else:
             return super().get_query_argument(name, *args)
 
@@ -271,154 +496,341 @@ class APIRequestHandler(RequestHandler):
 
 @handles(r"/api/conversations")
 class AllConversationsHandler(APIRequestHandler):
-    def get(self):
+    cache_tags = ("user names", "conversation notes")
+
+    # maps the values of the "first" query argument to conversation sorts
+    sorts = {
+        "oldest": "first_time",
+        "newest": "last_time",
+        "mostusedbyme": "messages_from_you",
+        "mostused": "number_of_messages",
+    }
+
+    async def get(self):
         types = self.get_query_argument("types").split("-")
         group = "group" in types
         individual = "individual" in types
         assert (
             len([x for x in types if x not in ("", "group", "individual")]) == 0
         ), "conversation types are limited to 'group' and 'individual'"
-        method, page_number = self.arguments("first", "page")
-        if (asc := method == "oldest") or method == "newest":
-            self.finish(
-                self.db.get_conversations_by_time(
-                    page_number, asc, group, individual
-                )
-            )
-        elif (by_me := method == "mostusedbyme") or method == "mostused":
-            self.finish(
-                self.db.get_conversations_by_message_count(
-                    page_number, group, individual, by_me
-                )
+        method, page_number, cursor = self.arguments("first", "page", "cursor")
+        assert method in self.sorts, "malformed 'first' query argument"
+        self.finish_json(
+            await self.query(
+                "get_conversations_json",
+                group,
+                individual,
+                self.sorts[method],
+                page_number,
+                cursor,
             )
+        )
 
 
 @handles(r"/api/conversations/withuser")
 class ConversationsByUserHandler(APIRequestHandler):
-    def get(self):
-        user_id, page_number = self.arguments("id", "page")
-        self.finish(self.db.get_conversations_by_user(user_id, page_number))
+    cache_tags = ("user names", "conversation notes")
+
+    async def get(self):
+        user_id, page_number, cursor = self.arguments("id", "page", "cursor")
+        self.finish_json(
+            await self.query(
+                "get_conversations_json",
+                True,
+                True,
+                "messages_from_user",
+                page_number,
+                cursor,
+                user_id,
+            )
+        )
 
 
 @handles(r"/api/conversation")
 class ConversationByID(APIRequestHandler):
-    def get(self):
-        self.finish(self.db.get_conversation_by_id(self.get_query_argument("id")))
+    cache_tags = ("user names",)
+
+    def response_tags(self):
+        return self.cache_tags + (("conversation", self.get_query_argument("id")),)
+
+    async def get(self):
+        id = self.get_query_argument("id")
+        self.finish(await self.query("get_conversation_by_id", id))
 
 
 @handles(r"/api/conversation/names")
 class ConversationNames(APIRequestHandler):
-    def get(self):
+    cache_tags = ("user names",)
+
+    async def get(self):
         conversation, order, page = self.arguments("conversation", "first", "page")
         assert order in ("oldest", "newest"), "malformed 'first' query argument"
-        self.finish(
-            self.db.get_conversation_names(conversation, order == "oldest", page)
+        self.finish_json(
+            await self.query(
+                "get_conversation_names_json", conversation, order == "oldest", page
+            )
         )
 
 
 @handles(r"/api/conversation/notes")
 class SetConversationNotes(APIRequestHandler):
-    def post(self):
+    async def post(self):
         id = self.get_query_argument("id")
         new_notes = str(self.request.body, "utf-8")
-        self.db.set_conversation_notes(id, new_notes)
+        await self.query("set_conversation_notes", id, new_notes)
+        self.invalidate("conversation notes", ("conversation", id))
         self.set_status(200)
         self.finish(None)
 
 
 @handles(r"/api/messages/random")
 class RandomMessages(APIRequestHandler):
-    def get(self):
-        self.finish(self.db.get_random_messages())
+    async def get(self):
+        self.finish(await self.query("get_random_messages"))
 
 
 @handles(r"/api/messages")
 class Messages(APIRequestHandler):
-    def get(self):
+    # the conversations that the messages are from are sent along with them
+    cache_tags = ("user names", "conversation notes")
+
+    async def get(self):
         conversation, user = self.arguments("conversation", "byuser")
         after, before, at, message = self.arguments(
             "after", "before", "at", "message"
         )
         if message:
-            at = self.db.get_message_timestamp_by_id(int(message))
+            at = await self.query("get_message_timestamp_by_id", int(message))
         search = self.get_query_argument("search", None)
-        self.finish(
-            self.db.traverse_messages(conversation, user, after, before, at, search)
-        )
+        substring = self.get_query_argument("substring", "false") == "true"
+        try:
+            messages = await self.query(
+                "traverse_messages",
+                conversation,
+                user,
+                after,
+                before,
+                at,
+                search,
+                substring,
+            )
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        self.finish(messages)
+
+
+@handles(r"/api/search")
+class Search(APIRequestHandler):
+    # the conversations that the messages are from are sent along with them
+    cache_tags = ("user names", "conversation notes")
+
+    async def get(self):
+        search = self.get_query_argument("search")
+        conversation, user, cursor = self.arguments("conversation", "byuser", "cursor")
+        substring = self.get_query_argument("substring", "false") == "true"
+        try:
+            results = await self.query(
+                "search_by_relevance", search, conversation, user, cursor, substring
+            )
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        self.finish(results)
 
 
 @handles(r"/api/message")
 class SingleMessage(APIRequestHandler):
-    def get(self):
-        self.finish(self.db.get_message_by_id(int(self.get_query_argument("id"))))
+    # the conversations that the messages are from are sent along with them
+    cache_tags = ("user names", "conversation notes")
+
+    async def get(self):
+        id = int(self.get_query_argument("id"))
+        self.finish(await self.query("get_message_by_id", id))
 
 
 @handles(r"/api/users")
 class Users(APIRequestHandler):
-    def get(self):
-        conversation, page = self.arguments("conversation", "page")
-        self.finish(self.db.get_users_by_message_count(page, conversation))
+    cache_tags = ("user names", "user notes")
+
+    async def get(self):
+        conversation, page, cursor = self.arguments("conversation", "page", "cursor")
+        self.finish_json(
+            await self.query(
+                "get_users_by_message_count_json", page, conversation, cursor
+            )
+        )
 
 
 @handles(r"/api/user")
 class SingleUser(APIRequestHandler):
-    def get(self):
-        self.finish(
-            self.db.get_users_by_id([int(self.get_query_argument("id"))], False)[0]
-        )
+    cache_tags = ()
+
+    def response_tags(self):
+        return (("user", int(self.get_query_argument("id"))),)
+
+    async def get(self):
+        id = int(self.get_query_argument("id"))
+        self.finish((await self.query("get_users_by_id", [id], False))[0])
 
 
 @handles(r"/api/globalstats")
 class SingleUser(APIRequestHandler):
-    def get(self):
-        self.finish(self.db.get_global_stats())
+    # the stats never change
+    cache_tags = ()
+
+    async def get(self):
+        self.finish(await self.query("get_global_stats"))
+
+
+@handles(r"/api/activity")
+class Activity(APIRequestHandler):
+    cache_tags = ()
+
+    async def get(self):
+        conversation, user = self.arguments("conversation", "byuser")
+        try:
+            user = int(user) if user else None
+        except ValueError:
+            raise HTTPError(400, "malformed 'byuser' query argument")
+        self.finish(await self.query("get_activity", conversation, user))
 
 
 @handles(r"/api/user/nickname")
 class UserNickname(APIRequestHandler):
-    def post(self):
+    async def post(self):
         id = self.get_query_argument("id")
-        invalidated_conversations = self.db.set_user_nickname(
-            id, str(self.request.body, "utf-8")
+        invalidated_conversations = await self.query(
+            "set_user_nickname", id, str(self.request.body, "utf-8")
         )
+        self.invalidate("user names", ("user", int(id)))
         self.set_status(200)
         self.finish(invalidated_conversations)
 
 
 @handles(r"/api/user/notes")
 class UserNotes(APIRequestHandler):
-    def post(self):
+    async def post(self):
         id = self.get_query_argument("id")
-        self.db.set_user_notes(id, str(self.request.body, "utf-8"))
+        await self.query("set_user_notes", id, str(self.request.body, "utf-8"))
+        self.invalidate("user notes", ("user", int(id)))
         self.set_status(200)
         self.finish()
 
 
+def parse_range(header: str, size: int) -> Union[tuple[int, int], None]:
+    """returns the (start, end) byte offsets, with end exclusive, for a Range header
+    that asks for one range of a file, like "bytes=0-499", "bytes=500-", or
+    "bytes=-500" (the last 500 bytes.) returns None for headers that ask for more
+    than one range or that can't be understood, which are answered with the whole
+    file, and raises a ValueError if the range is outside of the file."""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or match[1] == match[2] == "":
+        return None
+    if match[1] == "":
+        start, end = max(size - int(match[2]), 0), size
+    else:
+        start = int(match[1])
+        end = min(int(match[2]) + 1, size) if match[2] else size
+    if start >= end:
+        raise ValueError(f"range {header} is outside of a {size}-byte file")
+    return start, end
+
+
 @handles(r"/api/media/(group|individual)/(.+)")
 class Media(APIRequestHandler):
-    def get(self, type, filename):
-        file_location = (
-            Path(self.group_media if type == "group" else self.individual_media)
-            / filename
+    """streams media files in chunks that are read in another thread, supporting
+    range requests so that videos can be seeked through and conditional requests so
+    that cached copies can be revalidated without being sent again."""
+
+    chunk_size = 64 * 1024
+
+    async def get(self, type, filename, include_body=True):
+        root = Path(self.group_media if type == "group" else self.individual_media)
+        path = (root / filename).resolve()
+        if not path.is_relative_to(root.resolve()) or not path.is_file():
+            raise HTTPError(404)
+        stat = path.stat()
+        modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+        self.set_header(
+            "Content-Type", guess_type(path.name)[0] or "application/octet-stream"
         )
-        self.set_header("Content-Type", guess_type(self.request.path)[0])
         self.set_header("Cache-Control", "max-age=604800, immutable")
-        if Path(file_location).exists():
-            with open(file_location, "rb") as media:
-                while True:
-                    data = media.read(5000000)
-                    if not data:
-                        break
-                    self.write(data)
-        else:
-            self.set_status(404)
-        self.finish()
+        self.set_header("Accept-Ranges", "bytes")
+        self.set_header("Last-Modified", modified)
+        # media files don't change once they've been exported from twitter, so their
+        # size and modification time are enough to identify them
+        self.set_header("Etag", f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"')
+        if self.not_modified(modified):
+            self.set_status(304)
+            return
+        start, end = 0, stat.st_size
+        if range_header := self.request.headers.get("Range"):
+            try:
+                requested = parse_range(range_header, stat.st_size)
+            except ValueError:
+                self.set_status(416)
+                self.set_header("Content-Range", f"bytes */{stat.st_size}")
+                return
+            if requested:
+                start, end = requested
+                self.set_status(206)
+                self.set_header(
+                    "Content-Range", f"bytes {start}-{end - 1}/{stat.st_size}"
+                )
+        self.set_header("Content-Length", end - start)
+        if include_body:
+            await self.stream(path, start, end)
+
+    async def head(self, type, filename):
+        await self.get(type, filename, include_body=False)
+
+    def not_modified(self, modified: datetime) -> bool:
+        """checks the request's If-None-Match header or, if it doesn't have one, its
+        If-Modified-Since header."""
+        if self.request.headers.get("If-None-Match"):
+            return self.check_etag_header()
+        if since := self.request.headers.get("If-Modified-Since"):
+            try:
+                return modified <= parsedate_to_datetime(since)
+            except (TypeError, ValueError):
+                pass
+        return False
+
+    async def stream(self, path: Path, start: int, end: int):
+        """sends the bytes from start to end of a file, reading each chunk in the
+        IOLoop's thread pool and waiting for it to be sent before reading the next
+        one, so that only one chunk is in memory at a time."""
+        loop = IOLoop.current()
+        media = await loop.run_in_executor(None, open, path, "rb")
+        try:
+            await loop.run_in_executor(None, media.seek, start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = await loop.run_in_executor(
+                    None, media.read, min(self.chunk_size, remaining)
+                )
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                self.write(chunk)
+                await self.flush()
+        except StreamClosedError:
+            # the browser stopped listening, e.g. because the video was seeked
+            pass
+        finally:
+            media.close()
 
 
 @handles(r"/api/avatar/(\d+)\.[A-Za-z]+")
 class AvatarRequestHandler(APIRequestHandler):
-    def get(self, id):
-        avatar = self.db.get_user_avatar(int(id))
-        self.set_header("Content-Type", guess_type("a." + avatar[1])[0])
+    async def get(self, id):
+        avatar = await self.query("get_user_avatar", int(id))
+        if not avatar:
+            raise HTTPError(404)
+        image, extension, etag = avatar
+        self.set_header("Content-Type", guess_type("a." + extension)[0])
         self.set_header("Cache-Control", "max-age=604800, immutable")
-        self.finish(avatar[0])
\ No newline at end of file
+        self.set_header("Etag", etag)
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        self.finish(image)
\ No newline at end of file
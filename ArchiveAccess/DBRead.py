@@ -2,28 +2,97 @@ from __future__ import annotations
 
 import sqlite3
 from pprint import pprint
-from typing import Union, Final, ClassVar
+from typing import Union, Final, ClassVar, get_type_hints, get_origin, get_args
 from collections.abc import Iterable, Callable
 from collections import defaultdict
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, fields
 from os import PathLike
 from contextlib import contextmanager
-from copy import deepcopy
+from functools import partial
 import string
+import re
+import json
+import html
+import hashlib
+import random
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as Base64Error
 from pathlib import Path
-from cv2 import (
-    imread as open_image,
-    VideoCapture as Video,
-    IMREAD_COLOR as color_image,
-    CAP_PROP_FRAME_HEIGHT as video_height,
-    CAP_PROP_FRAME_WIDTH as video_width,
-)
+from datetime import date
+
+if __name__ == "__main__":  # pragma: no cover
+    from LRUCache import LRUCache
+    from QueryRegistry import QueryRegistry
+else:
+    from ArchiveAccess.LRUCache import LRUCache
+    from ArchiveAccess.QueryRegistry import QueryRegistry
+
+SQL_SCRIPTS_PATH: Final = Path.cwd() / "SQLScripts"
 
 CONVERSATIONS_PER_PAGE: Final = 20
 CONVERSATION_NAMES_PER_PAGE: Final = 50
 MESSAGES_PER_PAGE: Final = 40
 USERS_PER_PAGE: Final = 20
 
+# the fts5 tables that messages can be searched with, and which of their columns
+# holds the messages' content; the substring index only exists in archives that
+# were imported with it turned on (see substring_search.sql)
+SEARCH_INDEXES: Final = {
+    "words": ("messages_text_search", 4),
+    "substring": ("messages_substring_search", 0),
+}
+
+# fts5 wraps the words that a search matched in these characters (from unicode's
+# private use area) instead of in <mark> tags, so that the message around them can
+# be escaped before they're turned into tags; see SearchHighlight.from_row
+HIGHLIGHT_START: Final = "\ue000"
+HIGHLIGHT_END: Final = "\ue001"
+
+# ways that the word index (messages_text_search) can be built, which is chosen when
+# an archive is imported (see text_search.sql); smaller indexes can do less. each
+# maps to (whether searches can be narrowed down to a conversation or sender inside
+# of the index, whether phrases in quotes are searched for as phrases instead of as
+# separate words, and the fts5 options that the index is created with)
+TEXT_SEARCH_MODES: Final = {
+    # keeps the position of every word in every message
+    "full": (True, True, "detail = full"),
+    # keeps which column each word is in but not where it is, so there are no
+    # phrases; without column sizes, bm25 has to count the words in each match
+    "column": (True, False, "detail = column, columnsize = 0"),
+    # only indexes content and only keeps which messages each word is in
+    "content": (False, False, "detail = none, columnsize = 0"),
+}
+
+# characters from scripts that aren't written with spaces between words, which the
+# word index can't split up into searchable words
+UNSPACED_SCRIPTS: Final = re.compile(
+    "[\u0e00-\u0e7f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]"
+)
+
+# the trigram tokenizer that the substring index uses can't look up anything shorter
+SUBSTRING_SEARCH_MIN_LENGTH: Final = 3
+
+# timestamps that sort before and after every real one
+EARLIEST_TIME: Final = "0000-00-00T00:00:00.000Z"
+LATEST_TIME: Final = "9999-99-99T99:99:99.999Z"
+
+# default limits for the reader's caches
+CACHED_USERS: Final = 10_000
+CACHED_CONVERSATIONS: Final = 5_000
+# avatars are cached by their total size, since they're mostly a few kilobytes each
+CACHED_AVATAR_BYTES: Final = 32 * 1024 * 1024
+
+# how much of an archive that's opened as immutable is memory-mapped instead of read
+# through sqlite's page cache; sqlite caps this at its own compile-time maximum
+MMAP_SIZE: Final = 1 << 30
+
+# joins the annotations database's rows onto the rows of the users and conversations
+# tables, so that nicknames and notes can be selected along with everything else
+USER_ANNOTATIONS_JOIN: Final = """left join annotations.user_annotations
+    on user_annotations.user_id = users.id"""
+CONVERSATION_ANNOTATIONS_JOIN: Final = """left join annotations.conversation_annotations
+    on conversation_annotations.conversation_id = conversations.id"""
+
 AVATAR_API_URL: Final = "/api/avatar/"
 MEDIA_API_URL: Final = "/api/media/"
 
@@ -33,6 +102,51 @@ USER_AVATAR_DEFAULT_URL: Final = "/assets/svg/mysteryuser.svg"
 DEFAULT_DISPLAY_NAME: Final = "Mystery User"
 
 
+def qualified_fields(fields: Iterable[str], table: str, replacements: dict) -> str:
+    """joins field names into a select list, prefixing each with the name of its
+    table unless it is in replacements, in which case the expression that it maps to
+    is used instead."""
+    return ", ".join(replacements.get(x, f"{table}.{x}") for x in fields)
+
+
+def json_object_sql(fields: dict[str, str], schema: str = None) -> str:
+    """builds a call to sqlite's json_object() that produces the same object as the
+    `serialize` method of a DBRow (or its `to_dict` method, if schema is None, which
+    is what's used for nested objects): fields maps the names of the dataclass's
+    fields, in order, to sql expressions for their values, and schema is the name of
+    the class. expressions for nested objects have to return json (e.g. by being
+    wrapped in json()) so that they aren't embedded as strings."""
+    if schema:
+        fields = fields | {"schema": f"'{schema}'"}
+    pairs = ", ".join(f"'{name}', {value}" for name, value in fields.items())
+    return f"json_object({pairs})"
+
+
+def json_bool_sql(condition: str) -> str:
+    """turns a condition into a json true or false, since sqlite has no booleans."""
+    return f"json(iif({condition}, 'true', 'false'))"
+
+
+def user_json_fields(users: str, annotations: str) -> dict[str, str]:
+    """the expressions for the fields of an ArchivedUserSummary, in the form that
+    `json_object_sql` takes; users and annotations are the names (or aliases) of the
+    users table and the user_annotations table joined onto it. these mirror
+    `ArchivedUserSummary._get_formatted_tuple`."""
+    loaded = f"{users}.loaded_full_data"
+    return {
+        "id": f"cast({users}.id as text)",
+        "nickname": f"coalesce({annotations}.nickname, '')",
+        "handle": f"iif({loaded}, {users}.handle, cast({users}.id as text))",
+        "display_name": f"iif({loaded}, {users}.display_name, "
+        f"'{DEFAULT_DISPLAY_NAME}')",
+        "avatar_url": f"""iif({loaded},
+            '{AVATAR_API_URL}' || {users}.id || '.' || {users}.avatar_extension,
+            '{USER_AVATAR_DEFAULT_URL}')""",
+        "loaded_full_data": json_bool_sql(loaded),
+        "is_main_user": json_bool_sql(f"{users}.id=(select id from me)"),
+    }
+
+
 @contextmanager
 def set_row_mode(connection: sqlite3.Connection, row_factory: Callable) -> None:
     """Simple context manager to make a sqlite3 Connection temporarily return rows
@@ -68,6 +182,49 @@ class WhereClause:
             return ""
 
 
+def encode_cursor(sort_value: Union[str, int, float], id: Union[str, int]) -> str:
+    """creates an opaque token that marks a position in a sorted listing; it
+    contains the sort key and the id (as a tiebreaker) of the last item on a page, so
+    that the next page can be found with an index seek instead of by counting past all
+    of the items on the previous pages with an offset."""
+    return urlsafe_b64encode(json.dumps([sort_value, id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """reverses `encode_cursor`, returning [sort_value, id]. raises a ValueError if
+    the token wasn't created by `encode_cursor`."""
+    try:
+        key = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (Base64Error, UnicodeError, json.JSONDecodeError):
+        raise ValueError(f"invalid cursor {cursor!r}")
+    if (
+        not isinstance(key, list)
+        or len(key) != 2
+        # they're passed to sqlite as placeholder values
+        or not all(
+            isinstance(x, (str, int, float)) and not isinstance(x, bool) for x in key
+        )
+    ):
+        raise ValueError(f"invalid cursor {cursor!r}")
+    return key
+
+
+class Page(list):
+    """list of results from a paginated listing that also has a `cursor` attribute,
+    which is a token that can be passed back to the method that created the page to
+    get the page after it, or None if this is the last page."""
+
+    def __init__(self, results: Iterable = (), cursor: str = None):
+        super().__init__(results)
+        self.cursor = cursor
+
+
+def page_json(results: Iterable[str], cursor: Union[str, None]) -> str:
+    """puts together the json that the api server sends for a Page from the json
+    for each of its results, as built by the database."""
+    return f'{{"results": [{", ".join(results)}], "cursor": {json.dumps(cursor)}}}'
+
+
 @dataclass(frozen=True)
 class DBRow:
 
@@ -79,14 +236,53 @@ class DBRow:
 
     db_select = "select 1 from sqlite_master"
 
+    def to_dict(self) -> dict:
+        """returns the same thing as `dataclasses.asdict`, but much faster, since it
+        uses a function generated for this class instead of recursively copying
+        everything."""
+        return row_encoders(type(self))[0](self)
+
     def serialize(self) -> dict:
-        return asdict(self) | {"schema": type(self).__name__}
+        """returns `to_dict()` plus a "schema" field with the name of this class."""
+        return row_encoders(type(self))[1](self)
 
     @classmethod
     def from_row(cls, cursor: sqlite3.Cursor, row: tuple):  # pragma: no cover
         raise NotImplementedError
 
 
+# generated to_dict and serialize functions for each subclass of DBRow
+_row_encoders: dict[type, tuple[Callable, Callable]] = {}
+
+
+def row_encoders(cls: type) -> tuple[Callable, Callable]:
+    """generates the to_dict and serialize functions for a DBRow subclass the first
+    time they're needed. they build a dict literal with one entry for each field of
+    the dataclass; fields that are typed as DBRows or lists of DBRows are turned into
+    dicts themselves, as `dataclasses.asdict` would, and the rest are used as-is,
+    since they're all strings, numbers, bools, and Nones."""
+    if cls not in _row_encoders:
+        hints = get_type_hints(cls)
+        entries = []
+        for field in fields(cls):
+            hint = hints[field.name]
+            value = f"self.{field.name}"
+            if isinstance(hint, type) and issubclass(hint, DBRow):
+                value = f"None if {value} is None else {value}.to_dict()"
+            elif get_origin(hint) is list and issubclass(get_args(hint)[0], DBRow):
+                value = f"[x.to_dict() for x in {value}]"
+            entries.append(f"{field.name!r}: {value}")
+        schema = f"'schema': {cls.__name__!r}"
+        source = f"""def to_dict(self):
+    return {{{', '.join(entries)}}}
+def serialize(self):
+    return {{{', '.join(entries + [schema])}}}"""
+        namespace = {}
+        exec(source, {}, namespace)
+        _row_encoders[cls] = (namespace["to_dict"], namespace["serialize"])
+    return _row_encoders[cls]
+
+
 @dataclass(frozen=True)
 class ArchivedUserSummary(DBRow):
     """class that stores a limited amount of user data fetched from the database.
@@ -103,7 +299,12 @@ class ArchivedUserSummary(DBRow):
         "id=(select id from me)",
     )
 
-    db_select: ClassVar = f"select {', '.join(_source_fields)} from users"
+    from_clause: ClassVar = f"from users {USER_ANNOTATIONS_JOIN}"
+    db_select: ClassVar = f"select {', '.join(_source_fields)} {from_clause}"
+    # builds the serialized form of this class in the database; see json_object_sql
+    json_object: ClassVar = json_object_sql(
+        user_json_fields("users", "user_annotations"), "ArchivedUserSummary"
+    )
 
     id: str
     nickname: str
@@ -155,7 +356,20 @@ class ArchivedUser(ArchivedUserSummary):
         "last_appearance",
     )
     # todo: figure out whether this actually needs to be re-declared in this subclass
-    db_select: ClassVar = f"select {', '.join(_source_fields)} from users"
+    db_select: ClassVar = (
+        f"select {', '.join(_source_fields)} {ArchivedUserSummary.from_clause}"
+    )
+    json_object: ClassVar = json_object_sql(
+        user_json_fields("users", "user_annotations")
+        | {
+            "number_of_messages": "users.number_of_messages",
+            "bio": "coalesce(users.bio, '')",
+            "notes": "coalesce(user_annotations.notes, '')",
+            "first_appearance": "users.first_appearance",
+            "last_appearance": "users.last_appearance",
+        },
+        "ArchivedUser",
+    )
 
     number_of_messages: int
     bio: str
@@ -191,10 +405,22 @@ class ArchivedParticipant(ArchivedUserSummary):
         "participants.start_time",
         "participants.end_time",
     )
-    db_select: ClassVar = f"""select {', '.join(_source_fields)} from users 
-            join participants on 
+    from_clause: ClassVar = f"""from users
+            join participants on
             participants.participant=users.id and
-            participants.conversation=?"""
+            participants.conversation=?
+            {USER_ANNOTATIONS_JOIN}"""
+    db_select: ClassVar = f"select {', '.join(_source_fields)} {from_clause}"
+    json_object: ClassVar = json_object_sql(
+        user_json_fields("users", "user_annotations")
+        | {
+            "conversation": "participants.conversation",
+            "messages_in_conversation": "participants.messages_sent",
+            "join_time": "participants.start_time",
+            "leave_time": "participants.end_time",
+        },
+        "ArchivedParticipant",
+    )
 
     conversation: str
     messages_in_conversation: int
@@ -214,9 +440,72 @@ class Conversation(DBRow):
     """dataclass representing a conversation record. contains ArchivedUserSummary
     objects instead of just IDs."""
 
-    db_select: ClassVar = """select id, type, number_of_messages,
-    messages_from_you, first_time, last_time, num_participants, num_name_updates,
-    created_by_me, other_person, added_by, notes from conversations"""
+    _source_fields: ClassVar = (
+        "id",
+        "type",
+        "number_of_messages",
+        "messages_from_you",
+        "first_time",
+        "last_time",
+        "num_participants",
+        "num_name_updates",
+        "created_by_me",
+        "other_person",
+        "added_by",
+        "notes",
+        "current_name",
+        "participant_names",
+    )
+    # the fields that come from the annotations database instead of the conversations
+    # table
+    _annotation_fields: ClassVar = {
+        "notes": "conversation_annotations.notes",
+        "participant_names": """coalesce(conversation_annotations.participant_names,
+            conversations.participant_names)""",
+    }
+    select_list: ClassVar = qualified_fields(
+        _source_fields, "conversations", _annotation_fields
+    )
+
+    db_select: ClassVar = (
+        f"select {select_list} from conversations {CONVERSATION_ANNOTATIONS_JOIN}"
+    )
+
+    # joins the users that are embedded in conversations, for json_object
+    user_joins: ClassVar = """left join users as other_user
+            on other_user.id = conversations.other_person
+        left join annotations.user_annotations as other_user_annotations
+            on other_user_annotations.user_id = other_user.id
+        left join users as adder on adder.id = conversations.added_by
+        left join annotations.user_annotations as adder_annotations
+            on adder_annotations.user_id = adder.id"""
+    _other_user: ClassVar = user_json_fields("other_user", "other_user_annotations")
+    # mirrors from_row_and_users; needs user_joins and CONVERSATION_ANNOTATIONS_JOIN
+    json_object: ClassVar = json_object_sql(
+        {x: f"conversations.{x}" for x in _source_fields[0:8]}
+        | {
+            "created_by_me": json_bool_sql("conversations.created_by_me"),
+            "other_person": f"""json(iif(conversations.other_person is null, null,
+                {json_object_sql(_other_user)}))""",
+            "added_by": f"""json(iif(conversations.added_by is null, null,
+                {json_object_sql(user_json_fields("adder", "adder_annotations"))}))""",
+            "name": f"""iif(conversations.type='individual',
+                coalesce(
+                    nullif(other_user_annotations.nickname, ''),
+                    {_other_user["display_name"]} || ' (@' ||
+                    {_other_user["handle"]} || ')'
+                ),
+                coalesce(
+                    nullif(conversations.current_name, ''),
+                    nullif({_annotation_fields["participant_names"]}, ''),
+                    ''
+                ))""",
+            "image_url": f"""iif(conversations.type='individual',
+                {_other_user["avatar_url"]}, '{GROUP_DM_DEFAULT_URL}')""",
+            "notes": "coalesce(conversation_annotations.notes, '')",
+        },
+        "Conversation",
+    )
 
     # todo: deal with non-passthrough values in a post_init stage?
 
@@ -239,21 +528,23 @@ class Conversation(DBRow):
 
     @classmethod
     def from_row(cls, cursor: sqlite3.Cursor, row: tuple) -> Conversation:
+        """Creates a single Conversation; when there's more than one row to turn
+        into conversations, `TwitterDataReader.get_conversations_from_rows` is much
+        cheaper."""
+        return cursor.connection.get_conversations_from_rows([row])[0]
+
+    @classmethod
+    def from_row_and_users(
+        cls, row: tuple, users: dict[int, ArchivedUserSummary]
+    ) -> Conversation:
+        """Creates a Conversation from a row selected with `db_select` and a dict
+        that maps user ids to ArchivedUserSummary objects, which must include the
+        row's other_person and added_by users."""
 
         pass_through_values = row[0:8]
         created_by_me = bool(row[8])
-
-        if row[9]:
-            other_person = cursor.connection.get_users_by_id([row[9]])[0]
-            cursor.connection.cache_user_conversation_dependency(row[9], row[0])
-        else:
-            other_person = None
-
-        if row[10]:
-            added_by = cursor.connection.get_users_by_id([row[10]])[0]
-            cursor.connection.cache_user_conversation_dependency(row[10], 0)
-        else:
-            added_by = None
+        other_person = users[row[9]] if row[9] else None
+        added_by = users[row[10]] if row[10] else None
 
         if row[1] == "individual":
             name = (
@@ -263,38 +554,7 @@ class Conversation(DBRow):
             image_url = other_person.avatar_url
         else:
             image_url = GROUP_DM_DEFAULT_URL
-            with set_row_mode(cursor.connection, None):
-                last_name = cursor.connection.execute(
-                    "select new_name from name_updates "
-                    "where conversation=? "
-                    "order by update_time desc limit 1;",
-                    (row[0],),
-                ).fetchone()
-            if last_name:
-                name = last_name[0]
-            else:
-                # todo: probably want this call as a method in the TwitterDataReader
-                # connection class
-                with set_row_mode(cursor.connection, None):
-                    participant_rows = cursor.connection.execute(
-                        """select nickname, display_name, participant
-                        from participants
-                        join users on participants.participant=users.id
-                        where conversation=?
-                        order by messages_sent desc limit 6;""",
-                        (row[0],),
-                    ).fetchall()
-                participants = []
-                for x in participant_rows[0:5]:
-                    participants.append(
-                        x[0] if x[0] else (x[1] if x[1] else f"@{x[2]}")
-                    )
-                    cursor.connection.cache_user_conversation_dependency(
-                        x[2], row[0]
-                    )
-                name = ", ".join(participants)
-                if len(participant_rows) == 6:
-                    name += ", etc."
+            name = row[12] or row[13] or ""
 
         notes = row[11] or ""
 
@@ -347,6 +607,16 @@ class NameUpdate(MessageLike):
     db_select: ClassVar = """select rowid, update_time, initiator, new_name, conversation
         from name_updates"""
     timestamp_field: ClassVar = "update_time"
+    json_object: ClassVar = json_object_sql(
+        {
+            "id": "'update' || rowid",
+            "update_time": "update_time",
+            "initiator": "cast(initiator as text)",
+            "new_name": "new_name",
+            "conversation": "conversation",
+        },
+        "NameUpdate",
+    )
 
     id: str
     update_time: str
@@ -419,7 +689,7 @@ class ParticipantLeave(MessageLike):
 @dataclass(frozen=True)
 class Reaction(DBRow):
     db_select: ClassVar = (
-        "select rowid, emotion, creation_time, creator from reactions"
+        "select rowid, emotion, creation_time, creator, message from reactions"
     )
 
     id: int
@@ -434,10 +704,10 @@ class Reaction(DBRow):
 
 @dataclass(frozen=True)
 class Media(DBRow):
-    db_select: ClassVar = "select id, type, message, filename, from_group_message, width, height from media"
+    """width and height are measured when the database is created (see
+    `ArchiveAccess.MediaDimensions`) and are None for files that couldn't be found."""
 
-    dm_media_path: ClassVar
-    group_media_path: ClassVar
+    db_select: ClassVar = "select id, type, message, filename, from_group_message, width, height from media"
 
     id: str
     type: str
@@ -447,42 +717,23 @@ class Media(DBRow):
 
     @classmethod
     def from_row(cls, cursor: sqlite3.Cursor, row: tuple):
-        if not (row[5] and row[6]):
-            file_path = str(
-                (cls.group_media_path if row[4] else cls.dm_media_path)
-                / (f"{row[2]}-{row[3]}")
-            )
-            if row[1] == "image":
-                img = open_image(file_path, color_image)
-                height, width, _ = img.shape
-            else:
-                vid = Video(file_path)
-                height, width = vid.get(video_height), vid.get(video_width)
-            cursor.connection.execute(
-                "update media set width=?, height=? where id=?",
-                (width, height, row[0]),
-            )
-            cursor.connection.commit()
-        else:
-            height, width = row[6], row[5]
         return cls(
             str(row[0]),
             row[1],
             f"{MEDIA_API_URL}{'group/' if row[4] else 'individual/'}{row[2]}-{row[3]}",
-            width,
-            height,
+            row[5],
+            row[6],
         )
 
 
 @dataclass(frozen=True)
 class Message(MessageLike):
     db_select_fields: ClassVar = (
-        """select sent_time, conversation, content, sender, id from """
+        """select sent_time, conversation, content, sender, id, html_content from """
     )
     timestamp_field: ClassVar = "sent_time"
 
     db_select: ClassVar = db_select_fields + "messages"
-    db_select_for_search: ClassVar = db_select_fields + "messages_text_search"
 
     sent_time: str
     conversation: str
@@ -503,44 +754,514 @@ class Message(MessageLike):
 
     @classmethod
     def from_row(cls, cursor: sqlite3.Cursor, row: tuple):
-        with set_row_mode(cursor.connection, Reaction.from_row):
-            reactions = cursor.connection.execute(
-                Reaction.db_select + " where message=? order by creation_time;",
-                [row[4]],
-            ).fetchall()
-
-        with set_row_mode(cursor.connection, Media.from_row):
-            media = cursor.connection.execute(
-                Media.db_select + " where message=?;", [row[4]]
-            ).fetchall()
+        """Creates a single Message; when there's more than one row to turn into
+        messages, `TwitterDataReader.get_messages_from_rows` is much cheaper."""
+        return cursor.connection.get_messages_from_rows([row])[0]
 
-        with set_row_mode(cursor.connection, sqlite3.Row):
-            link_rows = cursor.connection.execute(
-                """select orig_url, url_preview, twitter_shortened_url
-                    from links where message=?""",
-                (row[4],),
-            ).fetchall()
-            html_content = row[2].replace("\n", "<br />")
-            for link in link_rows:
-                if link["orig_url"].startswith(
-                    "https://twitter.com/messages/media/"
-                ) and link["url_preview"].startswith("pic.twitter.com/"):
-                    html_content = html_content.replace(
-                        link["twitter_shortened_url"], ""
-                    )
-                else:
-                    html_content = html_content.replace(
-                        link["twitter_shortened_url"],
-                        f'<a href="{link["orig_url"]}">{link["url_preview"]}</a>',
-                    )
+    @classmethod
+    def from_row_and_attachments(
+        cls, row: tuple, reactions: list[Reaction], media: list[Media]
+    ) -> Message:
+        """Creates a Message from a row selected with `db_select` plus the reactions
+        and media that belong to it. the html content was rendered when the message
+        was added to the database, so it's used as-is."""
         return cls(
             *row[0:3],
             str(row[3]),
             str(row[4]),
             reactions,
             media,
-            html_content.strip(),
+            row[5],
+        )
+
+
+@dataclass(frozen=True)
+class SearchHighlight(DBRow):
+    """accompanies a message in relevance-ranked search results; snippet is the
+    part of the message that best matches the search and highlighted_content is the
+    whole message, both escaped like html_content and with the matching words
+    wrapped in <mark> tags. lower ranks are better matches."""
+
+    message: str
+    rank: float
+    snippet: str
+    highlighted_content: str
+
+    @classmethod
+    def from_row(cls, cursor: sqlite3.Cursor, row: tuple) -> SearchHighlight:
+        """takes a row of the form (message id, rank, snippet, highlight)"""
+        return cls(str(row[0]), row[1], mark_matches(row[2]), mark_matches(row[3]))
+
+
+def mark_matches(text: str) -> str:
+    """escapes a snippet or highlight from fts5 the same way that messages'
+    html_content is escaped and then turns the characters that the matches are
+    wrapped in into <mark> tags."""
+    escaped = html.escape(html.unescape(text))
+    return escaped.replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>")
+
+
+# every read query that TwitterDataReader runs is defined here; see QueryRegistry.py
+READ_QUERIES: Final = QueryRegistry(
+    large_tables=(
+        "messages",
+        "users",
+        "conversations",
+        "participants",
+        "name_updates",
+        "reactions",
+        "media",
+        "links",
+        "message_positions",
+        "timeline",
+        "daily_activity",
+        "weekly_activity",
+    )
+)
+
+
+def placeholder_list(count: int) -> str:
+    return ", ".join("?" for _ in range(count))
+
+
+@READ_QUERIES.shape("main_user")
+def main_user_query() -> str:
+    return ArchivedUser.db_select + " where id=(select id from me);"
+
+
+@READ_QUERIES.shape("users_by_id", sidecar=(True, False), count=(1, 20))
+def users_by_id_query(sidecar: bool, count: int) -> str:
+    user_class = ArchivedUserSummary if sidecar else ArchivedUser
+    return f"{user_class.db_select} where id in ({placeholder_list(count)});"
+
+
+@READ_QUERIES.shape("reactions_for_messages", count=(1, MESSAGES_PER_PAGE))
+def reactions_query(count: int) -> str:
+    return f"""{Reaction.db_select} where message in ({placeholder_list(count)})
+        order by creation_time;"""
+
+
+@READ_QUERIES.shape("media_for_messages", count=(1, MESSAGES_PER_PAGE))
+def media_query(count: int) -> str:
+    return f"{Media.db_select} where message in ({placeholder_list(count)});"
+
+
+@READ_QUERIES.shape(
+    "users_by_message_count",
+    paginated=True,
+    in_conversation=(False, True),
+    after_cursor=(False, True),
+    as_json=(False, True),
+)
+def users_by_message_count_query(
+    in_conversation: bool, after_cursor: bool, as_json: bool
+) -> str:
+    """the conversation id (if in_conversation) and the two values from the cursor
+    (if after_cursor) come before the limit and offset placeholders. if as_json,
+    each row is the user's json followed by the sort key and id for the cursor."""
+    if in_conversation:
+        user_class = ArchivedParticipant
+        sort_key, id = "participants.messages_sent", "participants.participant"
+    else:
+        user_class = ArchivedUser
+        sort_key, id = "number_of_messages", "id"
+    select = user_class.db_select
+    if as_json:
+        select = f"select {user_class.json_object}, {sort_key}, {id} "
+        select += user_class.from_clause
+    where = WhereClause()
+    if after_cursor:
+        where.add(f"({sort_key}, {id}) < (?, ?)")
+    return f"""{select} {where} order by {sort_key} desc, {id} desc
+        limit ? offset ?;"""
+
+
+@READ_QUERIES.shape("conversations_embedding_user")
+def conversations_embedding_user_query() -> str:
+    """takes the user's id three times."""
+    return """select id from conversations where other_person=? or added_by=?
+        union
+        select conversation from participants
+        join conversations on participants.conversation=conversations.id
+        where participant=? and type='group'
+        and current_name is null;"""
+
+
+# maps the ways that conversations can be sorted to (the expression they're sorted
+# by, whether it's descending, the column that breaks ties, and a join clause that
+# the sort key comes from, which takes a user id as a placeholder if it's present.)
+# tied conversations are sorted by the joined table's copy of the conversation id
+# when there is one so that the database can use one index for the whole order.
+CONVERSATION_SORTS: Final = {
+    "first_time": ("conversations.first_time", False, "conversations.id", ""),
+    "last_time": ("conversations.last_time", True, "conversations.id", ""),
+    "number_of_messages": (
+        "conversations.number_of_messages",
+        True,
+        "conversations.id",
+        "",
+    ),
+    "messages_from_you": (
+        "conversations.messages_from_you",
+        True,
+        "conversations.id",
+        "",
+    ),
+    "messages_from_user": (
+        "participants.messages_sent",
+        True,
+        "participants.conversation",
+        """join participants on participants.conversation=conversations.id
+            and participants.participant=?""",
+    ),
+}
+
+
+@READ_QUERIES.shape(
+    "conversations",
+    paginated=True,
+    group=(True, False),
+    individual=(True, False),
+    sort=tuple(CONVERSATION_SORTS),
+    after_cursor=(False, True),
+    as_json=(False, True),
+)
+def conversations_query(
+    group: bool, individual: bool, sort: str, after_cursor: bool, as_json: bool
+) -> str:
+    """selects the usual conversation fields followed by the sort key, so that it
+    can be put in the next cursor; if as_json, the fields are replaced by the id and
+    the conversation's json. placeholders: the user id for the messages_from_user
+    sort, then the cursor's two values if after_cursor, then the limit and offset."""
+    sort_key, descending, tiebreaker, join = CONVERSATION_SORTS[sort]
+    where = WhereClause()
+    if group and not individual:
+        where.add("conversations.type='group'")
+    elif individual and not group:
+        where.add("conversations.type='individual'")
+    if after_cursor:
+        where.add(f"({sort_key}, {tiebreaker}) {'<' if descending else '>'} (?, ?)")
+    direction = "desc" if descending else "asc"
+    select_list = Conversation.select_list
+    if as_json:
+        select_list = f"conversations.id, {Conversation.json_object}"
+        join += " " + Conversation.user_joins
+    return f"""select {select_list}, {sort_key} from conversations {join}
+        {CONVERSATION_ANNOTATIONS_JOIN} {where}
+        order by {sort_key} {direction}, {tiebreaker} {direction}
+        limit ? offset ?;"""
+
+
+@READ_QUERIES.shape("conversations_by_id", count=(1, 20))
+def conversations_by_id_query(count: int) -> str:
+    return f"{Conversation.db_select} where id in ({placeholder_list(count)});"
+
+
+@READ_QUERIES.shape("conversation_names", paginated=True, oldest_first=(True, False))
+def conversation_names_query(oldest_first: bool) -> str:
+    order = "asc" if oldest_first else "desc"
+    return f"""{NameUpdate.db_select}
+        where conversation=?
+        order by update_time {order}, rowid {order}
+        limit ? offset ?;"""
+
+
+@READ_QUERIES.shape(
+    "conversation_names_json", paginated=True, oldest_first=(True, False)
+)
+def conversation_names_json_query(oldest_first: bool) -> str:
+    """builds the whole response for a page of a conversation's names, including the
+    users who chose them. the page is used twice, so it's ordered by rowid as well
+    as by time to make sure that it has the same names both times when some of them
+    were set at the same time."""
+    order = "asc" if oldest_first else "desc"
+    return f"""with page as (
+            select {NameUpdate.json_object} as name_update, initiator, update_time,
+                rowid as row_id
+            from name_updates
+            where conversation=?
+            order by update_time {order}, rowid {order}
+            limit ? offset ?
         )
+        select json_object(
+            'results', json((
+                select json_group_array(json(name_update)) from (
+                    select name_update from page
+                    order by update_time {order}, row_id {order}
+                )
+            )),
+            'users', json((
+                select json_group_array({ArchivedUserSummary.json_object})
+                {ArchivedUserSummary.from_clause}
+                where users.id in (select initiator from page)
+            ))
+        );"""
+
+
+@READ_QUERIES.shape("search_settings")
+def search_settings_query() -> str:
+    return f"""select (select mode from text_search_mode), (
+            select count() from sqlite_master
+            where type='table' and name='{SEARCH_INDEXES["substring"][0]}'
+        );"""
+
+
+@READ_QUERIES.shape(
+    "message_search",
+    index=tuple(SEARCH_INDEXES.keys()),
+    in_conversation=(False, True),
+    by_sender=(False, True),
+    time_bound=(None, "<", "<=", ">"),
+    descending=(False, True),
+)
+def message_search_query(
+    index: str,
+    in_conversation: bool,
+    by_sender: bool,
+    time_bound: Union[str, None],
+    descending: bool,
+) -> str:
+    """selects messages that match a full text search of one of the SEARCH_INDEXES
+    in either time direction, optionally only those sent in a specific conversation
+    and/or by a specific sender, and optionally only those sent before/after a time.
+    the search should come from `TwitterDataReader.search_match`, which also narrows
+    it down to the conversation and sender within the word index; they're checked
+    again here because the column filters can't tell all ids apart (and the
+    substring index doesn't have them.) placeholders: the search, the conversation,
+    the sender, the time, and the limit, for whichever of those are used."""
+    table, _ = SEARCH_INDEXES[index]
+    where = WhereClause()
+    where.add(f"{table} match ?")
+    if in_conversation:
+        where.add("messages.conversation=?")
+    if by_sender:
+        where.add("messages.sender=?")
+    if time_bound:
+        where.add(f"messages.sent_time {time_bound} ?")
+    return f"""select messages.sent_time, messages.conversation, messages.content,
+            messages.sender, messages.id, messages.html_content
+        from {table}
+        join messages on messages.id = {table}.rowid
+        {where}
+        order by messages.sent_time {'desc' if descending else 'asc'}
+        limit ?;"""
+
+
+@READ_QUERIES.shape(
+    "ranked_search",
+    index=tuple(SEARCH_INDEXES.keys()),
+    in_conversation=(False, True),
+    by_sender=(False, True),
+    after_cursor=(False, True),
+)
+def ranked_search_query(
+    index: str, in_conversation: bool, by_sender: bool, after_cursor: bool
+) -> str:
+    """selects a page of messages that match a full text search, best matches first
+    according to fts5's bm25 ranking, along with a snippet and a highlighted copy of
+    each one's content (which aren't escaped yet; see mark_matches). the page of ids
+    is found first so that the snippets and highlights are only computed for the
+    messages that are returned instead of for every match. the search and filters
+    work the same way as in the message_search query. rows are the Message.db_select
+    fields followed by the rank, the snippet, and the highlight. placeholders: the
+    search, the conversation and the sender (if used), the rank and id from the
+    cursor (if used), the limit, and the search again."""
+    table, column = SEARCH_INDEXES[index]
+    where = WhereClause()
+    where.add(f"{table} match ?")
+    if in_conversation:
+        where.add("messages.conversation=?")
+    if by_sender:
+        where.add("messages.sender=?")
+    if after_cursor:
+        where.add(f"({table}.rank, {table}.rowid) > (?, ?)")
+    join = ""
+    if in_conversation or by_sender:
+        join = f"join messages on messages.id = {table}.rowid"
+    marks = f"'{HIGHLIGHT_START}', '{HIGHLIGHT_END}'"
+    return f"""with page as (
+            select {table}.rowid, {table}.rank
+            from {table} {join}
+            {where}
+            order by {table}.rank, {table}.rowid
+            limit ?
+        )
+        select messages.sent_time, messages.conversation, messages.content,
+            messages.sender, messages.id, messages.html_content, page.rank,
+            snippet({table}, {column}, {marks}, '…', 16),
+            highlight({table}, {column}, {marks})
+        from page
+        cross join {table}
+        cross join messages
+        where {table} match ?
+            and {table}.rowid = page.rowid
+            and messages.id = page.rowid
+        order by page.rank, page.rowid;"""
+
+
+# how each way of traversing the timeline bounds its page: whether the lower and
+# upper bounds are the time that was passed in or the time of the message that is
+# some number of messages away from it, and if so, which messages are counted
+TIMELINE_BOUNDS: Final = {
+    "after": (None, ("sent_time > ?", "asc")),
+    "before": (("sent_time < ?", "desc"), None),
+    "at": (("sent_time <= ?", "desc"), ("sent_time > ?", "asc")),
+}
+
+
+@READ_QUERIES.shape(
+    "timeline",
+    paginated=True,
+    in_conversation=(False, True),
+    by_user=(False, True),
+    direction=tuple(TIMELINE_BOUNDS.keys()),
+)
+def timeline_query(in_conversation: bool, by_user: bool, direction: str) -> str:
+    """selects a page of messages and conversation events from the timeline table in
+    chronological order, optionally only those in one conversation and/or only
+    involving one user. each bound of the page is either the time being traversed
+    from or the time of the message some number of messages away from it, which is
+    found with a subquery on the messages table; that way, every page has the same
+    number of messages in it no matter how many events are mixed in. the rows are
+    (kind, time, conversation, user, item, message content, new conversation name,
+    added_by). placeholders: the conversation and the user (if used), then for each
+    bound either the time or the conversation, the user, the time, and the number of
+    messages to skip."""
+
+    def message_time(condition: str, order: str, default: str) -> str:
+        where = WhereClause()
+        if in_conversation:
+            where.add("conversation=?")
+        if by_user:
+            where.add("sender=?")
+        where.add(condition)
+        return f"""coalesce(
+            (select sent_time from messages {where}
+                order by sent_time {order} limit 1 offset ?),
+            '{default}'
+        )"""
+
+    lower, upper = TIMELINE_BOUNDS[direction]
+    where = WhereClause()
+    if in_conversation:
+        where.add("timeline.conversation=?")
+    if by_user:
+        where.add("timeline.user=?")
+    if lower:
+        where.add(f"timeline.time >= {message_time(*lower, EARLIEST_TIME)}")
+    else:
+        where.add("timeline.time > ?")
+    if upper:
+        where.add(f"timeline.time <= {message_time(*upper, LATEST_TIME)}")
+    else:
+        where.add("timeline.time < ?")
+    return f"""select timeline.kind, timeline.time, timeline.conversation,
+            timeline.user, timeline.item, messages.content, messages.html_content,
+            name_updates.new_name, participants.added_by
+        from timeline
+        left join messages
+            on timeline.kind = 'message' and messages.id = timeline.item
+        left join name_updates
+            on timeline.kind = 'name_update' and name_updates.rowid = timeline.item
+        left join participants
+            on timeline.kind = 'join' and participants.rowid = timeline.item
+        {where}
+        order by timeline.time, timeline.rowid;"""
+
+
+@READ_QUERIES.shape("message_by_id")
+def message_by_id_query() -> str:
+    return Message.db_select + " where id=?;"
+
+
+@READ_QUERIES.shape("message_timestamp_by_id")
+def message_timestamp_query() -> str:
+    return "select sent_time from messages where id=?;"
+
+
+@READ_QUERIES.shape("message_count")
+def message_count_query() -> str:
+    return "select max(position) from message_positions;"
+
+
+@READ_QUERIES.shape("messages_at_positions", count=(1, MESSAGES_PER_PAGE))
+def messages_at_positions_query(count: int) -> str:
+    return f"""{Message.db_select} where id in (select message from message_positions
+        where position in ({placeholder_list(count)}));"""
+
+
+@READ_QUERIES.shape("user_avatar")
+def user_avatar_query() -> str:
+    return "select avatar, avatar_extension from users where id=?;"
+
+
+@READ_QUERIES.shape(
+    "global_stats", allowed_scans=("conversations", "users", "messages")
+)
+def global_stats_query() -> str:
+    # counting rows means visiting all of them, but this is only run once per
+    # connection
+    return """select
+        (select count() from conversations) as number_of_conversations,
+        (select count() from users) as number_of_users,
+        (select count() from messages) as number_of_messages,
+        (select min(first_time) from conversations) as earliest_message,
+        (select max(last_time) from conversations) as latest_message;"""
+
+
+@READ_QUERIES.shape("daily_activity")
+def daily_activity_query() -> str:
+    return """select day, messages from daily_activity where kind=? and item=?
+        order by day;"""
+
+
+@READ_QUERIES.shape("weekly_activity")
+def weekly_activity_query() -> str:
+    return """select hour, messages from weekly_activity where kind=? and item=?;"""
+
+
+def annotations_path(db_path: PathLike) -> str:
+    """returns where the annotations database for an archive is kept: next to it, as
+    [name].annotations.db, or, for in-memory databases, in another in-memory
+    database with a related name."""
+    db_path = str(db_path)
+    if db_path == ":memory:":
+        return db_path
+    if "mode=memory" in db_path:
+        name, _, options = db_path.partition("?")
+        return f"{name}-annotations?{options}"
+    return str(Path(db_path).with_suffix(".annotations.db"))
+
+
+def attach_annotations(connection: sqlite3.Connection, path: PathLike) -> None:
+    """attaches the annotations database at path to a connection as "annotations",
+    creating its tables if they don't exist yet, along with the temporary view that
+    group chats' participant names are derived from. see annotations.sql."""
+    connection.execute("attach database ? as annotations;", (str(path),))
+    with open(SQL_SCRIPTS_PATH / "annotations.sql") as script:
+        connection.executescript(script.read())
+
+
+def refresh_participant_names(
+    connection: sqlite3.Connection, user_ids: list[int]
+) -> None:
+    """rederives the participant names of the group chats that any of the given
+    users are in, after their nicknames or twitter names have changed, and saves them
+    in the annotations database, where they take precedence over the names that were
+    derived when the archive was finalized."""
+    connection.execute(
+        f"""insert into annotations.conversation_annotations
+                (conversation_id, participant_names)
+            select names.conversation, names.participant_names
+            from group_participant_names as names
+            where names.conversation in (
+                select conversation from participants
+                where participant in ({placeholder_list(len(user_ids))})
+            )
+            on conflict (conversation_id) do update
+                set participant_names=excluded.participant_names;""",
+        user_ids,
+    )
 
 
 class TwitterDataReader(sqlite3.Connection):
@@ -548,37 +1269,96 @@ class TwitterDataReader(sqlite3.Connection):
     and the database."""
 
     def __init__(
-        self, db_path: PathLike, dm_media_path: Pathlike, group_media_path: Pathlike
+        self,
+        db_path: PathLike,
+        dm_media_path: Pathlike,
+        group_media_path: Pathlike,
+        max_cached_users: int = CACHED_USERS,
+        max_cached_conversations: int = CACHED_CONVERSATIONS,
+        max_cache_bytes: int = None,
+        max_cached_avatar_bytes: int = CACHED_AVATAR_BYTES,
+        read_only: bool = False,
+        share_caches_with: TwitterDataReader = None,
+        check_same_thread: bool = True,
+        immutable: bool = False,
+        annotations_db: PathLike = None,
     ):
         """Takes in the path to a database created by DBWrite and opens it for
-        querying."""
+        querying. The caches for user summaries and conversations hold up to
+        max_cached_users and max_cached_conversations objects and, if
+        max_cache_bytes is given, up to about that many bytes each; the avatar cache
+        holds up to max_cached_avatar_bytes of images. any limit can be None to leave
+        it out.
+
+        For use in a ReaderPool, a reader can be made read-only, can use the caches
+        of another reader (in which case the cache limits are ignored) instead of
+        creating its own, and can be allowed to be used from threads other than the
+        one that created it.
+
+        Nicknames and notes are written to a separate annotations database, which is
+        kept next to the archive unless another path is given. That means that the
+        archive itself can be opened as immutable, which lets sqlite skip locking it
+        and checking it for changes on every read and lets it be memory-mapped; only
+        do that if nothing else will write to the archive while it's open."""
+        if immutable and "mode=memory" not in str(db_path):
+            path = Path(db_path).resolve().as_uri() + "?mode=ro&immutable=1"
+        else:
+            path = db_path
         super(TwitterDataReader, self).__init__(
-            db_path, uri=("mode=memory" in str(db_path))
+            path,
+            uri=(immutable or "mode=memory" in str(db_path)),
+            check_same_thread=check_same_thread,
         )
         self.row_factory = sqlite3.Row
-        self.users_cache: dict[int, ArchivedUserSummary] = {}
-        self.conversations_cache: dict[str, Conversation] = {}
-
-        # this object maps user ids to the ids of any conversation that depends on
-        # them through the added_by, other_person, or name fields. this is so that
-        # the right items can be invalidated from the conversation cache when user
-        # data is changed.
-        self.user_data_in_conversations: dict[int, set[str]] = defaultdict(set)
-
-        Media.dm_media_path = dm_media_path
-        Media.group_media_path = group_media_path
+        if immutable:
+            self.execute(f"pragma main.mmap_size = {MMAP_SIZE};")
+        attach_annotations(self, annotations_db or annotations_path(db_path))
+        if read_only:
+            self.execute("pragma query_only = 1;")
+        if share_caches_with:
+            self.users_cache = share_caches_with.users_cache
+            self.conversations_cache = share_caches_with.conversations_cache
+            self.avatars_cache = share_caches_with.avatars_cache
+        else:
+            self.users_cache = LRUCache(max_cached_users, max_cache_bytes)
+            self.conversations_cache = LRUCache(
+                max_cached_conversations, max_cache_bytes
+            )
+            self.avatars_cache = LRUCache(
+                max_bytes=max_cached_avatar_bytes, sizeof=lambda x: len(x[0])
+            )
 
-    def cache_user_conversation_dependency(self, user: int, conversation: str):
-        """called in the Conversation.from_row method to register the fact that the
-        conversation object being instantiated depends on the data of a user; this is
-        used for cache invalidation when the user's data changes"""
-        self.user_data_in_conversations[user].add(conversation)
+        self.dm_media_path = dm_media_path
+        self.group_media_path = group_media_path
+
+    def get_cache_stats(self) -> dict:
+        """returns the size, hit, miss, and eviction counts of each cache."""
+        return {
+            "users": self.users_cache.stats(),
+            "conversations": self.conversations_cache.stats(),
+            "avatars": self.avatars_cache.stats(),
+        }
+
+    def clear_caches(self):
+        """empties every cache, for when the database was changed by another
+        process."""
+        self.users_cache.clear()
+        self.conversations_cache.clear()
+        self.avatars_cache.clear()
+
+    def get_data_version(self) -> tuple[int, int]:
+        """returns numbers that change whenever another connection commits a
+        change to the archive or the annotations database; see
+        https://www.sqlite.org/pragma.html#pragma_data_version."""
+        with set_row_mode(self, None):
+            return (
+                self.execute("pragma main.data_version;").fetchone()[0],
+                self.execute("pragma annotations.data_version;").fetchone()[0],
+            )
 
     def get_main_user(self):
         with set_row_mode(self, ArchivedUser.from_row):
-            return self.execute(
-                ArchivedUser.db_select + " where id=(select id from me);"
-            ).fetchone()
+            return self.execute(READ_QUERIES["main_user"]()).fetchone()
 
     def get_users_by_id(
         self, user_ids: Iterable[int], sidecar: bool = True
@@ -599,82 +1379,180 @@ class TwitterDataReader(sqlite3.Connection):
 
         if sidecar:
             for user_id in user_ids:
-                if user_id in self.users_cache:
-                    users.append(self.users_cache[user_id])
+                if user := self.users_cache.get(int(user_id)):
+                    users.append(user)
                 else:
                     uncached_ids.append(user_id)
         else:
             uncached_ids = user_ids
 
+        if not uncached_ids:
+            return users
+
+        generation = self.users_cache.generation
         with set_row_mode(self, user_class.from_row):
             uncached_users = self.execute(
-                user_class.db_select
-                + f" where id in ({', '.join(['?' for _ in range(len(uncached_ids))])});",
-                user_ids,
+                READ_QUERIES["users_by_id"](sidecar=sidecar, count=len(uncached_ids)),
+                uncached_ids,
             ).fetchall()
             if sidecar:
                 for user in uncached_users:
-                    self.users_cache[user.id] = user
+                    self.users_cache.put(int(user.id), user, generation)
             return users + uncached_users
 
+    def get_messages_from_rows(self, rows: list[tuple]) -> list[Message]:
+        """Turns rows selected with `Message.db_select` into Message objects,
+        retrieving the reactions and media for all of them with one query per table
+        instead of two queries per message."""
+        if not rows:
+            return []
+        message_ids = [x[4] for x in rows]
+        count = len(message_ids)
+        reactions = defaultdict(list)
+        media = defaultdict(list)
+        with set_row_mode(self, None):
+            cursor = self.execute(
+                READ_QUERIES["reactions_for_messages"](count=count), message_ids
+            )
+            for row in cursor.fetchall():
+                reactions[row[4]].append(Reaction.from_row(cursor, row))
+            cursor = self.execute(
+                READ_QUERIES["media_for_messages"](count=count), message_ids
+            )
+            for row in cursor.fetchall():
+                media[row[2]].append(Media.from_row(cursor, row))
+        return [
+            Message.from_row_and_attachments(x, reactions[x[4]], media[x[4]])
+            for x in rows
+        ]
+
     def get_users_by_message_count(
-        self, page_number: int, conversation_id: str = None
-    ):
-        if conversation_id:
-            with set_row_mode(self, ArchivedParticipant.from_row):
-                return self.execute(
-                    ArchivedParticipant.db_select
-                    + " order by participants.messages_sent desc limit ? offset ?;",
-                    (
-                        conversation_id,
-                        USERS_PER_PAGE,
-                        (page_number - 1) * USERS_PER_PAGE,
-                    ),
-                ).fetchall()
-        else:
-            with set_row_mode(self, ArchivedUser.from_row):
-                return self.execute(
-                    ArchivedUser.db_select
-                    + " order by number_of_messages desc limit ? offset ?;",
-                    (USERS_PER_PAGE, (page_number - 1) * USERS_PER_PAGE),
-                ).fetchall()
+        self, page_number: int = 1, conversation_id: str = None, cursor: str = None
+    ) -> Page[ArchivedUser]:
+        """Retrieves `USERS_PER_PAGE` users ordered by how many messages they have
+        sent, either in total or in a specific conversation (in which case the users
+        are ArchivedParticipants.) Pages can be requested either by number or by
+        passing in the `cursor` of the previous page, which is cheaper for pages far
+        from the start because it doesn't have to skip over the previous ones."""
+        row_factory = (
+            ArchivedParticipant.from_row if conversation_id else ArchivedUser.from_row
+        )
+        with set_row_mode(self, row_factory):
+            users = self.users_by_message_count_cursor(
+                page_number, conversation_id, cursor, False
+            ).fetchall()
+        next_cursor = None
+        if len(users) == USERS_PER_PAGE:
+            last = users[-1]
+            next_cursor = encode_cursor(
+                last.messages_in_conversation
+                if conversation_id
+                else last.number_of_messages,
+                int(last.id),
+            )
+        return Page(users, next_cursor)
+
+    def get_users_by_message_count_json(
+        self, page_number: int = 1, conversation_id: str = None, cursor: str = None
+    ) -> str:
+        """Works like `get_users_by_message_count`, but has the database build the
+        json for the users and returns the json for the whole page, which can be sent
+        as a response as-is."""
+        with set_row_mode(self, None):
+            rows = self.users_by_message_count_cursor(
+                page_number, conversation_id, cursor, True
+            ).fetchall()
+        next_cursor = None
+        if len(rows) == USERS_PER_PAGE:
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][2])
+        return page_json((x[0] for x in rows), next_cursor)
+
+    def users_by_message_count_cursor(
+        self, page_number: int, conversation_id: str, cursor: str, as_json: bool
+    ) -> sqlite3.Cursor:
+        """runs the query behind get_users_by_message_count and its json version."""
+        placeholders = [conversation_id] if conversation_id else []
+        if cursor:
+            placeholders += decode_cursor(cursor)
+        offset = 0 if cursor else (page_number - 1) * USERS_PER_PAGE
+        return self.execute(
+            READ_QUERIES["users_by_message_count"](
+                in_conversation=bool(conversation_id),
+                after_cursor=bool(cursor),
+                as_json=as_json,
+            ),
+            placeholders + [USERS_PER_PAGE, offset],
+        )
+
+    def uncache_user(self, user_id: Union[str, int]) -> list:
+        """Removes a user and the conversations that embed their data from the
+        caches; returns the ids of those conversations, whether or not they were
+        cached, so that clients can refresh their copies too. Conversations embed
+        the users in their other_person and added_by fields, and the user's name can
+        be part of the name of any unnamed group chat they're in."""
+        with set_row_mode(self, None):
+            conversations = set(
+                x[0]
+                for x in self.execute(
+                    READ_QUERIES["conversations_embedding_user"](),
+                    (int(user_id),) * 3,
+                )
+            )
+        for conversation in conversations:
+            self.conversations_cache.pop(conversation, None)
+        self.users_cache.pop(int(user_id), None)
+        self.avatars_cache.pop(int(user_id), None)
+        return list(conversations)
 
     def set_user_nickname(self, user_id: Union[str, int], new_nickname: str) -> list:
         self.execute(
-            "update users set nickname=? where id=?;",
-            (new_nickname[0:50], int(user_id)),
+            """insert into annotations.user_annotations (user_id, nickname)
+                values (?, ?)
+                on conflict (user_id) do update set nickname=excluded.nickname;""",
+            (int(user_id), new_nickname[0:50]),
         )
-        for conversation in self.user_data_in_conversations[int(user_id)]:
-            self.conversations_cache.pop(conversation, None)
-        self.users_cache.pop(int(user_id), None)
+        refresh_participant_names(self, [int(user_id)])
         self.commit()
-        return list(self.user_data_in_conversations[int(user_id)])
+        return self.uncache_user(user_id)
 
     def set_user_notes(self, user_id: Union[str, int], new_notes: str) -> None:
         """this does not invalidate anything in the conversations cache because
         nothing in a conversation object uses the user's notes, currently"""
         self.execute(
-            "update users set notes=? where id=?;",
-            (new_notes, int(user_id)),
+            """insert into annotations.user_annotations (user_id, notes)
+                values (?, ?)
+                on conflict (user_id) do update set notes=excluded.notes;""",
+            (int(user_id), new_notes),
         )
         self.users_cache.pop(int(user_id), None)
         self.commit()
 
-    def get_user_avatar(self, id: Union[int, str]) -> bytes:
-        """Retrieves user avatar image file as bytes."""
-        return self.execute(
-            "select avatar, avatar_extension from users where id=?;", (id,)
-        ).fetchone()
+    def get_user_avatar(
+        self, id: Union[int, str]
+    ) -> Union[tuple[bytes, str, str], None]:
+        """Retrieves a user's avatar as (the image file's bytes, its extension, an
+        etag made from a hash of the bytes), or None if there isn't one. Avatars are
+        kept in a cache, since the same few show up on every page."""
+        if avatar := self.avatars_cache.get(int(id)):
+            return avatar
+        generation = self.avatars_cache.generation
+        row = self.execute(READ_QUERIES["user_avatar"](), (int(id),)).fetchone()
+        if not row or row[0] is None:
+            return None
+        etag = hashlib.blake2b(row[0], digest_size=16).hexdigest()
+        avatar = (row[0], row[1], f'"{etag}"')
+        self.avatars_cache.put(int(id), avatar, generation)
+        return avatar
 
     def get_conversations(
         self,
         group: bool,
         individual: bool,
-        order_by: str,
+        sort: str,
         page_number: int = 1,
-        where: str = "",
-        placeholders: Iterable = [],
-    ) -> list[Conversation]:
+        cursor: str = None,
+        user_id: Union[str, int] = None,
+    ) -> Page[Conversation]:
         """Generalized conversation record retrieval method.
 
         Arguments:
@@ -682,37 +1560,82 @@ class TwitterDataReader(sqlite3.Connection):
                 conversations.
             individual: boolean indicating whether to retrieve records for individual
                 conversations.
-            order_by: order by clause in sql indicating how to sort the results.
-                examples: "order by first_time asc", "order by number_of_messages desc"
+            sort: one of the keys of `CONVERSATION_SORTS`, which determines the order
+                of the results.
             page_number: indicates what page we are on. page numbers start at 1;
                 pages contain `CONVERSATIONS_PER_PAGE` conversations.
-            where: optional string containing sql statements that will be
-                added to the default where conditions with an "and".
-            placeholders: optional iterable containing values corresponding to any ?s
-                in the previous two sql strings
+            cursor: the `cursor` of the previous page; if this is given, page_number
+                is ignored and the page after that one is returned. this is cheaper
+                than using page numbers, since the database can seek straight to the
+                right spot in an index instead of skipping over the previous pages.
+            user_id: the user whose conversations are being retrieved, for the
+                "messages_from_user" sort.
         """
-        type_clause = WhereClause()
-        if group and individual:
-            pass
-        elif group:
-            type_clause.add("type='group'")
-        elif individual:
-            type_clause.add("type='individual'")
-        else:
-            return []
-        type_clause.add(where)
-        placeholders = list(placeholders) + [
-            CONVERSATIONS_PER_PAGE,
-            CONVERSATIONS_PER_PAGE * (page_number - 1),
-        ]
-        with set_row_mode(self, Conversation.from_row):
-            return self.execute(
-                Conversation.db_select + f" {type_clause} "
-                f" {order_by} "
-                f"limit ? "
-                f"offset ?;",
-                placeholders,
+        if not (group or individual):
+            return Page()
+        rows, next_cursor = self.get_conversation_rows(
+            group, individual, sort, page_number, cursor, user_id, False
+        )
+        return Page(self.get_conversations_from_rows(rows), next_cursor)
+
+    def get_conversations_json(
+        self,
+        group: bool,
+        individual: bool,
+        sort: str,
+        page_number: int = 1,
+        cursor: str = None,
+        user_id: Union[str, int] = None,
+    ) -> str:
+        """Works like `get_conversations`, but has the database build the json for
+        the conversations and the users embedded in them instead of creating
+        Conversation objects, and returns the json for the whole page, which can be
+        sent as a response as-is. Skips the conversation and user caches."""
+        if not (group or individual):
+            return page_json([], None)
+        rows, next_cursor = self.get_conversation_rows(
+            group, individual, sort, page_number, cursor, user_id, True
+        )
+        return page_json((x[1] for x in rows), next_cursor)
+
+    def get_conversation_rows(
+        self,
+        group: bool,
+        individual: bool,
+        sort: str,
+        page_number: int,
+        cursor: str,
+        user_id: Union[str, int],
+        as_json: bool,
+    ) -> tuple[list[tuple], Union[str, None]]:
+        """runs the query behind get_conversations and its json version and returns
+        its rows and the cursor for the next page."""
+        placeholders = [int(user_id)] if sort == "messages_from_user" else []
+        if cursor:
+            placeholders += decode_cursor(cursor)
+        offset = 0 if cursor else CONVERSATIONS_PER_PAGE * (page_number - 1)
+        with set_row_mode(self, None):
+            rows = self.execute(
+                READ_QUERIES["conversations"](
+                    group=group,
+                    individual=individual,
+                    sort=sort,
+                    after_cursor=bool(cursor),
+                    as_json=as_json,
+                ),
+                placeholders + [CONVERSATIONS_PER_PAGE, offset],
             ).fetchall()
+        next_cursor = None
+        if len(rows) == CONVERSATIONS_PER_PAGE:
+            next_cursor = encode_cursor(rows[-1][-1], rows[-1][0])
+        return rows, next_cursor
+
+    def get_conversations_from_rows(self, rows: list[tuple]) -> list[Conversation]:
+        """Turns rows selected with `Conversation.db_select` into Conversation
+        objects, retrieving the users that they reference with one query."""
+        user_ids = set(y for x in rows for y in (x[9], x[10]) if y)
+        users = {int(x.id): x for x in self.get_users_by_id(user_ids)}
+        return [Conversation.from_row_and_users(x, users) for x in rows]
 
     def get_conversations_by_time(
         self,
@@ -720,7 +1643,8 @@ class TwitterDataReader(sqlite3.Connection):
         asc: bool = True,
         group: bool = True,
         individual: bool = True,
-    ) -> list[Conversation]:
+        cursor: str = None,
+    ) -> Page[Conversation]:
         """Retrieves `CONVERSATIONS_PER_PAGE` conversations ordered by when their most
         or least recent messages were sent. Most of the arguments are passed on to
         `ArchiveAccess.DBRead.TwitterDataReader.get_conversations`, except for:
@@ -731,8 +1655,8 @@ class TwitterDataReader(sqlite3.Connection):
                 sorted by their newest message, with the newest first.
 
         """
-        order_by = f"order by {'first_time asc' if asc else 'last_time desc'}"
-        return self.get_conversations(group, individual, order_by, page_number)
+        sort = "first_time" if asc else "last_time"
+        return self.get_conversations(group, individual, sort, page_number, cursor)
 
     def get_conversations_by_message_count(
         self,
@@ -740,7 +1664,8 @@ class TwitterDataReader(sqlite3.Connection):
         group: bool = True,
         individual: bool = True,
         by_me: bool = False,
-    ) -> list[Conversation]:
+        cursor: str = None,
+    ) -> Page[Conversation]:
         """Retrieves `CONVERSATIONS_PER_PAGE` conversations ordered by how many
         messages were sent in them or by how many messages were sent in them by you.
         Most of the arguments are passed on to
@@ -751,45 +1676,47 @@ class TwitterDataReader(sqlite3.Connection):
                 you are presented first; if it's false, the conversations with the most
                 messages period are presented first.
         """
-        order_by = (
-            f"order by {'messages_from_you' if by_me else 'number_of_messages'} desc"
-        )
-        return self.get_conversations(group, individual, order_by, page_number)
+        sort = "messages_from_you" if by_me else "number_of_messages"
+        return self.get_conversations(group, individual, sort, page_number, cursor)
 
     def get_conversations_by_user(
-        self, user_id: Union[str, int], page_number: int
-    ) -> list[Conversation]:
+        self, user_id: Union[str, int], page_number: int = 1, cursor: str = None
+    ) -> Page[Conversation]:
         """returns the conversations that a specific user has appeared in, sorted by
         the number of messages they have sent in each conversation highest to
         lowest."""
 
-        order_by = """order by
-                (select messages_sent from participants
-                where participant=? and conversation=conversations.id)
-                desc"""
-        where_clause = f"""id in (select conversation from participants where
-                        participant=?)"""
         return self.get_conversations(
-            True, True, order_by, page_number, where_clause, (user_id, user_id)
+            True, True, "messages_from_user", page_number, cursor, user_id
         )
 
     def get_conversation_by_id(self, conversation_id: str) -> Conversation:
         """Retrieves the record for a specific conversation with a specific id."""
-        if conversation_id in self.conversations_cache:
-            return self.conversations_cache[conversation_id]
-        else:
-            c = self.get_conversations(True, True, "", 1, "id=?", [conversation_id])[
-                0
-            ]
-            self.conversations_cache[conversation_id] = c
-            return c
+        return self.get_conversations_by_id([conversation_id])[0]
 
     def get_conversations_by_id(
         self, conversation_ids: Iterable[str]
     ) -> list[Conversation]:
-        # this might be slightly faster using an in clause like get_user_by_id; not
-        # sure
-        return [self.get_conversation_by_id(x) for x in conversation_ids]
+        """Retrieves the records for a set of conversations, in the order their ids
+        were given in, loading any that aren't cached with one query."""
+        conversation_ids = list(conversation_ids)
+        conversations = {
+            x: conversation
+            for x in conversation_ids
+            if (conversation := self.conversations_cache.get(x))
+        }
+        uncached_ids = [x for x in conversation_ids if x not in conversations]
+        if uncached_ids:
+            generation = self.conversations_cache.generation
+            with set_row_mode(self, None):
+                rows = self.execute(
+                    READ_QUERIES["conversations_by_id"](count=len(uncached_ids)),
+                    uncached_ids,
+                ).fetchall()
+            for conversation in self.get_conversations_from_rows(rows):
+                self.conversations_cache.put(conversation.id, conversation, generation)
+                conversations[conversation.id] = conversation
+        return [conversations[x] for x in conversation_ids]
 
     def get_conversation_names(
         self, conversation_id: str, oldest_first=True, page_number: int = 1
@@ -798,10 +1725,7 @@ class TwitterDataReader(sqlite3.Connection):
         has had."""
         with set_row_mode(self, NameUpdate.from_row):
             names = self.execute(
-                f"""{NameUpdate.db_select}
-                where conversation=?
-                order by update_time {'asc' if oldest_first else 'desc'}
-                limit ? offset ?;""",
+                READ_QUERIES["conversation_names"](oldest_first=oldest_first),
                 (
                     conversation_id,
                     CONVERSATION_NAMES_PER_PAGE,
@@ -813,10 +1737,28 @@ class TwitterDataReader(sqlite3.Connection):
         )
         return {"results": names, "users": users}
 
+    def get_conversation_names_json(
+        self, conversation_id: str, oldest_first=True, page_number: int = 1
+    ) -> str:
+        """Works like `get_conversation_names`, but returns the json for the
+        response, which is built entirely by the database."""
+        with set_row_mode(self, None):
+            return self.execute(
+                READ_QUERIES["conversation_names_json"](oldest_first=oldest_first),
+                (
+                    conversation_id,
+                    CONVERSATION_NAMES_PER_PAGE,
+                    CONVERSATION_NAMES_PER_PAGE * (page_number - 1),
+                ),
+            ).fetchone()[0]
+
     def set_conversation_notes(self, conversation_id: str, notes: str) -> None:
         """Updates a conversation's notes field. hooray"""
         self.execute(
-            "update conversations set notes=? where id=?;", (notes, conversation_id)
+            """insert into annotations.conversation_annotations (conversation_id, notes)
+                values (?, ?)
+                on conflict (conversation_id) do update set notes=excluded.notes;""",
+            (conversation_id, notes),
         )
         self.conversations_cache.pop(conversation_id, None)
         self.commit()
@@ -841,6 +1783,262 @@ class TwitterDataReader(sqlite3.Connection):
             ) + search_comps[-1].translate(escaper)
         return parsed_search.replace('""', '" "')
 
+    def search_settings(self) -> tuple[str, bool]:
+        """returns the TEXT_SEARCH_MODES key that the archive's word index was
+        created with and whether the archive has a substring index. these are fixed
+        when the archive is imported, so they're only looked up once."""
+        if not hasattr(self, "search_settings_cache"):
+            with set_row_mode(self, None):
+                mode, has_substring_index = self.execute(
+                    READ_QUERIES["search_settings"]()
+                ).fetchone()
+            self.search_settings_cache = (mode, bool(has_substring_index))
+        return self.search_settings_cache
+
+    def search_index(self, search: str, substring: bool = False) -> str:
+        """picks which of the SEARCH_INDEXES a search should use: the substring
+        index if it was asked for or if the search is in a language that isn't
+        written with spaces between words and is long enough for the substring index
+        to look up (and the archive has one), and the word index otherwise. raises a ValueError if the substring index was asked for but
+        the archive was imported without it."""
+        _, has_substring_index = self.search_settings()
+        if substring and not has_substring_index:
+            raise ValueError("this archive was imported without substring search")
+        if has_substring_index and (
+            substring
+            or (
+                UNSPACED_SCRIPTS.search(search)
+                and len(search.strip()) >= SUBSTRING_SEARCH_MIN_LENGTH
+            )
+        ):
+            return "substring"
+        return "words"
+
+    def search_match(
+        self, search: str, conversation: str = "", user: str = "", index="words"
+    ) -> str:
+        """turns a search from a user into an fts5 query for one of the
+        SEARCH_INDEXES.
+
+        for the word index, the query only matches message content and, if
+        conversation and/or user are given, only matches messages in that
+        conversation and/or from that user. the filters are fts5 column filters on
+        the conversation and sender columns, which lets fts5 intersect the content
+        matches with the messages that pass them using the full text index instead of
+        checking each match against the messages table. what the query can do
+        depends on which of the TEXT_SEARCH_MODES the archive's word index was
+        created with: without phrases, the words in phrases are searched for
+        separately, and without indexed filter columns, the query only has the
+        search in it (and the filters are left to the sql.)
+
+        for the substring index, the whole search is one phrase, which matches any
+        message that contains it anywhere (ignoring case); the trigram tokenizer can
+        only look up phrases that are at least three characters long, so a ValueError
+        is raised for shorter ones."""
+        if index == "substring":
+            phrase = search.strip()
+            if len(phrase) < SUBSTRING_SEARCH_MIN_LENGTH:
+                raise ValueError("substring searches need at least 3 characters")
+            return '"' + phrase.replace('"', '""') + '"'
+        mode, _ = self.search_settings()
+        filter_columns, phrases, _ = TEXT_SEARCH_MODES[mode]
+        parsed_search = self.parse_search(search)
+        if not phrases:
+            parsed_search = parsed_search.replace('"', " ")
+        if not filter_columns:
+            return parsed_search
+        match = f"content : ({parsed_search})"
+        for column, value in (("conversation", conversation), ("sender", user)):
+            if value:
+                if phrases:
+                    escaped = str(value).replace('"', '""')
+                    match += f' AND {column} : "{escaped}"'
+                else:
+                    # the ids' parts can still be looked up as separate words
+                    words = re.findall(r"\w+", str(value))
+                    match += f" AND {column} : ({' '.join(words)})"
+        return match
+
+    def search_messages(
+        self,
+        conversation: str,
+        user: str,
+        after: str,
+        before: str,
+        at: str,
+        search: str,
+        substring: bool = False,
+    ) -> list[Message]:
+        """returns a page of messages that match a search, in chronological order;
+        see `traverse_messages`."""
+        index = self.search_index(search, substring)
+        placeholders = [self.search_match(search, conversation, user, index)]
+        if conversation:
+            placeholders.append(conversation)
+        if user:
+            placeholders.append(int(user))
+        search_query = partial(
+            READ_QUERIES["message_search"],
+            index=index,
+            in_conversation=bool(conversation),
+            by_sender=bool(user),
+        )
+
+        with set_row_mode(self, None):
+            if at:
+                batch_size = int(MESSAGES_PER_PAGE / 2)
+                rows = self.execute(
+                    search_query(time_bound="<=", descending=True),
+                    placeholders + [at, batch_size],
+                ).fetchall()
+                rows += self.execute(
+                    search_query(time_bound=">", descending=False),
+                    placeholders + [at, batch_size],
+                ).fetchall()
+            else:
+                time_bound = None
+                if before:
+                    descending = True
+                    if before != "end":
+                        time_bound = "<"
+                        placeholders.append(before)
+                elif after:
+                    descending = False
+                    if after != "beginning":
+                        time_bound = ">"
+                        placeholders.append(after)
+                rows = self.execute(
+                    search_query(time_bound=time_bound, descending=descending),
+                    placeholders + [MESSAGES_PER_PAGE],
+                ).fetchall()
+
+        messages = self.get_messages_from_rows(rows)
+        messages.sort(key=lambda x: x.sort_by_timestamp)
+        return messages
+
+    def read_timeline(
+        self, conversation: str, user: str, after: str, before: str, at: str
+    ) -> list[MessageLike]:
+        """returns a page of messages and the conversation events that happened
+        between them, in chronological order, from the timeline table; see
+        `traverse_messages`. the whole page is read with one query, plus the ones
+        that `get_messages_from_rows` uses to get the messages' attachments."""
+        filters = []
+        if conversation:
+            filters.append(conversation)
+        if user:
+            filters.append(int(user))
+
+        if at:
+            direction, start, skip = "at", at, int(MESSAGES_PER_PAGE / 2) - 1
+        elif after:
+            direction, skip = "after", MESSAGES_PER_PAGE - 1
+            start = EARLIEST_TIME if after == "beginning" else after
+        else:
+            direction, skip = "before", MESSAGES_PER_PAGE - 1
+            start = LATEST_TIME if before == "end" else before
+        placeholders = list(filters)
+        for bound in TIMELINE_BOUNDS[direction]:
+            placeholders += filters + [start, skip] if bound else [start]
+
+        with set_row_mode(self, None):
+            rows = self.execute(
+                READ_QUERIES["timeline"](
+                    in_conversation=bool(conversation),
+                    by_user=bool(user),
+                    direction=direction,
+                ),
+                placeholders,
+            ).fetchall()
+
+        messages = iter(
+            self.get_messages_from_rows(
+                [
+                    (time, convo, content, user_id, item, html_content)
+                    for (
+                        kind, time, convo, user_id, item, content, html_content, *_
+                    ) in rows
+                    if kind == "message"
+                ]
+            )
+        )
+        results = []
+        for kind, time, convo, user_id, item, _, _, new_name, added_by in rows:
+            if kind == "message":
+                results.append(next(messages))
+            elif kind == "name_update":
+                results.append(
+                    NameUpdate.from_row(None, (item, time, user_id, new_name, convo))
+                )
+            elif kind == "join":
+                results.append(
+                    ParticipantJoin.from_row(
+                        None, (item, user_id, added_by, convo, time)
+                    )
+                )
+            elif kind == "leave":
+                results.append(
+                    ParticipantLeave.from_row(None, (item, user_id, convo, time))
+                )
+        return results
+
+    def search_by_relevance(
+        self,
+        search: str,
+        conversation: str = "",
+        user: str = "",
+        cursor: str = None,
+        substring: bool = False,
+    ) -> dict[str, list]:
+        """Retrieves `MESSAGES_PER_PAGE` messages that match a search, ordered from
+        the best match to the worst instead of chronologically. Each message comes
+        with a SearchHighlight (in the "highlights" list) that has its rank and the
+        matching words marked in its content; the returned "cursor" can be passed
+        back in to get the next page, and is None after the last page. substring
+        works the same way as it does for `traverse_messages`."""
+        index = self.search_index(search, substring)
+        search = self.search_match(search, conversation, user, index)
+        placeholders = [search]
+        if conversation:
+            placeholders.append(conversation)
+        if user:
+            placeholders.append(int(user))
+        if cursor:
+            placeholders += decode_cursor(cursor)
+        placeholders += [MESSAGES_PER_PAGE, search]
+
+        with set_row_mode(self, None):
+            rows = self.execute(
+                READ_QUERIES["ranked_search"](
+                    index=index,
+                    in_conversation=bool(conversation),
+                    by_sender=bool(user),
+                    after_cursor=bool(cursor),
+                ),
+                placeholders,
+            ).fetchall()
+
+        messages = self.get_messages_from_rows([x[:6] for x in rows])
+        highlights = [SearchHighlight.from_row(None, (x[4], *x[6:])) for x in rows]
+        next_cursor = None
+        if len(rows) == MESSAGES_PER_PAGE:
+            next_cursor = encode_cursor(rows[-1][6], rows[-1][4])
+
+        users = self.get_users_by_id(
+            MessageLike.user_id_iterator((x.user_ids for x in messages))
+        )
+        conversations = self.get_conversations_by_id(
+            set(x.conversation for x in messages)
+        )
+
+        return {
+            "results": messages,
+            "highlights": highlights,
+            "users": users,
+            "conversations": conversations,
+            "cursor": next_cursor,
+        }
+
     def traverse_messages(
         self,
         conversation="",
@@ -849,12 +2047,15 @@ class TwitterDataReader(sqlite3.Connection):
         before: str = "",
         at: str = "",
         search: str = "",
+        substring: bool = False,
     ) -> dict[str, list]:
-
-        # these should probably be global variables somewhere. idk
-
-        zeroes_time_string = "0000-00-00T00:00:00.000Z"
-        nines_time_string = "9999-99-99T99:99:99.999Z"
+        """Retrieves `MESSAGES_PER_PAGE` messages, and the conversation events that
+        happened between them, in chronological order; see the /api/messages
+        endpoint in APIDoc.py for what the arguments mean. If substring is True,
+        the search finds messages that contain it anywhere, even in the middle of a
+        word, using the substring index; that's also used automatically for searches
+        in languages that aren't written with spaces if the archive has it. Raises a
+        ValueError for substring searches that can't be done."""
 
         assert (
             after or before or at
@@ -868,146 +2069,15 @@ class TwitterDataReader(sqlite3.Connection):
         assert (
             after == "beginning"
             or before == "end"
-            or zeroes_time_string <= (after or before or at) <= nines_time_string
+            or EARLIEST_TIME <= (after or before or at) <= LATEST_TIME
         )
 
-        where = WhereClause()
-        placeholders = []
-        if conversation:
-            where.add("conversation=?")
-            placeholders.append(conversation)
-        if user:
-            where.add("sender=?")
-            placeholders.append(int(user))
-
-        if search:
-            where.add(
-                "messages_text_search MATCH '" + self.parse_search(search) + "'"
+        if search:  # conversation events not included in searches
+            messages = self.search_messages(
+                conversation, user, after, before, at, search, substring
             )
-            select = Message.db_select_for_search
         else:
-            select = Message.db_select
-
-        at_last_page = False
-        at_first_page = False
-
-        with set_row_mode(self, Message.from_row):
-            if at:
-                first_where = where
-                second_where = deepcopy(where)
-                first_where.add("sent_time <= ?")
-                second_where.add("sent_time > ?")
-
-                # `at` must be the last added placeholder so it can work for both
-                # versions of the where clause
-                placeholders.append(at)
-
-                batch_size = int(MESSAGES_PER_PAGE / 2)
-
-                first_batch = self.execute(
-                    f"""{select}
-                    {first_where}
-                    order by sent_time desc
-                    limit {batch_size};""",
-                    placeholders,
-                ).fetchall()
-
-                if len(first_batch) < batch_size:
-                    at_first_page = True
-
-                second_batch = self.execute(
-                    f"""{select}
-                    {second_where}
-                    order by sent_time asc
-                    limit {batch_size};""",
-                    placeholders,
-                ).fetchall()
-
-                if len(second_batch) < batch_size:
-                    at_last_page = True
-
-                messages = first_batch + second_batch
-
-            else:
-
-                if before:
-                    sort = "sent_time desc"
-                    if before != "end":
-                        where.add("sent_time < ?")
-                        placeholders.append(before)
-                elif after:
-                    sort = "sent_time asc"
-                    if after != "beginning":
-                        where.add("sent_time > ?")
-                        placeholders.append(after)
-                messages = self.execute(
-                    f"""{select}
-                        {where}
-                        order by {sort}
-                        limit {MESSAGES_PER_PAGE};""",
-                    placeholders,
-                ).fetchall()
-
-                if len(messages) < MESSAGES_PER_PAGE:
-                    if after:
-                        at_last_page = True
-                    elif before:
-                        at_first_page = True
-
-        if not search:  # conversation events not included in searches
-
-            if after == "beginning" or at_first_page:
-                sequence_start = zeroes_time_string
-            else:
-                sequence_start = after or min(x.sort_by_timestamp for x in messages)
-
-            if before == "end" or at_last_page:
-                sequence_end = nines_time_string
-            else:
-                sequence_end = before or max(x.sort_by_timestamp for x in messages)
-
-            with set_row_mode(self, NameUpdate.from_row):
-                name_where = WhereClause()
-                name_placeholders = []
-                if conversation:
-                    name_where.add("conversation=?")
-                    name_placeholders.append(conversation)
-                if user:
-                    name_where.add("initiator=?")
-                    name_placeholders.append(user)
-                name_where.add(f"{NameUpdate.timestamp_field} > ?")
-                name_placeholders.append(sequence_start)
-                name_where.add(f"{NameUpdate.timestamp_field} < ?")
-                name_placeholders.append(sequence_end)
-                messages += self.execute(
-                    NameUpdate.db_select + f" {name_where};", name_placeholders
-                )
-
-            joining_where = WhereClause()
-            joining_leaving_placeholders = []
-            if conversation:
-                joining_where.add("conversation=?")
-                joining_leaving_placeholders.append(conversation)
-            if user:
-                joining_where.add("participant=?")
-                joining_leaving_placeholders.append(user)
-            leaving_where = deepcopy(joining_where)
-            leaving_where.add("end_time > ? and end_time < ?")
-            joining_where.add("start_time > ? and start_time < ?")
-            joining_leaving_placeholders += [sequence_start, sequence_end]
-
-            with set_row_mode(self, ParticipantJoin.from_row):
-                messages += self.execute(
-                    ParticipantJoin.db_select + f" {joining_where};",
-                    joining_leaving_placeholders,
-                ).fetchall()
-            with set_row_mode(self, ParticipantLeave.from_row):
-                messages += self.execute(
-                    ParticipantLeave.db_select + f" {leaving_where};",
-                    joining_leaving_placeholders,
-                )
-
-        messages.sort(key=lambda x: x.sort_by_timestamp)
+            messages = self.read_timeline(conversation, user, after, before, at)
 
         users = self.get_users_by_id(
             MessageLike.user_id_iterator((x.user_ids for x in messages))
@@ -1020,51 +2090,83 @@ class TwitterDataReader(sqlite3.Connection):
 
     def get_message_by_id(self, id: int) -> dict[str, list]:
         with set_row_mode(self, Message.from_row):
-            message = self.execute(
-                Message.db_select + " where id=?;", (id,)
-            ).fetchone()
-            users = self.get_users_by_id(set(message.user_ids))
-            return {
-                "results": [message],
-                "users": users,
-                "conversation": [self.get_conversation_by_id(message.conversation)],
-            }
+            message = self.execute(READ_QUERIES["message_by_id"](), (id,)).fetchone()
+        users = self.get_users_by_id(set(message.user_ids))
+        return {
+            "results": [message],
+            "users": users,
+            "conversation": [self.get_conversation_by_id(message.conversation)],
+        }
 
     def get_message_timestamp_by_id(self, id: int) -> str:
         result = self.execute(
-            "select sent_time from messages where id=?;", (id,)
+            READ_QUERIES["message_timestamp_by_id"](), (id,)
         ).fetchone()
         if result:
             return result[0]
 
     def get_random_messages(self) -> dict[str, list]:
-        with set_row_mode(self, Message.from_row):
-            messages = self.execute(
-                Message.db_select
-                + " where id IN (SELECT id FROM messages ORDER BY RANDOM() LIMIT ?);",
-                (MESSAGES_PER_PAGE,),
-            ).fetchall()
-            users = self.get_users_by_id(
-                MessageLike.user_id_iterator((x.user_ids for x in messages))
+        """Picks `MESSAGES_PER_PAGE` different messages uniformly at random. Random
+        positions are chosen from the gapless numbering in the message_positions
+        table, so this takes the same amount of time no matter how many messages
+        there are. The database returns them in id order, so they're shuffled
+        afterwards."""
+        with set_row_mode(self, None):
+            count = self.execute(READ_QUERIES["message_count"]()).fetchone()[0]
+            positions = random.sample(
+                range(1, (count or 0) + 1), min(MESSAGES_PER_PAGE, count or 0)
             )
-            return {"results": messages, "users": users}
+            rows = self.execute(
+                READ_QUERIES["messages_at_positions"](count=len(positions)), positions
+            ).fetchall()
+        random.shuffle(rows)
+        messages = self.get_messages_from_rows(rows)
+        users = self.get_users_by_id(
+            MessageLike.user_id_iterator((x.user_ids for x in messages))
+        )
+        return {"results": messages, "users": users}
 
     def get_global_stats(self) -> dict:
         if not hasattr(self, "global_stats_cache"):
             with set_row_mode(self, sqlite3.Row):
                 self.global_stats_cache = dict(
-                    self.execute(
-                        """select 
-                        (select count() from conversations) as number_of_conversations,
-                        (select count() from users) as number_of_users,
-                        (select count() from messages) as number_of_messages,
-                        (select min(first_time) from conversations) as earliest_message,
-                        (select max(last_time) from conversations) as latest_message;
-                    """
-                    ).fetchone()
+                    self.execute(READ_QUERIES["global_stats"]()).fetchone()
                 )
         return self.global_stats_cache
 
+    def get_activity(self, conversation: str = None, user: int = None) -> dict:
+        """returns how many messages were sent in a conversation, by a user, or (if
+        neither is specified) in total on each day and in each hour of the week, from
+        the counts that were made when the database was finalized. to keep the
+        response small, the counts are plain lists: "daily" has one count for each
+        day starting from "first_day" (yyyy-mm-dd) and ending on the last day with
+        any messages, and "weekly" has 168 counts, one for each hour of the week
+        starting from midnight on sunday. days and hours are in utc."""
+        if conversation is not None:
+            key = ("conversation", conversation)
+        elif user is not None:
+            key = ("user", str(user))
+        else:
+            key = ("all", "")
+        with set_row_mode(self, None):
+            days = self.execute(READ_QUERIES["daily_activity"](), key).fetchall()
+            hours = self.execute(READ_QUERIES["weekly_activity"](), key).fetchall()
+        daily = []
+        if days:
+            first_day = date.fromisoformat(days[0][0])
+            last_day = date.fromisoformat(days[-1][0])
+            daily = [0] * ((last_day - first_day).days + 1)
+            for day, messages in days:
+                daily[(date.fromisoformat(day) - first_day).days] = messages
+        weekly = [0] * (7 * 24)
+        for hour, messages in hours:
+            weekly[hour] = messages
+        return {
+            "first_day": days[0][0] if days else None,
+            "daily": daily,
+            "weekly": weekly,
+        }
+
 
 if __name__ == "__main__":  # pragma: no cover
     source = TwitterDataReader("./db/test.db")
@@ -4,15 +4,52 @@ from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPClientError
 from tornado.ioloop import IOLoop
 import json
 import asyncio
+import html
 from collections import deque
 from typing import Union
 
 if __name__ == "__main__":  # pragma: no cover
     import JSONStream
+    from MediaDimensions import fill_media_dimensions
+    from DBRead import (
+        TEXT_SEARCH_MODES,
+        SQL_SCRIPTS_PATH,
+        annotations_path,
+        attach_annotations,
+        refresh_participant_names,
+    )
 else:
     from ArchiveAccess import JSONStream
-
-SQL_SCRIPTS_PATH = Path.cwd() / "SQLScripts"
+    from ArchiveAccess.MediaDimensions import fill_media_dimensions
+    from ArchiveAccess.DBRead import (
+        TEXT_SEARCH_MODES,
+        SQL_SCRIPTS_PATH,
+        annotations_path,
+        attach_annotations,
+        refresh_participant_names,
+    )
+
+
+def render_html_content(text: str, links: list[dict]) -> str:
+    """turns the text of a message into the html that the frontend displays:
+    everything is escaped, newlines become line breaks, and the shortened links
+    listed in the message's "urls" are replaced with <a> tags pointing to where they
+    really go (or removed, for the links to media that's attached to the message.)
+    twitter stores some characters in message text as html entities and others as-is,
+    so the text is unescaped first to avoid escaping those twice."""
+    html_content = html.escape(html.unescape(text)).replace("\n", "<br />")
+    for link in links:
+        if link["expanded"].startswith(
+            "https://twitter.com/messages/media/"
+        ) and link["display"].startswith("pic.twitter.com/"):
+            html_content = html_content.replace(link["url"], "")
+        else:
+            html_content = html_content.replace(
+                link["url"],
+                f'<a href="{html.escape(link["expanded"])}">'
+                f'{html.escape(link["display"])}</a>',
+            )
+    return html_content.strip()
 
 
 class SimpleTwitterAPIClient:
@@ -192,6 +229,40 @@ class SimpleTwitterAPIClient:
         self.http_client.close()
 
 
+def store_user_data(connection: Connection, user: dict):
+    """writes a dict containing data about a user from the twitter api, with the
+    'avatar_bytes' and 'avatar_extension' fields added by SimpleTwitterAPIClient, to
+    that user's row in the users table."""
+    connection.execute(
+        """update users 
+            set loaded_full_data=1, handle=?, display_name=?, bio=?, 
+            avatar=?, avatar_extension=? where id=?;""",
+        (
+            user["screen_name"],
+            user["name"],
+            user["description"],
+            user["avatar_bytes"],
+            user["avatar_extension"],
+            user["id"],
+        ),
+    )
+
+
+def create_text_search_index(connection: Connection, mode: str = "full"):
+    """creates the word index that messages are searched with, along with the
+    trigger that adds messages to it, in one of DBRead.TEXT_SEARCH_MODES; see
+    text_search.sql. this commits any transaction that the connection is in."""
+    filter_columns, _, options = TEXT_SEARCH_MODES[mode]
+    with open(SQL_SCRIPTS_PATH / "text_search.sql") as script:
+        connection.executescript(
+            script.read().format(
+                mode=mode,
+                filter_columns="" if filter_columns else "unindexed",
+                options=options,
+            )
+        )
+
+
 class TwitterDataWriter(Connection):
     """creates a database containing group and individual direct messages and
     associated data.
@@ -219,6 +290,20 @@ class TwitterDataWriter(Connection):
         added_messages: tracks the number of messages or other conversation events
             that have been added to the database. intended to be used by this object's
             owner for progress reports
+        dm_media_path: folder containing the archive's media files from individual
+            dms; used to measure the media during finalize. can be None.
+        group_media_path: same, but for group dms.
+        substring_search: whether finalize should build the optional trigram index
+            (see substring_search.sql) that lets messages be searched for parts of
+            words.
+        text_search_mode: which of DBRead.TEXT_SEARCH_MODES to create the word
+            index with; smaller indexes can't search for phrases or narrow searches
+            down to a conversation or sender by themselves.
+        annotations_db: where the archive's nicknames and notes are kept, if not in
+            the default place next to it (see DBRead.annotations_path.)
+        enrich_later: whether user data is going to be fetched after the import (see
+            TwitterUserEnricher) instead of with a bearer token passed in here, in
+            which case finalize doesn't say that it isn't being fetched.
     """
 
     def __init__(
@@ -228,11 +313,18 @@ class TwitterDataWriter(Connection):
         account_id,
         bearer_token,
         automatic_overwrite=False,
+        dm_media_path=None,
+        group_media_path=None,
+        substring_search=False,
+        text_search_mode="full",
+        annotations_db=None,
+        enrich_later=False,
     ):
         """creates a database file for an archive for a specific account, initializes
         it with a sql script that creates tables within it, begins our overall sql
         transaction, and saves the id of the account being archived in the
-        database."""
+        database. the archive's annotations database (see annotations.sql) is left
+        alone when the archive is overwritten, so nicknames and notes carry over."""
         db_path = Path(db_path)
         if (":memory:" not in str(db_path)) and ("mode=memory" not in str(db_path)):
             if db_path.exists():
@@ -244,8 +336,11 @@ class TwitterDataWriter(Connection):
                     == "y"
                 ):
                     db_path.unlink()
-                    if (prev_journal := Path(str(db_path) + "-journal")).exists():
-                        prev_journal.unlink()
+                    # the server's ReaderPool puts databases in wal mode, which has
+                    # its own extra files
+                    for suffix in ("-journal", "-wal", "-shm"):
+                        if (prev_journal := Path(str(db_path) + suffix)).exists():
+                            prev_journal.unlink()
                 else:
                     raise RuntimeError(f"Database for {account_name} already exists")
         super(TwitterDataWriter, self).__init__(
@@ -257,8 +352,10 @@ class TwitterDataWriter(Connection):
         # so that all of our inserts can be contained in one large one (faster)
         self.isolation_level = None
 
+        attach_annotations(self, annotations_db or annotations_path(db_path))
         with open(SQL_SCRIPTS_PATH / "setup.sql") as setup:
             self.executescript(setup.read())
+        create_text_search_index(self, text_search_mode)
         self.commit()
 
         self.execute("begin")
@@ -278,9 +375,14 @@ class TwitterDataWriter(Connection):
             self.online_mode = True
         else:
             self.online_mode = False
+        self.enrich_later = enrich_later
 
         self.added_messages = 0
 
+        self.dm_media_path = dm_media_path
+        self.group_media_path = group_media_path
+        self.substring_search = substring_search
+
         # maps participant tuples (user_id, conversation_id) to a list of all of the
         # joining/leaving events that happened with them (event_type, datestring). in
         # the finalize method, this is used to find the first join and last leave for
@@ -305,19 +407,7 @@ class TwitterDataWriter(Connection):
         information in the database. intended to be passed as a callback function
         to queue_twitter_user_request in the SimpleTwitterAPIClient class."""
         if user:
-            self.execute(
-                """update users 
-                    set loaded_full_data=1, handle=?, display_name=?, bio=?, 
-                    avatar=?, avatar_extension=? where id=?;""",
-                (
-                    user["screen_name"],
-                    user["name"],
-                    user["description"],
-                    user["avatar_bytes"],
-                    user["avatar_extension"],
-                    user["id"],
-                ),
-            )
+            store_user_data(self, user)
 
     def add_user_if_necessary(self, user_id: Union[int, str]):
         """one-stop shop for adding a user record for a user id to the
@@ -511,14 +601,16 @@ class TwitterDataWriter(Connection):
                 self.add_participant_if_necessary(user_id, message["conversationId"])
 
             self.execute(
-                """insert into messages (id, sent_time, sender, conversation, content)
-                            values (?, ?, ?, ?, ?);""",
+                """insert into messages
+                    (id, sent_time, sender, conversation, content, html_content)
+                    values (?, ?, ?, ?, ?, ?);""",
                 (
                     message["id"],
                     message["createdAt"],
                     message["senderId"],
                     message["conversationId"],
                     message["text"],
+                    render_html_content(message["text"], message["urls"]),
                 ),
             )
 
@@ -616,11 +708,35 @@ class TwitterDataWriter(Connection):
 
         self.added_messages += 1
 
+    def run_script(self, filename: str):
+        """executes a script from the SQLScripts folder one statement at a time
+        inside of the current transaction. statements in the script are separated by
+        blank lines; comment lines are printed as progress messages if they start
+        with "-- " followed by a capital letter and are otherwise ignored."""
+        with open(SQL_SCRIPTS_PATH / filename) as script:
+            command = ""
+            for line in script:
+                if not line.strip():
+                    if command:
+                        self.execute(command)
+                    command = ""
+                elif line.startswith("--"):
+                    if line[2:].strip()[:1].isupper():
+                        print(line[2:].strip())
+                    # await asyncio.sleep(0.5)
+                else:
+                    command += line
+            if command:
+                # execute the last command, which is terminated by the EOF rather
+                # than a blank line
+                self.execute(command)
+
     async def finalize(self):
-        """runs the script that creates the indexes; runs the script that infers data
-        to put into the gaps in the participants and conversations tables; waits for
-        the fetching of user data from the twitter api to be done; optimizes,
-        shrinks, and closes the database."""
+        """waits for the fetching of user data from the twitter api to be done; runs
+        the script that creates the indexes; runs the script that infers data to put
+        into the gaps in the participants and conversations tables; builds the
+        substring search index if it was asked for; measures the media files if we
+        know where they are; optimizes, shrinks, and closes the database."""
 
         print("indexing data...")
 
@@ -661,38 +777,8 @@ class TwitterDataWriter(Connection):
 
         self.commit()
 
-        with open(SQL_SCRIPTS_PATH / "indexes.sql") as index_script:
-            indexes = [
-                x
-                for x in index_script.readlines()
-                if x.strip() and not x.startswith("--")
-            ]
-            print()
-            for i, index in enumerate(indexes, start=1):
-                print(f"\rCreating search index {i}/{len(indexes)}...", end="")
-                self.execute(index)
-                # await asyncio.sleep(2)
-            print()
-
-        with open(
-            SQL_SCRIPTS_PATH / "cache_conversation_stats.sql"
-        ) as conversation_stats_script:
-            command = ""
-            for line in conversation_stats_script:
-                if not line.strip():
-                    if command:
-                        self.execute(command)
-                    command = ""
-                elif line.startswith("--"):
-                    print(line[2:].strip())
-                    # await asyncio.sleep(0.5)
-                else:
-                    command += line
-            if command:
-                # execute the last command, which is terminated by the EOF rather
-                # than a blank line
-                self.execute(command)
-
+        # user data has to be in place before the conversation stats script runs,
+        # since that uses users' names to derive names for unnamed group chats
         if self.online_mode:
             try:
                 await self.api_client.flush_queue()
@@ -703,15 +789,121 @@ class TwitterDataWriter(Connection):
                     "are online, your bearer token was valid, and that Twitter still "
                     "exists. users will be shown in the archive by their ID numbers"
                 )
-        else:
+        elif not self.enrich_later:
             print(
                 "no bearer token provided; not fetching user data. users will be "
                 "shown in the archive by their ID numbers"
             )
 
+        with open(SQL_SCRIPTS_PATH / "indexes.sql") as index_script:
+            indexes = [
+                x
+                for x in index_script.readlines()
+                if x.strip() and not x.startswith("--")
+            ]
+            print()
+            for i, index in enumerate(indexes, start=1):
+                print(f"\rCreating search index {i}/{len(indexes)}...", end="")
+                self.execute(index)
+                # await asyncio.sleep(2)
+            print()
+
+        self.run_script("cache_conversation_stats.sql")
+
+        if self.substring_search:
+            self.run_script("substring_search.sql")
+
+        if self.dm_media_path and self.group_media_path:
+            print("measuring media...")
+            fill_media_dimensions(self, self.dm_media_path, self.group_media_path)
+
         self.execute("pragma optimize;")
 
         self.commit()
 
         print("smallifying database size...")
         self.execute("vacuum")
+
+
+class TwitterUserEnricher(Connection):
+    """fills in twitter profile data for the users in an existing database that were
+    stored without it (because no bearer token was available at import time or the
+    api could not be reached.)
+
+    users are requested from the twitter api in batches and each batch is written in
+    its own short transaction, so this can run against a database that a
+    TwitterDataReader is serving from at the same time.
+
+    Attributes:
+        api_client: instance of SimpleTwitterAPIClient used to retrieve user data.
+        batch_size: number of users requested and then saved at a time; capped at
+            100 since that is the most the users/lookup endpoint accepts.
+        on_batch_saved: optional callback that receives the list of ids of the users
+            whose data was just committed, e.g. to invalidate a reader's caches.
+        enriched_users: number of users whose data has been saved so far; intended
+            for progress reports.
+
+    How to use:
+        >>> enricher = TwitterUserEnricher("db/someone.db", "SJKLJKDSLJDSKL")
+        >>> await enricher.enrich()
+        >>> enricher.close()
+    """
+
+    def __init__(self, db_path, bearer_token, batch_size=100, on_batch_saved=None):
+        # the timeout lets our small write transactions wait out any reads that the
+        # server is in the middle of instead of failing
+        super(TwitterUserEnricher, self).__init__(
+            db_path, uri=("mode=memory" in str(db_path)), timeout=30
+        )
+        self.isolation_level = None
+        attach_annotations(self, annotations_path(db_path))
+        self.api_client = SimpleTwitterAPIClient(bearer_token)
+        self.batch_size = min(batch_size, 100)
+        self.on_batch_saved = on_batch_saved
+        self.enriched_users = 0
+
+    @property
+    def unloaded_user_ids(self) -> list:
+        """returns the ids of the users that don't have data from the twitter api."""
+        return [
+            x[0]
+            for x in self.execute(
+                "select id from users where loaded_full_data=0;"
+            ).fetchall()
+        ]
+
+    def save_user_batch(self, users: list):
+        """saves a list of user dicts from the twitter api in one transaction."""
+        user_ids = [int(x["id"]) for x in users]
+        self.execute("begin immediate")
+        try:
+            for user in users:
+                store_user_data(self, user)
+            # the new names might show up in the names of group chats
+            refresh_participant_names(self, user_ids)
+        except:
+            self.execute("rollback")
+            raise
+        self.execute("commit")
+        self.enriched_users += len(users)
+        if self.on_batch_saved:
+            self.on_batch_saved(user_ids)
+
+    async def enrich(self):
+        """requests data for every user that doesn't have it yet, batch by batch,
+        and saves whatever the api returns."""
+        user_ids = self.unloaded_user_ids
+        print(f"{len(user_ids):,} users in the database are missing twitter data")
+        for batch_start in range(0, len(user_ids), self.batch_size):
+            # the api client hands back None for users that it couldn't find
+            found_users = []
+            for user_id in user_ids[batch_start : batch_start + self.batch_size]:
+                self.api_client.queue_twitter_user_request(
+                    str(user_id), found_users.append
+                )
+            await self.api_client.flush_queue()
+            found_users = [x for x in found_users if x]
+            if found_users:
+                self.save_user_batch(found_users)
+        self.api_client.close()
+        print(f"saved twitter data for {self.enriched_users:,} users")
@@ -0,0 +1,137 @@
+"""size-bounded least-recently-used cache, used by the reader to keep users and
+conversations in memory without letting a long-running server grow forever."""
+
+from collections import OrderedDict
+from collections.abc import Hashable, Callable
+from dataclasses import is_dataclass, fields
+from typing import Any
+from threading import RLock
+import sys
+
+
+def approximate_size(item: Any) -> int:
+    """estimates how many bytes an object takes up in memory, including the
+    contents of dataclasses, lists, tuples, and dicts. strings and other leaf values
+    are counted with sys.getsizeof, which is close enough to decide when to evict."""
+    size = sys.getsizeof(item)
+    if is_dataclass(item):
+        size += sum(approximate_size(getattr(item, x.name)) for x in fields(item))
+    elif isinstance(item, (list, tuple, set)):
+        size += sum(approximate_size(x) for x in item)
+    elif isinstance(item, dict):
+        size += sum(approximate_size(k) + approximate_size(v) for k, v in item.items())
+    return size
+
+
+class LRUCache:
+    """dict-like cache that evicts the least recently used entries once it holds
+    more than max_entries items or its items add up to more than max_bytes (as
+    measured by sizeof); either limit can be None to leave it unbounded. keeps count
+    of hits, misses, and evictions so that the limits can be tuned. safe to share
+    between threads.
+
+    to keep a thread from caching data that it read just before another thread
+    changed it and invalidated the old copy, `generation` goes up with every
+    invalidation (pop, pop_where, or clear); a thread can note it before reading and
+    pass it to `put`, which then skips storing the value if anything was
+    invalidated in the meantime."""
+
+    def __init__(
+        self,
+        max_entries: int = None,
+        max_bytes: int = None,
+        sizeof: Callable[[Any], int] = approximate_size,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self.lock = RLock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        """checks for a key without counting a hit or miss or marking it as used."""
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """returns the value for a key and marks it as the most recently used, or
+        returns default if it isn't in the cache."""
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, generation: int = None) -> None:
+        """adds or replaces a value and then evicts old entries until the cache is
+        back within its limits. a value that is bigger than max_bytes on its own is
+        not stored at all, and neither is one that was read at a `generation` that
+        an invalidation has since ended."""
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while (
+                self.max_entries is not None and len(self.entries) > self.max_entries
+            ) or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """removes a key from the cache (e.g. because its data changed) and returns
+        its value, or default if it wasn't there."""
+        with self.lock:
+            self.generation += 1
+            return self.remove(key, default)
+
+    def remove(self, key: Hashable, default: Any = None) -> Any:
+        """pop without counting as an invalidation."""
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value, size = self.entries.pop(key)
+            self.bytes -= size
+            return value
+
+    def pop_where(self, predicate: Callable[[Any], bool]) -> int:
+        """removes every entry whose value makes predicate return True and returns
+        how many there were."""
+        with self.lock:
+            self.generation += 1
+            keys = [k for k, (v, _) in self.entries.items() if predicate(v)]
+            for key in keys:
+                self.remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor
+from sqlite3 import Connection
+from pathlib import Path
+from os import PathLike
+from typing import Union
+
+if __name__ == "__main__":  # pragma: no cover
+    from MediaProbe import probe_dimensions
+else:
+    from ArchiveAccess.MediaProbe import probe_dimensions
+
+
+def media_file_path(
+    dm_media_path: PathLike,
+    group_media_path: PathLike,
+    message_id: Union[int, str],
+    filename: str,
+    from_group_message: bool,
+) -> Path:
+    """returns the location of a media file in a twitter archive; the files are stored
+    as [message id]-[filename] in a different folder for group and individual dms."""
+    return Path(group_media_path if from_group_message else dm_media_path) / (
+        f"{message_id}-{filename}"
+    )
+
+
+def measure_media(job: tuple) -> tuple:
+    """opens a media file and finds its dimensions. takes a tuple of the form
+    (media_id, media_type, file_path) and returns one of the form (width, height,
+    media_id) so that it can be fed straight into an update statement; width and
+    height are None if the file is missing or can't be read. this is run in worker
+    processes, which is why it takes and returns single tuples.
+
+    the dimensions are read from the file's header if possible; cv2 is only used to
+    decode files whose headers probe_dimensions doesn't understand."""
+    media_id, media_type, file_path = job
+    if not Path(file_path).exists():
+        return (None, None, media_id)
+    if dimensions := probe_dimensions(file_path):
+        return (*dimensions, media_id)
+
+    # cv2 is slow to import, so it's only loaded when it's needed
+    from cv2 import (
+        imread as open_image,
+        VideoCapture as Video,
+        IMREAD_COLOR as color_image,
+        CAP_PROP_FRAME_HEIGHT as video_height,
+        CAP_PROP_FRAME_WIDTH as video_width,
+    )
+
+    width, height = None, None
+    if media_type == "image":
+        img = open_image(str(file_path), color_image)
+        if img is not None:
+            height, width, _ = img.shape
+    else:
+        vid = Video(str(file_path))
+        height, width = int(vid.get(video_height)), int(vid.get(video_width))
+        vid.release()
+    return (width or None, height or None, media_id)
+
+
+def fill_media_dimensions(
+    connection: Connection,
+    dm_media_path: PathLike,
+    group_media_path: PathLike,
+    processes: int = None,
+    batch_size: int = 500,
+) -> int:
+    """measures every media file that doesn't have a width and height in the database
+    yet using a pool of worker processes, and saves the results `batch_size` at a
+    time in short transactions so that this can run against a database that is being
+    served. the connection must not be in the middle of a transaction. returns the
+    number of media files that were measured.
+
+    Arguments:
+        connection: sqlite3 connection to an archive database.
+        dm_media_path: folder containing the media from individual dms.
+        group_media_path: folder containing the media from group dms.
+        processes: number of worker processes to use; defaults to the number of
+            processors on this machine.
+        batch_size: number of measurements to save per transaction.
+    """
+    jobs = [
+        (
+            media_id,
+            media_type,
+            media_file_path(
+                dm_media_path, group_media_path, message, filename, from_group
+            ),
+        )
+        for media_id, media_type, message, filename, from_group in connection.execute(
+            """select id, type, message, filename, from_group_message from media
+                where width is null or height is null;"""
+        ).fetchall()
+    ]
+    if not jobs:
+        return 0
+
+    measured = 0
+
+    def save(batch):
+        connection.execute("begin immediate")
+        connection.executemany("update media set width=?, height=? where id=?;", batch)
+        connection.execute("commit")
+
+    with ProcessPoolExecutor(processes) as pool:
+        batch = []
+        for result in pool.map(measure_media, jobs, chunksize=16):
+            if result[0] is None:
+                print(f"\nwarning: could not measure media with id {result[2]}")
+                continue
+            batch.append(result)
+            measured += 1
+            if len(batch) == batch_size:
+                save(batch)
+                batch = []
+                print(f"\rmeasured {measured:,}/{len(jobs):,} media files", end="")
+        if batch:
+            save(batch)
+        print(f"\rmeasured {measured:,}/{len(jobs):,} media files")
+
+    return measured
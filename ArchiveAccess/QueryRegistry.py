@@ -0,0 +1,140 @@
+"""keeps every read query that TwitterDataReader runs in one place, as named
+"statement shapes": functions that build the sql for a query from a few options,
+like which column to sort by or how many ids are in an `in (...)` list. because each
+shape declares the values its options can take, every version of every query can be
+listed and checked with `explain query plan` to make sure none of them scan through
+a whole large table, and that the ones that return pages of a listing read their
+rows in order from an index instead of sorting everything that matches."""
+
+from collections.abc import Callable, Iterator
+from functools import lru_cache
+from itertools import product
+from sqlite3 import Connection
+from typing import Any
+
+
+class StatementShape:
+    """a named read query whose sql is built by `build` from keyword options. the
+    sql for each combination of options is only built once.
+
+    Arguments:
+        name: identifies the query in the registry and in test failures.
+        build: function that takes the options as keyword arguments and returns
+            the sql.
+        variants: maps each option to the values that should be explained when the
+            query plans are checked; options can take other values at runtime (e.g.
+            any number of ids for an `in` list) as long as those don't change which
+            indexes the query can use.
+        allowed_scans: tables that this query is allowed to scan in full, for the
+            rare queries that really do need to look at every row.
+        paginated: whether the query returns a page of a sorted listing, which
+            should come straight out of an index in order; otherwise the database
+            has to sort every matching row to find the first few.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        build: Callable[..., str],
+        variants: dict[str, tuple],
+        allowed_scans: tuple[str] = (),
+        paginated: bool = False,
+    ):
+        self.name = name
+        self.build = build
+        self.variants = variants
+        self.allowed_scans = allowed_scans
+        self.paginated = paginated
+        self.sql = lru_cache(maxsize=256)(build)
+
+    def __call__(self, **options: Any) -> str:
+        return self.sql(**options)
+
+    def all_sql(self) -> Iterator[tuple[dict, str]]:
+        """yields (options, sql) for every combination of the variant values."""
+        for values in product(*self.variants.values()):
+            options = dict(zip(self.variants.keys(), values))
+            yield options, self.sql(**options)
+
+
+class QueryRegistry:
+    """collection of StatementShapes, which are added with the `shape` decorator
+    and retrieved by name with square brackets."""
+
+    def __init__(self, large_tables: tuple[str]):
+        """large_tables are the tables that `find_scans` complains about; small
+        ones, like the one-row `me` table, can be scanned without any trouble."""
+        self.large_tables = large_tables
+        self.shapes: dict[str, StatementShape] = {}
+
+    def shape(
+        self,
+        name: str,
+        allowed_scans: tuple[str] = (),
+        paginated: bool = False,
+        **variants: tuple,
+    ) -> Callable[[Callable[..., str]], StatementShape]:
+        """decorator that registers a function that builds sql as a StatementShape;
+        see that class for what the arguments mean."""
+
+        def register(build: Callable[..., str]) -> StatementShape:
+            assert name not in self.shapes, f"query {name} is defined twice"
+            self.shapes[name] = StatementShape(
+                name, build, variants, allowed_scans, paginated
+            )
+            return self.shapes[name]
+
+        return register
+
+    def __getitem__(self, name: str) -> StatementShape:
+        return self.shapes[name]
+
+    def __iter__(self) -> Iterator[StatementShape]:
+        return iter(self.shapes.values())
+
+    def find_scans(self, connection: Connection) -> list[str]:
+        """runs `explain query plan` for every version of every query against a
+        database with the archive schema and returns a description of each full scan
+        of a large table that isn't explicitly allowed. scans that walk through an
+        index don't count, since that's how sorted listings read their pages (and
+        they stop once they have enough rows); neither do full-text searches, which
+        show up as scans of virtual tables that use the fts index. for paginated
+        queries, sorting rows from a large table in a temporary b-tree is also a
+        problem, since every matching row has to be read and sorted to find the page;
+        sorting a page that's already been picked out is fine."""
+        problems = []
+        for shape in self:
+            for options, sql in shape.all_sql():
+                plan = connection.execute(
+                    "explain query plan " + sql, [None] * sql.count("?")
+                ).fetchall()
+                for _, parent, _, detail in plan:
+                    words = detail.split()
+                    if (
+                        words[0] == "SCAN"
+                        and words[1] in self.large_tables
+                        and words[1] not in shape.allowed_scans
+                        and "INDEX" not in detail
+                    ):
+                        problems.append(f"{shape.name} {options}: {detail}")
+                    if (
+                        shape.paginated
+                        and detail.startswith("USE TEMP B-TREE FOR")
+                        and "ORDER BY" in detail
+                        and self.reads_large_table(plan, parent)
+                    ):
+                        problems.append(f"{shape.name} {options}: {detail}")
+        return problems
+
+    def reads_large_table(self, plan: list[tuple], parent: int) -> bool:
+        """whether the part of a query plan with the given parent id reads rows
+        straight from a large table."""
+        for _, node_parent, _, detail in plan:
+            words = detail.split()
+            if (
+                node_parent == parent
+                and words[0] in ("SCAN", "SEARCH")
+                and words[1] in self.large_tables
+            ):
+                return True
+        return False
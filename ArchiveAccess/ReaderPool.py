@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from collections.abc import Iterator, Awaitable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Final
+from os import PathLike
+from threading import Lock, RLock, local
+from tornado.ioloop import IOLoop
+
+if __name__ == "__main__":  # pragma: no cover
+    from DBRead import TwitterDataReader
+else:
+    from ArchiveAccess.DBRead import TwitterDataReader
+
+# methods of TwitterDataReader that modify the annotations database
+WRITE_METHODS: Final = frozenset(
+    ("set_user_nickname", "set_user_notes", "set_conversation_notes")
+)
+
+
+class ReaderPool:
+    """Keeps a few read-only TwitterDataReaders, so that queries can run at the
+    same time in different threads, and keeps one read-write TwitterDataReader that writes are funneled
+    through one at a time. All of them share the same caches, so writes invalidate
+    cached data for every reader. The only writes are to the annotations database,
+    which is switched to WAL mode so that reads don't have to wait for writes to
+    finish; so is the archive, unless it's opened as immutable.
+
+    Any TwitterDataReader method can be called on the pool itself; the call uses a
+    reader, or the writer for the methods in WRITE_METHODS (waiting for it to be free
+    if necessary.) The pool has a fixed number of threads of its own, which `run`
+    uses to call methods for async code, like the server's request handlers, so that
+    the IOLoop isn't blocked while queries run; each of them has its own reader.
+    Calls from any other thread (like the IOLoop's) take turns with one more reader,
+    so the pool never has more than `size` + 2 connections open."""
+
+    def __init__(
+        self,
+        db_path: PathLike,
+        dm_media_path: PathLike,
+        group_media_path: PathLike,
+        size: int = 4,
+        immutable: bool = False,
+        **cache_limits,
+    ):
+        """Opens the read-write connection to the database at db_path and starts
+        up to `size` threads for `run`, each of which opens its read-only connection
+        when it starts. immutable and cache_limits are passed on to
+        TwitterDataReader."""
+        self.writer = TwitterDataReader(
+            db_path,
+            dm_media_path,
+            group_media_path,
+            check_same_thread=False,
+            immutable=immutable,
+            **cache_limits,
+        )
+        if "mode=memory" not in str(db_path):
+            self.writer.execute("pragma annotations.journal_mode = wal;")
+            if not immutable:
+                self.writer.execute("pragma main.journal_mode = wal;")
+        self.reader_arguments = (db_path, dm_media_path, group_media_path)
+        self.immutable = immutable
+        self.write_lock = Lock()
+        self.connections = [self.writer]
+        self.connections_lock = Lock()
+        self.thread_readers = local()
+        self.shared_reader = None
+        self.shared_reader_lock = RLock()
+        self.executor = ThreadPoolExecutor(
+            size, thread_name_prefix="reader", initializer=self.open_thread_reader
+        )
+
+    def open_reader(self) -> TwitterDataReader:
+        # each connection is only used by one thread at a time, but close() is
+        # called from another one
+        reader = TwitterDataReader(
+            *self.reader_arguments,
+            read_only=True,
+            share_caches_with=self.writer,
+            check_same_thread=False,
+            immutable=self.immutable,
+        )
+        with self.connections_lock:
+            self.connections.append(reader)
+        return reader
+
+    def open_thread_reader(self):
+        self.thread_readers.reader = self.open_reader()
+
+    @contextmanager
+    def reader(self) -> Iterator[TwitterDataReader]:
+        """gives a read-only connection for the duration of a with block: the
+        calling thread's own, if it's one of the pool's threads, or else the one
+        that other threads share, once none of them is using it."""
+        reader = getattr(self.thread_readers, "reader", None)
+        if reader is not None:
+            yield reader
+            return
+        with self.shared_reader_lock:
+            if self.shared_reader is None:
+                self.shared_reader = self.open_reader()
+            yield self.shared_reader
+
+    @contextmanager
+    def writing(self) -> Iterator[TwitterDataReader]:
+        """gives exclusive access to the read-write connection for the duration of a
+        with block."""
+        with self.write_lock:
+            yield self.writer
+
+    def __getattr__(self, name: str):
+        if not callable(getattr(TwitterDataReader, name, None)):
+            raise AttributeError(f"'ReaderPool' object has no attribute '{name}'")
+
+        def call(*args, **kwargs):
+            with self.writing() if name in WRITE_METHODS else self.reader() as db:
+                return getattr(db, name)(*args, **kwargs)
+
+        return call
+
+    def run(self, method: str, *args, **kwargs) -> Awaitable:
+        """calls a TwitterDataReader method in one of the pool's threads and returns
+        an awaitable for its result; the IOLoop can keep serving other requests while
+        it runs. if all of the threads are busy, the call waits for one to be free."""
+        return IOLoop.current().run_in_executor(
+            self.executor, partial(getattr(self, method), *args, **kwargs)
+        )
+
+    def close(self):
+        self.executor.shutdown()
+        with self.connections_lock:
+            for connection in self.connections:
+                connection.close()
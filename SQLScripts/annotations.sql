@@ -0,0 +1,56 @@
+-- notes and nicknames that are added while an archive is being browsed. these live in
+-- their own small database next to the archive, which is attached to every
+-- connection as "annotations", so that the archive itself is never written to once
+-- it has been imported (and so that they survive the archive being re-imported.)
+-- this script runs every time a connection is opened.
+
+create table if not exists annotations.user_annotations (
+    user_id integer primary key,
+    nickname text check(length(nickname) < 50),
+    notes text
+);
+
+create table if not exists annotations.conversation_annotations (
+    conversation_id text primary key,
+    notes text,
+    -- group chats' participant names, redone whenever a participant's nickname or
+    -- twitter name changes after the archive was finalized; used instead of the
+    -- archive's conversations.participant_names when it isn't null
+    participant_names text
+);
+
+-- derives the default name for each group conversation: the names of the five
+-- participants who have sent the most messages, followed by "etc." if there are
+-- more. used to fill in participant_names during finalization and whenever a user's
+-- name changes. this is a temporary view because views that are stored in the
+-- archive can't refer to tables in the annotations database.
+create temp view if not exists group_participant_names as
+select conversation,
+    group_concat(name, ', ') filter (
+        where position <= 5
+    ) || (
+        case
+            when count() > 5 then ', etc.'
+            else ''
+        end
+    ) as participant_names
+from (
+        select participants.conversation as conversation,
+            coalesce(
+                nullif(user_annotations.nickname, ''),
+                nullif(users.display_name, ''),
+                '@' || users.id
+            ) as name,
+            row_number() over (
+                partition by participants.conversation
+                order by participants.messages_sent desc
+            ) as position
+        from participants
+            join users on participants.participant = users.id
+            left join annotations.user_annotations
+                on user_annotations.user_id = users.id
+            join conversations on participants.conversation = conversations.id
+        where conversations.type = "group"
+    )
+where position <= 6
+group by conversation;
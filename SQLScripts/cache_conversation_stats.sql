@@ -148,4 +148,127 @@ set messages_sent = (
         from messages
         where messages.conversation = participants.conversation
             and messages.sender = participants.participant
-    );
\ No newline at end of file
+    );
+
+-- Caching conversation names...
+update conversations
+set current_name = (
+        select new_name
+        from name_updates
+        where conversation = conversations.id
+        order by update_time desc
+        limit 1
+    )
+where type = "group";
+
+update conversations
+set participant_names = names.participant_names
+from group_participant_names as names
+where names.conversation = conversations.id;
+
+update annotations.conversation_annotations
+set participant_names = null;
+
+-- Numbering messages for random sampling...
+delete from message_positions;
+
+insert into message_positions (message)
+select id
+from messages
+order by id;
+
+-- Building the timeline...
+delete from timeline;
+
+insert into timeline (time, kind, conversation, user, item)
+select sent_time,
+    'message',
+    conversation,
+    sender,
+    id
+from messages;
+
+insert into timeline (time, kind, conversation, user, item)
+select update_time,
+    'name_update',
+    conversation,
+    initiator,
+    rowid
+from name_updates;
+
+insert into timeline (time, kind, conversation, user, item)
+select start_time,
+    'join',
+    conversation,
+    participant,
+    rowid
+from participants
+where start_time is not null;
+
+insert into timeline (time, kind, conversation, user, item)
+select end_time,
+    'leave',
+    conversation,
+    participant,
+    rowid
+from participants
+where end_time is not null;
+
+-- Counting messages by day and by hour of the week...
+delete from daily_activity;
+
+insert into daily_activity (kind, item, day, messages)
+select 'conversation',
+    conversation,
+    substr(sent_time, 1, 10),
+    count()
+from messages
+group by conversation,
+    substr(sent_time, 1, 10);
+
+insert into daily_activity (kind, item, day, messages)
+select 'user',
+    sender,
+    substr(sent_time, 1, 10),
+    count()
+from messages
+group by sender,
+    substr(sent_time, 1, 10);
+
+insert into daily_activity (kind, item, day, messages)
+select 'all',
+    '',
+    day,
+    sum(messages)
+from daily_activity
+where kind = 'conversation'
+group by day;
+
+delete from weekly_activity;
+
+insert into weekly_activity (kind, item, hour, messages)
+select 'conversation',
+    conversation,
+    strftime('%w', sent_time) * 24 + strftime('%H', sent_time),
+    count()
+from messages
+group by conversation,
+    strftime('%w', sent_time) * 24 + strftime('%H', sent_time);
+
+insert into weekly_activity (kind, item, hour, messages)
+select 'user',
+    sender,
+    strftime('%w', sent_time) * 24 + strftime('%H', sent_time),
+    count()
+from messages
+group by sender,
+    strftime('%w', sent_time) * 24 + strftime('%H', sent_time);
+
+insert into weekly_activity (kind, item, hour, messages)
+select 'all',
+    '',
+    hour,
+    sum(messages)
+from weekly_activity
+where kind = 'conversation'
+group by hour;
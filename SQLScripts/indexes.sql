@@ -1,11 +1,25 @@
 -- these need to be single lines so that dbwrite can run them individually for progress reporting purposes
 create index convos_ids_idx on conversations(id);
 
-create index convos_message_count_idx on conversations(type, number_of_messages);
+create index convos_message_count_idx on conversations(type, number_of_messages, id);
 
-create index convo_firsttime_idx on conversations (first_time);
+-- the ids at the end of these indexes are tiebreakers for keyset pagination
+create index convo_firsttime_idx on conversations (first_time, id);
 
-create index convo_lasttime_idx on conversations (last_time);
+create index convo_lasttime_idx on conversations (last_time, id);
+
+create index convos_by_messages_idx on conversations (number_of_messages, id);
+
+create index convos_by_my_messages_idx on conversations (messages_from_you, id);
+
+-- the same orders for listings of only group or only individual conversations
+create index convos_type_firsttime_idx on conversations (type, first_time, id);
+
+create index convos_type_lasttime_idx on conversations (type, last_time, id);
+
+create index convos_type_my_messages_idx on conversations (type, messages_from_you, id);
+
+create index convos_by_added_by_idx on conversations (added_by);
 
 create index users_by_messages on users (number_of_messages);
 
@@ -25,6 +39,26 @@ create index name_updates_chronological_idx on name_updates (update_time);
 
 create index name_updates_convo_chronological_idx on name_updates (conversation, update_time);
 
+create index name_updates_user_chronological_idx on name_updates (initiator, update_time);
+
 create index participation_start_idx on participants (start_time);
 
-create index participation_end_idx on participants (end_time);
\ No newline at end of file
+create index participation_end_idx on participants (end_time);
+
+create index participation_convo_start_idx on participants (conversation, start_time);
+
+create index participation_convo_end_idx on participants (conversation, end_time);
+
+create index participation_user_start_idx on participants (participant, start_time);
+
+create index participation_user_end_idx on participants (participant, end_time);
+
+create index participants_by_conversation_idx on participants (conversation, messages_sent, participant);
+
+create index participants_by_user_idx on participants (participant, messages_sent, conversation);
+
+create index timeline_chronological_idx on timeline (time);
+
+create index timeline_convo_chronological_idx on timeline (conversation, time);
+
+create index timeline_user_chronological_idx on timeline (user, time);
\ No newline at end of file
@@ -4,7 +4,6 @@ create table me (id integer primary key);
 create table conversations (
     id text primary key,
     type text not null check(type in ("group", "individual")),
-    notes text,
     number_of_messages integer,
     messages_from_you integer,
     -- null for group chats
@@ -23,6 +22,12 @@ create table conversations (
     added_by integer,
     num_participants integer,
     num_name_updates integer,
+    -- the most recent name given to a group chat; null if it was never named
+    current_name text,
+    -- the names of the most active participants in a group chat, which are used as
+    -- its name if it doesn't have one (see group_participant_names in
+    -- annotations.sql)
+    participant_names text,
     /* if we created the chat then participant info might not be comprehensive (the
      data doesn't show the initial members in that case fsr) */
     foreign key(other_person) references users(id),
@@ -35,16 +40,14 @@ create table users (
     first_appearance text,
     last_appearance text,
     loaded_full_data integer check(loaded_full_data in (0, 1)),
-    -- if false, the rest of these will be null except maybe nickname and notes,
-    -- which are user-created
+    -- if false, the rest of these will be null; nicknames and notes are kept in
+    -- the annotations database (see annotations.sql)
     handle text,
     display_name text,
     bio text,
     avatar blob,
     -- "jpg", "png", maybe "gif"; who needs mime types
-    avatar_extension text,
-    nickname text check(length(nickname) < 50),
-    notes text
+    avatar_extension text
 );
 
 create table messages (
@@ -53,30 +56,57 @@ create table messages (
     sender integer not null,
     conversation text not null,
     content text,
+    -- content with links turned into <a> tags and everything else escaped, ready to
+    -- be displayed; rendered once when the message is added
+    html_content text,
     foreign key(sender) references users(id),
     foreign key(conversation) references conversations(id)
 );
 
--- not actually sure if all the unindexed columns need to be listed out? probably tho
-create virtual table messages_text_search using fts5(
-    id unindexed,
-    sent_time unindexed,
-    sender unindexed,
-    conversation unindexed,
-    content,
-    content = messages,
-    content_rowid = id,
-    tokenize = porter
+-- numbers the messages from 1 to n with no gaps, so that random messages can be
+-- picked by choosing random positions instead of by sorting the whole messages table
+-- by random(); filled in when the database is finalized
+create table message_positions (
+    position integer primary key,
+    message integer not null
 );
 
--- messages don't get updated or deleted lol so other triggers aren't necessary
-create trigger message_add
-after
-insert on messages begin
-insert into messages_text_search(rowid, content)
-values(new.id, new.content);
+-- every message and conversation event in one place, in the order they happened, so
+-- that a page of them can be read with one range scan; filled in when the database
+-- is finalized. kind is 'message', 'name_update', 'join', or 'leave'; item is the
+-- message's id or the rowid of the name_updates or participants row that has the
+-- rest of the event's data; user is the message's sender, the name update's
+-- initiator, or the participant who joined or left.
+create table timeline (
+    time text not null,
+    kind text not null,
+    conversation text not null,
+    user integer not null,
+    item integer not null
+);
+
+-- how many messages were sent on each day (yyyy-mm-dd) and in each hour of the week
+-- (0 to 167, starting from midnight on sunday), all in utc, so that activity charts
+-- don't have to count messages; filled in when the database is finalized. kind is
+-- 'all', 'conversation', or 'user'; item is the conversation's or user's id, or ''
+-- for the counts of all messages.
+create table daily_activity (
+    kind text not null,
+    item text not null,
+    day text not null,
+    messages integer not null,
+    primary key (kind, item, day)
+) without rowid;
+
+create table weekly_activity (
+    kind text not null,
+    item text not null,
+    hour integer not null,
+    messages integer not null,
+    primary key (kind, item, hour)
+) without rowid;
 
-end;
+-- the full text search index for messages is created by text_search.sql
 
 create table reactions (
     -- twitter gives reactions a specific id but letting sqlite use rowid should be
@@ -0,0 +1,15 @@
+-- Building the substring search index...
+-- optional second search index that is only created if the archive was imported
+-- with it turned on. the trigram tokenizer indexes every three-character sequence
+-- in a message instead of whole words, so it can find parts of words, urls, and text
+-- in languages that aren't written with spaces between words, at the cost of being
+-- a few times bigger than the porter index
+create virtual table messages_substring_search using fts5(
+    content,
+    content = messages,
+    content_rowid = id,
+    tokenize = trigram
+);
+
+insert into messages_substring_search(messages_substring_search)
+values('rebuild');
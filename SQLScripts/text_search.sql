@@ -0,0 +1,40 @@
+-- creates the word index that messages are searched with. this is a template that
+-- DBWrite.create_text_search_index fills in according to the mode chosen for the
+-- archive (see DBRead.TEXT_SEARCH_MODES): the sender and conversation columns are
+-- marked as unindexed in modes that don't index them, and the fts5 options set how
+-- much detail the index keeps about where words appear.
+
+-- which of the modes the index was created with; one row
+create table text_search_mode (mode text not null);
+
+insert into text_search_mode (mode) values ('{mode}');
+
+-- not actually sure if all the unindexed columns need to be listed out? probably tho.
+-- sender and conversation are indexed (in the modes that allow it) so that searches
+-- can be limited to one of them with a column filter, which fts5 can intersect with
+-- the search's matches without looking up every matching message in the messages
+-- table
+create virtual table messages_text_search using fts5(
+    id unindexed,
+    sent_time unindexed,
+    sender {filter_columns},
+    conversation {filter_columns},
+    content,
+    content = messages,
+    content_rowid = id,
+    tokenize = porter,
+    {options}
+);
+
+-- only the content column counts towards how relevant a message is to a search
+insert into messages_text_search(messages_text_search, rank)
+values('rank', 'bm25(0.0, 0.0, 0.0, 0.0, 1.0)');
+
+-- messages don't get updated or deleted lol so other triggers aren't necessary
+create trigger message_add
+after
+insert on messages begin
+insert into messages_text_search(rowid, sender, conversation, content)
+values(new.id, new.sender, new.conversation, new.content);
+
+end;
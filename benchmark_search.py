@@ -0,0 +1,183 @@
+from ArchiveAccess.DBRead import (
+    TwitterDataReader,
+    READ_QUERIES,
+    SEARCH_INDEXES,
+    TEXT_SEARCH_MODES,
+    MESSAGES_PER_PAGE,
+)
+from ArchiveAccess.DBWrite import create_text_search_index
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import argparse
+import sqlite3
+
+
+def table_size(db: sqlite3.Connection, table: str, fts: bool = False) -> int:
+    """returns the number of bytes a table takes up, or, if fts is True, the size of
+    the shadow tables that fts5 stores a virtual table's index in. returns None if
+    the table doesn't exist or if this sqlite wasn't compiled with dbstat."""
+    if not db.execute(
+        "select count() from sqlite_master where name=?;", (table,)
+    ).fetchone()[0]:
+        return None
+    try:
+        if fts:
+            return db.execute(
+                r"select sum(pgsize) from dbstat where name like ? escape '\';",
+                (table.replace("_", r"\_") + r"\_%",),
+            ).fetchone()[0]
+        return db.execute(
+            "select sum(pgsize) from dbstat where name=?;", (table,)
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def time_query(db: sqlite3.Connection, sql: str, parameters: list, runs: int):
+    """returns the median number of milliseconds it took to run a query and fetch all
+    of its results."""
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        db.execute(sql, parameters).fetchall()
+        times.append((perf_counter() - start) * 1000)
+    return median(times)
+
+
+def report(db_path: Path, searches: list[str], runs: int):
+    """prints the size of each search index in a database and how long it takes to
+    find all of a search's matches, the first page of them by time, and the first
+    page of them by relevance with each index."""
+    reader = TwitterDataReader(db_path, Path(), Path(), read_only=True)
+    reader.row_factory = None
+    mode, _ = reader.search_settings()
+    print(f"database: {db_path.stat().st_size:,} bytes")
+    print(f"messages table: {table_size(reader, 'messages') or 0:,} bytes")
+
+    for index, (table, _) in SEARCH_INDEXES.items():
+        size = table_size(reader, table, fts=True)
+        if size is None:
+            print(f"{index} index ({table}): not present or not measurable")
+            continue
+        print(
+            f"{index} index ({table}"
+            + (f", {mode} mode" if index == "words" else "")
+            + f"): {size:,} bytes"
+        )
+        for search in searches:
+            try:
+                match = reader.search_match(search, index=index)
+            except ValueError as e:
+                print(f"  {search!r}: {e}")
+                continue
+            try:
+                matches = reader.execute(
+                    f"select count() from {table} where {table} match ?;", [match]
+                ).fetchone()[0]
+            except sqlite3.OperationalError as e:
+                print(f"  {search!r}: {e}")
+                continue
+            all_ms = time_query(
+                reader,
+                f"select rowid from {table} where {table} match ?;",
+                [match],
+                runs,
+            )
+            chronological_ms = time_query(
+                reader,
+                READ_QUERIES["message_search"](
+                    index=index,
+                    in_conversation=False,
+                    by_sender=False,
+                    time_bound=None,
+                    descending=False,
+                ),
+                [match, MESSAGES_PER_PAGE],
+                runs,
+            )
+            ranked_ms = time_query(
+                reader,
+                READ_QUERIES["ranked_search"](
+                    index=index,
+                    in_conversation=False,
+                    by_sender=False,
+                    after_cursor=False,
+                ),
+                [match, MESSAGES_PER_PAGE, match],
+                runs,
+            )
+            print(
+                f"  {search!r}: {matches:,} matches; all matches {all_ms:.1f}ms, "
+                f"first page by time {chronological_ms:.1f}ms, "
+                f"first page by relevance {ranked_ms:.1f}ms"
+            )
+
+    reader.close()
+
+
+def copy_with_mode(db_path: Path, copy_path: Path, mode: str):
+    """copies a database and rebuilds the copy's word index in one of the
+    TEXT_SEARCH_MODES."""
+    with sqlite3.connect(db_path) as db:
+        db.execute("vacuum into ?;", (str(copy_path),))
+    copy = sqlite3.connect(copy_path, isolation_level=None)
+    copy.executescript(
+        """drop trigger message_add;
+        drop table messages_text_search;
+        drop table text_search_mode;"""
+    )
+    create_text_search_index(copy, mode)
+    copy.execute(
+        "insert into messages_text_search(messages_text_search) values('rebuild');"
+    )
+    copy.execute("vacuum;")
+    copy.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the size of an archive database's search indexes and "
+        "how long it takes to search with each of them, to help decide whether "
+        "the substring search index (see main.py's --substring_search flag) is "
+        "worth its space and which --search_index mode to import with."
+    )
+    parser.add_argument(
+        "path_to_db",
+        help="The path of the .db file to measure; this will be something like "
+        "db/YourUserName.db",
+    )
+    parser.add_argument(
+        "searches",
+        nargs="+",
+        help="Searches to time, e.g. common words, rare words, and parts of words.",
+    )
+    parser.add_argument(
+        "-r",
+        "--runs",
+        type=int,
+        default=5,
+        help="How many times to run each query; the median time is reported.",
+    )
+    parser.add_argument(
+        "-m",
+        "--modes",
+        action="store_true",
+        help="Also build a temporary copy of the database with the word index in "
+        "each of the other --search_index modes and report on those.",
+    )
+    args = parser.parse_args()
+
+    db_path = Path(args.path_to_db)
+    if not db_path.exists():
+        parser.error(f"no database found at {db_path}")
+
+    report(db_path, args.searches, args.runs)
+    if args.modes:
+        with TemporaryDirectory() as folder:
+            for mode in TEXT_SEARCH_MODES:
+                copy_path = Path(folder) / f"{mode}.db"
+                copy_with_mode(db_path, copy_path, mode)
+                print(f"\nwith the word index in {mode} mode:")
+                report(copy_path, args.searches, args.runs)
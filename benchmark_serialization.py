@@ -0,0 +1,111 @@
+from ArchiveAccess.DBRead import (
+    ArchivedUserSummary,
+    Conversation,
+    Reaction,
+    Media,
+    Message,
+    DBRow,
+    Page,
+    MESSAGES_PER_PAGE,
+)
+from ArchiveAccess.APIServer import APIRequestHandler
+from dataclasses import asdict
+from statistics import median
+from time import perf_counter
+import argparse
+import json
+
+
+def sample_page() -> dict:
+    """builds a response like the one for a page of messages in a group chat, where
+    every message has a few reactions and an image."""
+    users = [
+        ArchivedUserSummary(
+            str(i), "", f"user{i}", f"User {i}", f"/{i}.jpg", True, i == 0
+        )
+        for i in range(10)
+    ]
+    messages = [
+        Message(
+            f"2020-01-01T00:00:{i:02d}.000Z",
+            "group",
+            f"message number {i} " * 5,
+            str(i % 10),
+            str(1000 + i),
+            [
+                Reaction(i * 3 + j, "funny", f"2020-01-01T00:01:{i:02d}.000Z", str(j))
+                for j in range(3)
+            ],
+            [Media(str(i), "image", f"/api/media/group/{1000 + i}-a.jpg", 640, 480)],
+            f"message number {i} " * 5,
+        )
+        for i in range(MESSAGES_PER_PAGE)
+    ]
+    conversation = Conversation(
+        "group",
+        "group",
+        1000,
+        100,
+        "2019",
+        "2021",
+        10,
+        0,
+        True,
+        None,
+        users[1],
+        "a group",
+        "/group.svg",
+        "",
+    )
+    return {
+        "results": Page(messages, "cursor"),
+        "users": users,
+        "conversations": [conversation],
+    }
+
+
+def asdict_serialize(item):
+    """how responses were serialized before DBRows had generated encoders."""
+    if isinstance(item, DBRow):
+        return asdict(item) | {"schema": type(item).__name__}
+    elif isinstance(item, list):
+        return [asdict_serialize(x) for x in item]
+    elif isinstance(item, dict):
+        return {k: asdict_serialize(v) for k, v in item.items()}
+    return item
+
+
+def time_serialization(serialize, runs: int) -> float:
+    """returns the median number of milliseconds it took to serialize a fresh page
+    and turn it into json."""
+    times = []
+    for _ in range(runs):
+        page = sample_page()
+        start = perf_counter()
+        json.dumps(serialize(page))
+        times.append((perf_counter() - start) * 1000)
+    return median(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure how long it takes to turn a page of messages into the "
+        "JSON that the server sends, with the generated DBRow encoders and with "
+        "dataclasses.asdict."
+    )
+    parser.add_argument(
+        "-r",
+        "--runs",
+        type=int,
+        default=200,
+        help="How many times to serialize the page; the median time is reported.",
+    )
+    args = parser.parse_args()
+
+    assert json.dumps(asdict_serialize(sample_page())) == json.dumps(
+        APIRequestHandler.process_chunk(sample_page())
+    )
+    before = time_serialization(asdict_serialize, args.runs)
+    after = time_serialization(APIRequestHandler.process_chunk, args.runs)
+    print(f"dataclasses.asdict: {before:.3f}ms per page")
+    print(f"generated encoders: {after:.3f}ms per page ({before / after:.1f}x faster)")
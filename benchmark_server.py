@@ -0,0 +1,240 @@
+from ArchiveAccess.DBRead import (
+    TwitterDataReader,
+    READ_QUERIES,
+    MEDIA_API_URL,
+)
+from ArchiveAccess.ReaderPool import ReaderPool
+from ArchiveAccess.APIServer import ArchiveAPIServer, CACHED_RESPONSE_BYTES
+from collections import defaultdict
+from multiprocessing import Process, Queue
+from pathlib import Path
+from random import Random
+from statistics import median, quantiles
+from time import perf_counter
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.testing import bind_unused_port
+from urllib.parse import quote
+import argparse
+import asyncio
+import logging
+import re
+import sqlite3
+import sys
+
+
+def sample_requests(db_path: Path) -> dict[str, list[str]]:
+    """picks some urls for each kind of request that the load test makes, based on
+    what's in the archive. substring searches, which can be much slower than the
+    rest, are only made if the archive has a substring search index."""
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    _, substring = db.execute(READ_QUERIES["search_settings"]()).fetchone()
+    conversations = [
+        quote(x[0])
+        for x in db.execute(
+            "select id from conversations order by number_of_messages desc limit 5;"
+        )
+    ]
+    words = []
+    for (content,) in db.execute(
+        "select content from messages where length(content) > 8 limit 20;"
+    ):
+        words.append(max(re.findall(r"\w+", content), key=len))
+    media = [
+        f"{MEDIA_API_URL}{'group/' if x[2] else 'individual/'}{x[0]}-{x[1]}"
+        for x in db.execute(
+            "select message, filename, from_group_message from media limit 5;"
+        )
+    ]
+    db.close()
+    return {
+        "conversations": [
+            f"/api/conversations?types=group-individual&first={x}"
+            for x in ("newest", "oldest", "mostused")
+        ],
+        "users": ["/api/users", "/api/users?page=2"],
+        "messages": [
+            f"/api/messages?conversation={x}&after=beginning" for x in conversations
+        ],
+        "search": [f"/api/search?search={quote(x)}" for x in words],
+        "substring search": [
+            f"/api/search?search={quote(x[:3])}&substring=true"
+            for x in words
+            if substring
+        ],
+        "stats": ["/api/globalstats"],
+        "media": media,
+    }
+
+
+def serve(
+    db_path: Path,
+    media_path: Path,
+    threads: int,
+    cache: bool,
+    started: Queue,
+    port: int = None,
+):
+    """runs the server until the process is killed, after putting its port in
+    `started`. the server gets a ReaderPool with `threads` threads, or, if threads is
+    0, a single TwitterDataReader, whose methods are called on the IOLoop. its
+    response cache is turned off unless `cache` is True. if a port is given, it's
+    shared with any other processes serving it, like the workers in main.py."""
+    logging.getLogger("tornado.access").setLevel(logging.WARNING)
+    if threads:
+        reader = ReaderPool(db_path, media_path, media_path, threads)
+    else:
+        reader = TwitterDataReader(db_path, media_path, media_path, read_only=True)
+    server = ArchiveAPIServer(
+        reader,
+        media_path,
+        media_path,
+        0,
+        "none",
+        cached_response_bytes=CACHED_RESPONSE_BYTES if cache else 0,
+    )
+    if port:
+        sockets = bind_sockets(port, reuse_port=True)
+    else:
+        socket, port = bind_unused_port()
+        sockets = [socket]
+    HTTPServer(server.application).add_sockets(sockets)
+    started.put(port)
+    IOLoop.current().start()
+
+
+async def load(
+    port: int, urls: dict[str, list[str]], concurrency: int, total: int, seed: int
+) -> tuple[dict[str, list[float]], float]:
+    """makes `total` requests of random kinds with `concurrency` of them in flight at
+    a time and returns the number of milliseconds each one took, by kind, and the
+    number of seconds that they took altogether."""
+    random = Random(seed)
+    requests = [
+        (kind, random.choice(urls[kind]))
+        for kind in random.choices([x for x in urls if urls[x]], k=total)
+    ]
+    client = AsyncHTTPClient(max_clients=concurrency)
+    latencies = defaultdict(list)
+    start = perf_counter()
+
+    async def make_requests():
+        while requests:
+            kind, url = requests.pop()
+            start = perf_counter()
+            response = await client.fetch(
+                f"http://127.0.0.1:{port}{url}", raise_error=False
+            )
+            latencies[kind].append((perf_counter() - start) * 1000)
+            if response.code != 200:
+                print(f"{url}: {response.code}")
+
+    await asyncio.gather(*(make_requests() for _ in range(concurrency)))
+    client.close()
+    return latencies, perf_counter() - start
+
+
+def report(name: str, latencies: dict[str, list[float]], seconds: float):
+    everything = [y for x in latencies.values() for y in x]
+    print(f"{name} {len(everything) / seconds:.1f} requests/second")
+    for kind, times in sorted(latencies.items()) + [("all", everything)]:
+        p99 = quantiles(times, n=100)[98] if len(times) > 1 else times[0]
+        print(
+            f"  {kind}: {len(times)} requests, median {median(times):.1f}ms, "
+            f"p99 {p99:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the server's response times for a mix of requests made "
+        "at the same time, with database calls run in the reader pool's threads and "
+        "with them run directly on the IOLoop, and then with the response cache; "
+        "or, with --workers, the throughput of different numbers of server "
+        "processes."
+    )
+    parser.add_argument("db_path", type=Path, help="Archive database to serve.")
+    parser.add_argument(
+        "-m",
+        "--media",
+        type=Path,
+        default=Path.cwd() / "DemoData" / "media",
+        help="Folder that the archive's media is in.",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=20,
+        help="How many requests to have in flight at a time.",
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=1000, help="How many requests to make."
+    )
+    parser.add_argument(
+        "-t", "--threads", type=int, default=4, help="Size of the reader pool."
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        nargs="+",
+        help="Numbers of worker processes to compare, like main.py's --workers, "
+        "each with its own reader pool and with the response cache turned off.",
+    )
+    args = parser.parse_args()
+
+    urls = sample_requests(args.db_path)
+    if args.workers:
+        socket, port = bind_unused_port()
+        socket.close()
+        for workers in args.workers:
+            started = Queue()
+            servers = [
+                Process(
+                    target=serve,
+                    args=(args.db_path, args.media, args.threads, False, started, port),
+                )
+                for _ in range(workers)
+            ]
+            for server in servers:
+                server.start()
+            for _ in servers:
+                started.get()
+            latencies, seconds = asyncio.run(
+                load(port, urls, args.concurrency, args.requests, seed=1)
+            )
+            for server in servers:
+                server.terminate()
+                server.join()
+            report(
+                f"{workers} worker process{'es' if workers > 1 else ''}:",
+                latencies,
+                seconds,
+            )
+        sys.exit()
+
+    for threads, cache in ((0, False), (args.threads, False), (args.threads, True)):
+        started = Queue()
+        server = Process(
+            target=serve, args=(args.db_path, args.media, threads, cache, started)
+        )
+        server.start()
+        port = started.get()
+        latencies, seconds = asyncio.run(
+            load(port, urls, args.concurrency, args.requests, seed=1)
+        )
+        server.terminate()
+        server.join()
+        report(
+            (
+                f"database calls run in {threads} reader pool threads"
+                if threads
+                else "database calls run directly on the IOLoop"
+            )
+            + (", with the response cache:" if cache else ":"),
+            latencies,
+            seconds,
+        )
@@ -5,7 +5,7 @@ from DemoData.demo_constants import DEMO_ACCOUNT_ID, DEMO_ACCOUNT_USERNAME
 from pathlib import Path
 from tornado.ioloop import IOLoop
 from ArchiveAccess.DBWrite import TwitterDataWriter
-from ArchiveAccess.DBRead import TwitterDataReader
+from ArchiveAccess.ReaderPool import ReaderPool
 from ArchiveAccess.APIServer import ArchiveAPIServer
 import argparse
 from typing import Final
@@ -14,6 +14,9 @@ import json
 db_path: Final = Path.cwd() / "db" / (DEMO_ACCOUNT_USERNAME + ".db")
 
 
+media_path: Final = Path.cwd() / "DemoData" / "media"
+
+
 async def create_demo_db(overwrite, bearer_token):
     db_store = TwitterDataWriter(
         db_path,
@@ -21,6 +24,8 @@ async def create_demo_db(overwrite, bearer_token):
         DEMO_ACCOUNT_ID,
         bearer_token,
         automatic_overwrite=overwrite,
+        dm_media_path=media_path,
+        group_media_path=media_path,
     )
     for message in readme:
         db_store.add_message(message, True)
@@ -75,14 +80,13 @@ if __name__ == "__main__":
     else:
         bearer_token = args.bearer_token or None
 
-    media_path = Path.cwd() / "DemoData" / "media"
-
     async def init():
         await create_demo_db(args.overwrite, bearer_token)
 
     IOLoop.current().run_sync(init)
 
-    reader = TwitterDataReader(db_path, media_path, media_path)
+    # nothing writes to the demo archive once it's been created
+    reader = ReaderPool(db_path, media_path, media_path, immutable=True)
     server = ArchiveAPIServer(
         reader,
         media_path,
@@ -0,0 +1,49 @@
+from ArchiveAccess.DBWrite import TwitterUserEnricher
+from pathlib import Path
+from tornado.ioloop import IOLoop
+import argparse
+import json
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download the usernames, display names, bios and avatars of the "
+        "users in an existing archive database that don't have them yet. Stop the "
+        "web client before running this; when it's started without a bearer token, "
+        "it opens the database in a mode that assumes nothing else will change it."
+    )
+    parser.add_argument(
+        "path_to_db",
+        help="The path of the .db file to fill in; this will be something like "
+        "db/YourUserName.db",
+    )
+    parser.add_argument(
+        "-b",
+        "--bearer_token",
+        required=True,
+        help="A bearer token obtained from the Twitter developer portal. This can be "
+        "either the token itself or a path to a JSON file with a 'bearer_token' "
+        "field.",
+    )
+    parser.add_argument(
+        "-s",
+        "--batch_size",
+        type=int,
+        default=100,
+        help="How many users to request and save at a time (100 at most).",
+    )
+    args = parser.parse_args()
+
+    if not Path(args.path_to_db).exists():
+        parser.error(f"no database found at {args.path_to_db}")
+
+    if Path(args.bearer_token).exists():
+        with open(args.bearer_token) as key_file:
+            bearer_token = json.load(key_file)["bearer_token"]
+    else:
+        bearer_token = args.bearer_token
+
+    enricher = TwitterUserEnricher(args.path_to_db, bearer_token, args.batch_size)
+    try:
+        IOLoop.current().run_sync(enricher.enrich)
+    finally:
+        enricher.close()
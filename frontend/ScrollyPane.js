@@ -8,7 +8,10 @@ ScrollyPane.propTypes = {
   // items because of the user scrolling or because it is empty. as successive
   // requests are made, the page number (starting from 1) will simply be added to the
   // end of this url. requests to /api/whatever should therefore end with the query
-  // parameter "?page=" and the correct value will be filled in
+  // parameter "?page=" and the correct value will be filled in. if a response
+  // contains a "cursor" field, the next request will replace "page=" at the end of
+  // the url with "cursor=" followed by that cursor instead, and a null cursor means
+  // that there are no more items.
   url: PropTypes.string.isRequired,
   // function that will process the json-parsed response from url and will return an
   // array of objects that can be rendered in the pane; this array will be
@@ -153,12 +156,18 @@ export default function ScrollyPane(props) {
     ) {
       setLoading(true);
 
-      fetch(props.url + page).then((r) =>
+      const url =
+        typeof page == "string"
+          ? props.url.replace(/page=$/, "cursor=") + encodeURIComponent(page)
+          : props.url + page;
+      fetch(url).then((r) =>
         r.json().then((j) => {
           const processedItems = props.processItems(j);
           setItems((oldItems) => oldItems.concat(processedItems));
           if (!processedItems.length) {
             setPage(-1);
+          } else if (j.cursor !== undefined) {
+            setPage(j.cursor === null ? -1 : j.cursor);
           } else {
             setPage((prevPage) => (prevPage == -1 ? prevPage : prevPage + 1));
           }
@@ -1,17 +1,28 @@
 from ArchiveAccess.JSONStream import PrefixedJSON, MessageStream
 import json
-from ArchiveAccess.DBWrite import TwitterDataWriter
-from ArchiveAccess.DBRead import TwitterDataReader
-from ArchiveAccess.APIServer import ArchiveAPIServer
+from ArchiveAccess.DBWrite import TwitterDataWriter, TwitterUserEnricher
+from ArchiveAccess.ReaderPool import ReaderPool
+from ArchiveAccess.APIServer import ArchiveAPIServer, ResponseCache, build_frontend
 from pathlib import Path
+from typing import Union
 from tornado.ioloop import IOLoop
 import asyncio
+import multiprocessing
+import secrets
+import socket
+import sqlite3
 import sys
 import argparse
 import traceback
+from contextlib import closing
 
 
-async def main(data_path: Path, bearer_token: str, overwrite: bool):
+async def main(
+    data_path: Path,
+    overwrite: bool,
+    substring_search: bool = False,
+    search_index: str = "full",
+):
     manifest_path = data_path / "manifest.js"
     with PrefixedJSON(manifest_path) as manifest_file:
         manifest = json.load(manifest_file)
@@ -21,8 +32,16 @@ async def main(data_path: Path, bearer_token: str, overwrite: bool):
             db_path,
             manifest["userInfo"]["userName"],
             manifest["userInfo"]["accountId"],
-            bearer_token,
+            # user data is fetched by enrich_users once the server is running so
+            # that importing messages never has to wait on the network
+            None,
             automatic_overwrite=overwrite,
+            dm_media_path=data_path / "direct_messages_media",
+            group_media_path=data_path / "direct_messages_group_media",
+            substring_search=substring_search,
+            text_search_mode=search_index,
+            # whether there's a bearer token for that is reported after the import
+            enrich_later=True,
         )
         try:
 
@@ -86,6 +105,75 @@ async def main(data_path: Path, bearer_token: str, overwrite: bool):
     return db_path
 
 
+def missing_user_data(db_path: Path) -> bool:
+    """checks whether any users in the database still need data from twitter."""
+    with closing(sqlite3.connect(db_path)) as db:
+        return bool(
+            db.execute(
+                "select 1 from users where loaded_full_data=0 limit 1;"
+            ).fetchone()
+        )
+
+
+async def enrich_users(
+    db_path: Path,
+    bearer_token: str,
+    reader: Union[ReaderPool, None],
+    response_cache: Union[ResponseCache, None],
+):
+    """fetches twitter data for any users in the database that don't have it yet
+    while the server is running, evicting each batch of users from the reader's caches
+    and the responses that show them from the server's cache once it's saved so the
+    new names and avatars show up right away. when the server runs in other
+    processes, there's no reader here, and they find out about the changes with
+    ArchiveAPIServer.watch_for_changes instead."""
+
+    def batch_saved(ids: list):
+        if reader is not None:
+            for id in ids:
+                reader.uncache_user(id)
+        if response_cache is not None:
+            response_cache.invalidate("user names", *(("user", int(x)) for x in ids))
+
+    enricher = TwitterUserEnricher(db_path, bearer_token, on_batch_saved=batch_saved)
+    try:
+        await enricher.enrich()
+    except:
+        traceback.print_exc()
+        print(
+            "could not connect to Twitter API for user data; check that you "
+            "are online, your bearer token was valid, and that Twitter still "
+            "exists. users will be shown in the archive by their ID numbers"
+        )
+    finally:
+        enricher.close()
+
+
+def serve_worker(
+    db_path: Path,
+    dm_media_path: Path,
+    group_media_path: Path,
+    immutable: bool,
+    port: int,
+    password: str,
+    cookie_secret: str,
+):
+    """runs one of the server processes started by --workers, which all listen on
+    the same port."""
+    reader = ReaderPool(db_path, dm_media_path, group_media_path, immutable=immutable)
+    server = ArchiveAPIServer(
+        reader,
+        dm_media_path,
+        group_media_path,
+        build_mode="no_build",
+        port=port,
+        password=password,
+        cookie_secret=cookie_secret,
+    )
+    server.watch_for_changes()
+    server.start(reuse_port=True)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Load messages from a Twitter data archive and display "
@@ -108,9 +196,10 @@ if __name__ == "__main__":
         "the token itself or a path to a JSON file with a 'bearer_token' field. If "
         "this is not supplied, users will be identified only with numbers (although "
         "you can then go through and give them nicknames for the purposes of "
-        "viewing the archive.) This is only needed when creating a database; "
-        "if you're invoking this command later to re-start the web client, ignore "
-        "this.",
+        "viewing the archive.) User data is downloaded in the background while the "
+        "web client is running, and only for users that don't have it yet, so you "
+        "can also supply this later to fill in the data for a database that was "
+        "created without it.",
     )
     parser.add_argument(
         "-o",
@@ -118,9 +207,32 @@ if __name__ == "__main__":
         action="store_true",
         help="This flag causes any existing database generated for an account with "
         "this program to be overwritten with a newly-created database. Use this "
-        "option if, for example, you initially created the database without user "
-        "data being fetched and you want to create a new database while supplying "
-        "a bearer token.",
+        "option if, for example, you want to re-import your archive from a newer "
+        "download.",
+    )
+    parser.add_argument(
+        "-s",
+        "--substring_search",
+        action="store_true",
+        help="This flag builds an extra search index when your archive is imported "
+        "that lets you search for parts of words, pieces of links, and text in "
+        "languages like Chinese and Japanese that aren't written with spaces between "
+        "words. It makes the database file bigger (see benchmark_search.py to find "
+        "out how much) and only takes effect when a database is created, so use it "
+        "together with --overwrite for an archive you've already imported.",
+    )
+    parser.add_argument(
+        "-si",
+        "--search_index",
+        choices=["full", "column", "content"],
+        default="full",
+        help="How much detail to keep in the index that messages are searched with. "
+        '"full" (the default) supports searching for phrases in quotes; "column" '
+        "makes the index smaller by searching for the words in phrases separately; "
+        '"content" makes it smaller still, but searches limited to one conversation '
+        "or user have to check every match against the limit, so they're slower. "
+        "Like --substring_search, this only takes effect when a database is created, "
+        "and benchmark_search.py --modes can tell you how big each option would be.",
     )
     parser.add_argument(
         "-pw",
@@ -148,7 +260,18 @@ if __name__ == "__main__":
         'frontend to be built once so that you can use it, and "no_build" (the '
         "default) if you are using a pre-made main.js bundle from a release. ",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="How many processes to serve the archive with. More than one lets the "
+        "server use more than one CPU core when lots of people are browsing the "
+        "archive at once. Not available on Windows.",
+    )
     args = parser.parse_args()
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--workers is not supported on this platform")
 
     db_path = ""
     data_path = args.path_to_data
@@ -161,7 +284,9 @@ if __name__ == "__main__":
 
     async def locate_or_create_db():
         global db_path
-        db_path = await main(Path(data_path), bearer_token, args.overwrite)
+        db_path = await main(
+            Path(data_path), args.overwrite, args.substring_search, args.search_index
+        )
 
     IOLoop.current().run_sync(locate_or_create_db)
 
@@ -170,13 +295,66 @@ if __name__ == "__main__":
     dm_media_path = Path(data_path) / "direct_messages_media"
     group_media_path = Path(data_path) / "direct_messages_group_media"
 
-    reader = TwitterDataReader(db_path, dm_media_path, group_media_path)
-    server = ArchiveAPIServer(
-        reader,
-        dm_media_path,
-        group_media_path,
-        build_mode=args.mode,
-        port=args.port,
-        password=args.password,
-    )
-    server.start()
+    # unless user data is going to be saved while the server is running, nothing will
+    # write to the archive itself, so it can be opened as immutable, which is faster
+    enriching = bool(bearer_token) and missing_user_data(db_path)
+    if bearer_token and not enriching:
+        print("all users in the database already have their twitter data")
+    elif not bearer_token:
+        print(
+            "no bearer token provided; not fetching user data. users will be "
+            "shown in the archive by their ID numbers"
+        )
+
+    if args.workers > 1:
+        build_frontend(args.mode)
+        # the workers check each other's authentication cookies with this
+        cookie_secret = secrets.token_urlsafe(32)
+        # spawned instead of forked so that they don't inherit this process's
+        # IOLoop or database connections
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(
+                target=serve_worker,
+                args=(
+                    db_path,
+                    dm_media_path,
+                    group_media_path,
+                    not enriching,
+                    args.port,
+                    args.password,
+                    cookie_secret,
+                ),
+                daemon=True,
+            )
+            for _ in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        print(
+            f"starting {args.workers} server processes at "
+            f"http://localhost:{args.port}"
+        )
+        if enriching:
+            IOLoop.current().run_sync(
+                lambda: enrich_users(db_path, bearer_token, None, None)
+            )
+        for worker in workers:
+            worker.join()
+    else:
+        reader = ReaderPool(
+            db_path, dm_media_path, group_media_path, immutable=not enriching
+        )
+        server = ArchiveAPIServer(
+            reader,
+            dm_media_path,
+            group_media_path,
+            build_mode=args.mode,
+            port=args.port,
+            password=args.password,
+        )
+        if enriching:
+            IOLoop.current().spawn_callback(
+                enrich_users, db_path, bearer_token, reader, server.response_cache
+            )
+        server.start()
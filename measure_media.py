@@ -0,0 +1,46 @@
+from ArchiveAccess.MediaDimensions import fill_media_dimensions
+from pathlib import Path
+import argparse
+import sqlite3
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the width and height of any media files in an existing "
+        "archive database that haven't been measured yet, so that the web client "
+        "never has to open media files to lay out messages. Stop the web client before "
+        "running this, since it opens the database in a mode that assumes nothing "
+        "else will change it."
+    )
+    parser.add_argument(
+        "path_to_db",
+        help="The path of the .db file to fill in; this will be something like "
+        "db/YourUserName.db",
+    )
+    parser.add_argument(
+        "path_to_data",
+        help=r'The path of the "data" folder from your unzipped Twitter data '
+        r"archive that the database was created from.",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        help="How many processes to measure media files with; defaults to the "
+        "number of processors on this machine.",
+    )
+    args = parser.parse_args()
+
+    if not Path(args.path_to_db).exists():
+        parser.error(f"no database found at {args.path_to_db}")
+
+    data_path = Path(args.path_to_data)
+    connection = sqlite3.connect(args.path_to_db, timeout=30, isolation_level=None)
+    try:
+        fill_media_dimensions(
+            connection,
+            data_path / "direct_messages_media",
+            data_path / "direct_messages_group_media",
+            args.processes,
+        )
+    finally:
+        connection.close()
@@ -1,12 +1,18 @@
 from ArchiveAccess.DBWrite import TwitterDataWriter
 from ArchiveAccess.DBRead import TwitterDataReader
+from ArchiveAccess.APIServer import Media
 from pytest import fixture
+from tornado.httpclient import AsyncHTTPClient, HTTPResponse
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application
 from datetime import datetime
 from typing import Final, Iterable, Union
 from random import uniform, choice, randrange
 from string import ascii_letters
 import json
 import asyncio
+from pathlib import Path
 
 DATE_FORMAT: Final = "%Y-%m-%dT%H:%M:%S.%fZ"
 
@@ -20,17 +26,30 @@ AMAZINGPHIL: Final = 14631115
 @fixture
 def writer():
     tdw = TwitterDataWriter(
-        "file:memdb1?mode=memory&cache=shared", "test", MAIN_USER_ID
+        "file:memdb1?mode=memory&cache=shared", "test", MAIN_USER_ID, "dummy token"
     )
     tdw.api_client.http_client = DummyHTTPClient()
     yield tdw
     tdw.close()
 
 
+@fixture
+def offline_writer():
+    tdw = TwitterDataWriter(
+        "file:memdb1?mode=memory&cache=shared", "test", MAIN_USER_ID, None
+    )
+    yield tdw
+    tdw.close()
+
+
 @fixture
 def connected_writer():
+    bearer_token = None
+    if Path("api_keys.json").exists():
+        with open("api_keys.json") as key_file:
+            bearer_token = json.load(key_file)["bearer_token"]
     tdw = TwitterDataWriter(
-        "file:memdb1?mode=memory&cache=shared", "test", MAIN_USER_ID
+        "file:memdb1?mode=memory&cache=shared", "test", MAIN_USER_ID, bearer_token
     )
     yield tdw
     tdw.close()
@@ -38,7 +57,7 @@ def connected_writer():
 
 @fixture
 def reader():
-    tdr = TwitterDataReader("file:memdb1?mode=memory&cache=shared")
+    tdr = TwitterDataReader("file:memdb1?mode=memory&cache=shared", Path(), Path())
     tdr.set_trace_callback(lambda x: print("SQL: " + x))
     yield tdr
     tdr.close()
@@ -226,3 +245,36 @@ def generate_name_update(
         "type": "conversationNameUpdate",
         "conversationId": conversation_id,
     }
+
+
+def serve(handlers: list[tuple], **settings) -> tuple[HTTPServer, str]:
+    """starts a server for some of the api's handlers on the current IOLoop and
+    returns it along with the url that the api's paths go after."""
+    socket, port = bind_unused_port()
+    http_server = HTTPServer(Application(handlers, **settings))
+    http_server.add_sockets([socket])
+    return http_server, f"http://127.0.0.1:{port}/api/"
+
+
+def media_handler(media: Path, require_password: bool = False) -> tuple:
+    """the api's media route, serving both group and individual media from one
+    folder without a reader."""
+    return (
+        r"/api/media/(group|individual)/(.+)",
+        Media,
+        {
+            "reader": None,
+            "group_media": str(media),
+            "individual_media": str(media),
+            "require_password": require_password,
+        },
+    )
+
+
+async def fetch(
+    url: str, method: str = "GET", body: str = None, **headers
+) -> HTTPResponse:
+    """makes a request without raising an exception for error responses."""
+    return await AsyncHTTPClient().fetch(
+        url, method=method, body=body, headers=headers, raise_error=False
+    )
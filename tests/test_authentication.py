@@ -0,0 +1,40 @@
+"""tests that the authentication cookie given out by one server process is accepted
+by any other process that has the same cookie secret, as when running with
+--workers, and by no others."""
+
+from ArchiveAccess.APIServer import Authenticator
+from tests.message_utils import serve, media_handler, fetch
+from pathlib import Path
+from pytest import mark
+
+
+@mark.asyncio
+async def test_shared_authentication(tmp_path: Path):
+    (tmp_path / "1-image.jpg").write_bytes(b"image")
+    servers = [
+        serve(
+            [
+                ("/api/authenticate", Authenticator, {"password": "hunter2"}),
+                media_handler(tmp_path, require_password=True),
+            ],
+            cookie_secret=secret,
+        )
+        for secret in ("shared", "shared", "other")
+    ]
+    (_, first), (_, second), (_, other) = servers
+
+    response = await fetch(first + "authenticate", "POST", "wrong")
+    assert response.code == 403
+    response = await fetch(first + "authenticate", "POST", "hunter2")
+    assert response.code == 200
+    cookie = response.headers["Set-Cookie"].split(";")[0]
+
+    assert (await fetch(second + "media/group/1-image.jpg")).code == 403
+    response = await fetch(second + "media/group/1-image.jpg", Cookie=cookie)
+    assert response.code == 200 and response.body == b"image"
+    assert (await fetch(other + "media/group/1-image.jpg", Cookie=cookie)).code == 403
+    # a server that accepts the cookie can renew it without the password
+    response = await fetch(second + "authenticate", "POST", "", Cookie=cookie)
+    assert response.code == 200 and "Set-Cookie" in response.headers
+    for http_server, _ in servers:
+        http_server.stop()
@@ -4,12 +4,13 @@ this module tests that the user data that SimpleTwitterAPIClient retrieves is co
 and is saved, and checks that the attributes set by cache_conversation_stats.sql are
 accurate."""
 
-from ArchiveAccess.DBWrite import TwitterDataWriter
+from ArchiveAccess.DBWrite import TwitterDataWriter, TwitterUserEnricher
 import pytest
 from pytest import fixture
 from collections import deque
 from typing import Final, Iterable
 from datetime import datetime
+from pathlib import Path
 from random import uniform, choice, randrange
 from string import ascii_letters
 from tornado.httpclient import HTTPRequest
@@ -21,7 +22,9 @@ from tests.message_utils import (
     OBAMA,
     AMAZINGPHIL,
     writer,
+    offline_writer,
     connected_writer,
+    DummyHTTPClient,
     generate_messages,
     generate_conversation,
 )
@@ -80,7 +83,6 @@ async def test_normal_individual_conversation(connected_writer: TwitterDataWrite
     ).fetchone() == (
         conversation_id,
         "individual",
-        None,
         20,
         10,
         int(users[1]),
@@ -90,6 +92,8 @@ async def test_normal_individual_conversation(connected_writer: TwitterDataWrite
         None,
         2,
         0,
+        None,
+        None,
     )
 
     assert check_dog_rates(connected_writer) == 10
@@ -138,7 +142,6 @@ async def test_onesided_individual_conversation(writer: TwitterDataWriter):
     ).fetchone() == (
         conversation_id,
         "individual",
-        None,
         5,
         0,
         int(talking_user),
@@ -148,6 +151,8 @@ async def test_onesided_individual_conversation(writer: TwitterDataWriter):
         None,
         2,
         0,
+        None,
+        None,
     )
 
     assert check_dog_rates(writer) == 5
@@ -194,7 +199,6 @@ async def test_othersided_individual_conversation(writer: TwitterDataWriter):
     ).fetchone() == (
         conversation_id,
         "individual",
-        None,
         8,
         8,
         DOG_RATES,
@@ -204,6 +208,8 @@ async def test_othersided_individual_conversation(writer: TwitterDataWriter):
         None,
         2,
         0,
+        None,
+        None,
     )
 
     assert check_dog_rates(writer) == 0
@@ -270,7 +276,6 @@ async def test_simple_group_conversation(writer: TwitterDataWriter):
     ).fetchone() == (
         conversation_id,
         "group",
-        None,
         sum(message_counts),
         message_counts[0],
         None,
@@ -280,6 +285,8 @@ async def test_simple_group_conversation(writer: TwitterDataWriter):
         None,
         len(users),
         1,
+        "bim bam boom",
+        f"@{OBAMA}, We Rate Dogs, @{MAIN_USER_ID}",
     )
 
     assert check_dog_rates(writer) == message_counts[1]
@@ -488,3 +495,64 @@ async def test_conversation_ended_by_various_events(writer: TwitterDataWriter):
         assert writer.execute(
             "select last_time from conversations where id=?;", (conversation_id,)
         ).fetchone() == (conversation_end_time,)
+
+
+@pytest.mark.asyncio
+async def test_enrich_existing_database(offline_writer: TwitterDataWriter):
+    """creates a database without a bearer token and then fills in the user data
+    afterwards with a TwitterUserEnricher, the way main.py does while serving."""
+    messages = generate_conversation(
+        (3, 2, 2),
+        ("2020-01-01T10:00:00.100Z",) * 3,
+        ("2020-01-10T10:00:00.100Z",) * 3,
+        "enrich-later",
+        (DOG_RATES, OBAMA, AMAZINGPHIL),
+    )
+    for message in messages:
+        offline_writer.add_message(message, True)
+    await offline_writer.finalize()
+
+    assert offline_writer.execute(
+        "select count() from users where loaded_full_data=0;"
+    ).fetchone() == (3,)
+
+    saved_batches = []
+    enricher = TwitterUserEnricher(
+        "file:memdb1?mode=memory&cache=shared",
+        "dummy token",
+        batch_size=2,
+        on_batch_saved=saved_batches.append,
+    )
+    enricher.api_client.http_client = DummyHTTPClient()
+    await enricher.enrich()
+    enricher.close()
+
+    assert check_dog_rates(offline_writer) == 3
+    assert saved_batches == [[DOG_RATES]]
+    assert enricher.enriched_users == 1
+    # the dummy http client doesn't know anything about the other users, so they
+    # are left to be requested again next time
+    assert offline_writer.execute(
+        "select count() from users where loaded_full_data=0;"
+    ).fetchone() == (2,)
+
+
+@pytest.mark.asyncio
+async def test_media_dimensions(writer: TwitterDataWriter):
+    """checks that finalize measures the media files it can find and leaves the
+    dimensions of the ones it can't empty."""
+    writer.dm_media_path = Path("DemoData/media")
+    writer.group_media_path = Path("DemoData/media")
+    messages = generate_messages(
+        2, "2020-01-01T10:00:00.100Z", "2020-01-10T10:00:00.100Z", "media", OBAMA
+    )
+    messages[0]["id"] = "1000000000000"
+    messages[0]["mediaUrls"] = ["https://video.twimg.com/dm_gif/1/seth.mp4"]
+    messages[1]["mediaUrls"] = ["https://video.twimg.com/dm_gif/2/missing.mp4"]
+    for message in messages:
+        writer.add_message(message, True)
+    await writer.finalize()
+
+    assert writer.execute(
+        "select width, height from media order by id;"
+    ).fetchall() == [(498, 280), (None, None)]
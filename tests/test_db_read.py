@@ -1,4 +1,4 @@
-from pytest import fixture, mark
+from pytest import fixture, mark, raises
 from tests.message_utils import (
     writer,
     reader,
@@ -18,6 +18,9 @@ from tests.message_utils import (
 from random import shuffle, choice, randint
 from tornado.ioloop import IOLoop
 from pprint import pprint
+from pathlib import Path
+from base64 import urlsafe_b64encode
+import json
 from ArchiveAccess.DBWrite import TwitterDataWriter
 from ArchiveAccess import DBRead
 from ArchiveAccess.DBRead import (
@@ -168,6 +171,27 @@ async def test_set_user_nicknotes(
     assert reader.get_users_by_id((OBAMA,), False)[0].notes == "was president"
 
 
+@mark.asyncio
+async def test_avatar_cache(writer: TwitterDataWriter, reader: TwitterDataReader):
+    for user in (DOG_RATES, OBAMA):
+        writer.add_message(
+            generate_messages(1, random_2010s_datestring(), "", "avatars", user)[0],
+            True,
+        )
+    await writer.finalize()
+
+    image, extension, etag = reader.get_user_avatar(DOG_RATES)
+    assert (image, extension) == (b"", "jpg")
+    assert etag.startswith('"') and etag.endswith('"')
+    assert reader.get_user_avatar(str(DOG_RATES)) == (image, extension, etag)
+    assert reader.get_cache_stats()["avatars"]["hits"] == 1
+    # users whose data couldn't be retrieved don't have avatars
+    assert reader.get_user_avatar(OBAMA) is None
+    # avatars can change when user data is retrieved again
+    reader.uncache_user(DOG_RATES)
+    assert DOG_RATES not in reader.avatars_cache
+
+
 @mark.asyncio
 async def test_conversations_by_time(
     writer: TwitterDataWriter, reader: TwitterDataReader
@@ -487,6 +511,197 @@ async def test_conversation_names(
     ]
 
 
+@mark.asyncio
+async def test_conversation_participant_names(
+    writer: TwitterDataWriter, reader: TwitterDataReader
+):
+    """checks that unnamed group chats are named after their most active
+    participants, that nicknames are worked into those names, and that a page of
+    conversations takes the same number of queries no matter what's in it."""
+    many_users = generate_conversation(
+        range(7, 0, -1),
+        [random_2000s_datestring()] * 7,
+        [random_2010s_datestring()] * 7,
+        "seven-people",
+        range(1, 8),
+    )
+    few_users = generate_conversation(
+        (2, 1),
+        [random_2000s_datestring()] * 2,
+        [random_2010s_datestring()] * 2,
+        "two-people",
+        (DOG_RATES, OBAMA),
+    )
+    group_chats = []
+    for i in range(DBRead.CONVERSATIONS_PER_PAGE):
+        group_chats += generate_messages(
+            1, random_2000s_datestring(), "", f"group-chat-{i}", i + 1
+        )
+    for message in many_users + few_users + group_chats:
+        writer.add_message(message, True)
+    await writer.finalize()
+
+    assert reader.get_conversation_by_id("seven-people").name == (
+        "@1, @2, @3, @4, @5, etc."
+    )
+    assert reader.get_conversation_by_id("two-people").name == (
+        f"We Rate Dogs, @{OBAMA}"
+    )
+
+    assert set(reader.set_user_nickname(OBAMA, "barack")) >= {"two-people"}
+    assert reader.get_conversation_by_id("two-people").name == (
+        "We Rate Dogs, barack"
+    )
+
+    statements = []
+    reader.set_trace_callback(statements.append)
+    page = reader.get_conversations_by_time(1)
+    assert len(page) == DBRead.CONVERSATIONS_PER_PAGE
+    assert len(statements) <= 3
+
+
+@mark.asyncio
+async def test_cursor_pagination(writer: TwitterDataWriter, reader: TwitterDataReader):
+    """walks through each listing that supports cursors and makes sure that following
+    the cursors gets the same results as counting up page numbers. lots of the sort
+    keys are tied, so this also checks that ties are broken consistently."""
+    start_times = ("2009-09-09T05:05:05.000Z", "2010-09-09T05:05:05.000Z")
+    end_time = "2011-09-09T05:05:05.000Z"
+    for i in range(45):
+        for message in generate_messages(
+            i % 3 + 1, start_times[i % 2], end_time, f"convo-{i}", DOG_RATES
+        ):
+            writer.add_message(message, True)
+        for message in generate_messages(
+            i % 4 + 1, start_times[i % 2], end_time, "everyone", 1000 + i
+        ):
+            writer.add_message(message, True)
+    await writer.finalize()
+
+    def by_pages(method, *args):
+        results, page_number = [], 1
+        while page := method(page_number, *args):
+            results += page
+            page_number += 1
+        return [x.id for x in results]
+
+    def by_cursors(method, *args):
+        page = method(1, *args)
+        results = list(page)
+        while page.cursor:
+            page = method(1, *args, cursor=page.cursor)
+            results += page
+        return [x.id for x in results]
+
+    listings = (
+        (reader.get_conversations_by_time, True),
+        (reader.get_conversations_by_time, False),
+        (reader.get_conversations_by_message_count, True, True, False),
+        (reader.get_conversations_by_user, DOG_RATES),
+        (reader.get_users_by_message_count,),
+        (reader.get_users_by_message_count, "everyone"),
+    )
+    for method, *args in listings:
+        if method == reader.get_conversations_by_user:
+            paged = by_pages(lambda p, *a, **k: method(args[0], p, **k))
+            cursored = by_cursors(lambda p, *a, **k: method(args[0], p, **k))
+        else:
+            paged = by_pages(method, *args)
+            cursored = by_cursors(method, *args)
+        assert len(paged) > DBRead.USERS_PER_PAGE
+        assert len(set(paged)) == len(paged)
+        assert cursored == paged
+
+    # a page after a cursor should be found with one index seek instead of by
+    # scanning through the earlier pages
+    first_page = reader.get_conversations_by_time(1, asc=False)
+    plans = reader.execute(
+        """explain query plan select id from conversations
+        where (last_time, id) < (?, ?) order by last_time desc, id desc limit 20;""",
+        DBRead.decode_cursor(first_page.cursor),
+    ).fetchall()
+    assert any("convo_lasttime_idx ((last_time,id)<(?,?))" in x[-1] for x in plans)
+
+
+def test_forged_cursors():
+    assert DBRead.decode_cursor(DBRead.encode_cursor("2010", "1-2")) == ["2010", "1-2"]
+    assert DBRead.decode_cursor(DBRead.encode_cursor(1.5, 3)) == [1.5, 3]
+    # these would be valid json but not valid placeholder values
+    for forged in ([[1], {}], ["a"], ["a", True], ["a", None], {"a": 1}):
+        encoded = urlsafe_b64encode(json.dumps(forged).encode()).decode()
+        with raises(ValueError):
+            DBRead.decode_cursor(encoded)
+    with raises(ValueError):
+        DBRead.decode_cursor("not base64!")
+
+
+@mark.asyncio
+async def test_bounded_caches(writer: TwitterDataWriter):
+    """makes sure the reader's caches stay within their limits, count their hits,
+    and drop conversations that embed a user when the user's nickname changes."""
+    for i in range(5):
+        writer.add_message(
+            generate_messages(
+                1,
+                random_2000s_datestring(),
+                "",
+                f"{1000 + i}-{MAIN_USER_ID}",
+                MAIN_USER_ID,
+                1000 + i,
+            )[0]
+        )
+    await writer.finalize()
+    reader = TwitterDataReader(
+        "file:memdb1?mode=memory&cache=shared",
+        Path(),
+        Path(),
+        max_cached_users=3,
+        max_cached_conversations=3,
+    )
+    ids = [f"{1000 + i}-{MAIN_USER_ID}" for i in range(5)]
+    reader.get_conversations_by_id(ids)
+    stats = reader.get_cache_stats()
+    assert stats["conversations"]["entries"] == 3
+    assert stats["conversations"]["evictions"] == 2
+    assert stats["users"]["entries"] == 3
+
+    statements = []
+    reader.set_trace_callback(statements.append)
+    assert reader.get_conversation_by_id(ids[-1]).name == "Mystery User (@1004)"
+    assert not statements
+    assert reader.get_cache_stats()["conversations"]["hits"] == 1
+
+    assert reader.set_user_nickname(1004, "nickname") == [ids[-1]]
+    assert reader.get_conversation_by_id(ids[-1]).name == "nickname"
+    reader.close()
+
+
+@mark.asyncio
+async def test_random_messages(writer: TwitterDataWriter, reader: TwitterDataReader):
+    messages = generate_messages(
+        100,
+        random_2000s_datestring(),
+        random_2010s_datestring(),
+        "a-conversation",
+        MAIN_USER_ID,
+    )
+    for message in messages:
+        writer.add_message(message, True)
+    await writer.finalize()
+
+    statements = []
+    reader.set_trace_callback(statements.append)
+    random_ids = [x.id for x in reader.get_random_messages()["results"]]
+    assert len(random_ids) == len(set(random_ids)) == DBRead.MESSAGES_PER_PAGE
+    assert set(random_ids) <= set(str(x["id"]) for x in messages)
+    # they don't come back in the order they're stored in
+    assert random_ids != sorted(random_ids, key=int)
+    # the messages are looked up by their positions instead of sorting the table
+    for statement in statements:
+        plan = reader.execute("explain query plan " + statement).fetchall()
+        assert not any(x[-1].startswith("SCAN messages") for x in plan)
+
+
 @mark.asyncio
 async def test_conversation_notes(
     writer: TwitterDataWriter, reader: TwitterDataReader
@@ -788,6 +1003,240 @@ async def test_text_search(writer: TwitterDataWriter, reader: TwitterDataReader)
     assert len(results) == len(texts)
 
 
+@mark.asyncio
+async def test_filtered_search(writer: TwitterDataWriter, reader: TwitterDataReader):
+    for name, sender, recipient in (
+        ("searchone", MAIN_USER_ID, AMAZINGPHIL),
+        ("searchtwo", OBAMA, MAIN_USER_ID),
+    ):
+        messages = generate_messages(
+            10,
+            random_2000s_datestring(),
+            random_2010s_datestring(),
+            name,
+            sender,
+            recipient,
+        )
+        for message in messages:
+            message["text"] = "the same words everywhere"
+            writer.add_message(message)
+    await writer.finalize()
+
+    def search(query, conversation="", user=""):
+        results = reader.traverse_messages(
+            conversation, user, after="beginning", search=query
+        )["results"]
+        ranked = reader.search_by_relevance(query, conversation, user)["results"]
+        assert sorted(x.id for x in results) == sorted(x.id for x in ranked)
+        return results
+
+    assert len(search("words")) == 20
+    in_one = search("words", conversation="searchone")
+    assert len(in_one) == 10
+    assert all(x.conversation == "searchone" for x in in_one)
+    from_obama = search("words", user=str(OBAMA))
+    assert len(from_obama) == 10
+    assert all(x.sender == str(OBAMA) for x in from_obama)
+    assert not search("words", conversation="searchone", user=str(OBAMA))
+    # the conversation and sender columns don't match the search itself
+    assert not search(str(OBAMA))
+    assert not search("searchone")
+    # this archive wasn't imported with substring search turned on
+    with raises(ValueError):
+        reader.traverse_messages(after="beginning", search="ord", substring=True)
+
+
+@mark.asyncio
+async def test_activity(writer: TwitterDataWriter, reader: TwitterDataReader):
+    # wednesday, friday, and friday again in one conversation; thursday in another
+    for time, conversation, sender, recipient in (
+        ("2020-01-01T10:00:00.000Z", "activityone", OBAMA, MAIN_USER_ID),
+        ("2020-01-03T10:30:00.000Z", "activityone", OBAMA, MAIN_USER_ID),
+        ("2020-01-03T23:59:59.000Z", "activityone", MAIN_USER_ID, OBAMA),
+        ("2020-01-02T00:00:00.000Z", "activitytwo", AMAZINGPHIL, MAIN_USER_ID),
+    ):
+        writer.add_message(
+            generate_messages(1, time, "", conversation, sender, recipient)[0]
+        )
+    await writer.finalize()
+
+    def weekly(counts):
+        week = [0] * 168
+        for hour, messages in counts.items():
+            week[hour] = messages
+        return week
+
+    assert reader.get_activity() == {
+        "first_day": "2020-01-01",
+        "daily": [1, 1, 2],
+        "weekly": weekly({3 * 24 + 10: 1, 4 * 24: 1, 5 * 24 + 10: 1, 5 * 24 + 23: 1}),
+    }
+    assert reader.get_activity(conversation="activityone") == {
+        "first_day": "2020-01-01",
+        "daily": [1, 0, 2],
+        "weekly": weekly({3 * 24 + 10: 1, 5 * 24 + 10: 1, 5 * 24 + 23: 1}),
+    }
+    assert reader.get_activity(user=OBAMA) == {
+        "first_day": "2020-01-01",
+        "daily": [1, 0, 1],
+        "weekly": weekly({3 * 24 + 10: 1, 5 * 24 + 10: 1}),
+    }
+    assert reader.get_activity(user=DOG_RATES) == {
+        "first_day": None,
+        "daily": [],
+        "weekly": [0] * 168,
+    }
+
+
+@mark.asyncio
+@mark.parametrize("mode", DBRead.TEXT_SEARCH_MODES.keys())
+async def test_text_search_modes(mode: str):
+    db = f"file:{mode}search?mode=memory&cache=shared"
+    writer = TwitterDataWriter(db, "test", MAIN_USER_ID, None, text_search_mode=mode)
+    reader = TwitterDataReader(db, Path(), Path())
+    texts = ("the dog walked home", "the walking dog is home", "walking the cat")
+    for name, sender in (("modeone", MAIN_USER_ID), ("modetwo", AMAZINGPHIL)):
+        messages = generate_messages(
+            len(texts),
+            random_2000s_datestring(),
+            random_2010s_datestring(),
+            name,
+            sender,
+            OBAMA,
+        )
+        for message, text in zip(messages, texts):
+            message["text"] = text
+            writer.add_message(message)
+    await writer.finalize()
+
+    def search(query, conversation="", user=""):
+        results = reader.traverse_messages(
+            conversation, user, after="beginning", search=query
+        )["results"]
+        ranked = reader.search_by_relevance(query, conversation, user)
+        assert sorted(x.id for x in results) == sorted(x.id for x in ranked["results"])
+        return sorted(x.content for x in results)
+
+    assert search("cat") == [texts[2]] * 2
+    assert search("walk", conversation="modetwo") == sorted(texts)
+    assert search("dog home", user=str(AMAZINGPHIL)) == sorted(texts[0:2])
+    # only the full index knows where words are, so it's the only one that can tell
+    # that "dog walked" is a phrase in one message and not the other
+    if mode == "full":
+        assert search('"dog walk"') == [texts[0]] * 2
+    else:
+        assert search('"dog walk"') == sorted(texts[0:2] * 2)
+    writer.close()
+    reader.close()
+
+
+@mark.asyncio
+async def test_substring_search(writer: TwitterDataWriter, reader: TwitterDataReader):
+    texts = (
+        "check out https://example.com/some/page",
+        "unbelievable",
+        "東京に行きました",
+        "nothing to see",
+    )
+    messages = generate_messages(
+        len(texts),
+        random_2000s_datestring(),
+        random_2010s_datestring(),
+        "substringconvo",
+        MAIN_USER_ID,
+        AMAZINGPHIL,
+    )
+    for message, text in zip(messages, texts):
+        message["text"] = text
+        writer.add_message(message)
+    writer.substring_search = True
+    await writer.finalize()
+
+    def search(query, substring=True):
+        return [
+            x.content
+            for x in reader.traverse_messages(
+                after="beginning", search=query, substring=substring
+            )["results"]
+        ]
+
+    assert search("example.com/some") == [texts[0]]
+    assert search("BELIEV") == [texts[1]]
+    assert search("lievable") == [texts[1]]
+    # the word index doesn't find parts of words
+    assert search("believ", substring=False) == []
+    # searches in languages without spaces use the substring index automatically
+    assert search("京に行", substring=False) == [texts[2]]
+    # but not when they're too short for it, which only fails if it was asked for
+    assert search("東京", substring=False) == []
+    with raises(ValueError):
+        search("東京")
+
+    ranked = reader.search_by_relevance("believ", substring=True)
+    assert ranked["highlights"][0].highlighted_content == "un<mark>believ</mark>able"
+
+
+@mark.asyncio
+async def test_ranked_search(writer: TwitterDataWriter, reader: TwitterDataReader):
+    messages = generate_messages(
+        DBRead.MESSAGES_PER_PAGE + 10,
+        random_2000s_datestring(),
+        random_2010s_datestring(),
+        "rankedconvo",
+        MAIN_USER_ID,
+        AMAZINGPHIL,
+    )
+    messages[0]["text"] = "home home home sweet home"
+    for message in messages[1:]:
+        message["text"] = "i went home and then i went somewhere else entirely"
+    messages[-1]["text"] = "no matches here"
+
+    for message in messages:
+        writer.add_message(message)
+    await writer.finalize()
+
+    first_page = reader.search_by_relevance("home")
+    assert first_page["results"][0].id == messages[0]["id"]
+    highlight = first_page["highlights"][0]
+    assert highlight.message == messages[0]["id"]
+    assert highlight.highlighted_content.count("<mark>home</mark>") == 4
+    ranks = [x.rank for x in first_page["highlights"]]
+    assert ranks == sorted(ranks)
+    assert len(first_page["results"]) == DBRead.MESSAGES_PER_PAGE
+    assert first_page["cursor"]
+
+    second_page = reader.search_by_relevance("home", cursor=first_page["cursor"])
+    assert second_page["cursor"] is None
+    ids = [x.id for x in first_page["results"] + second_page["results"]]
+    assert sorted(ids) == sorted(x["id"] for x in messages[:-1])
+
+    assert not reader.search_by_relevance("home", user=str(OBAMA))["results"]
+
+
+@mark.asyncio
+async def test_ranked_search_escaping(
+    writer: TwitterDataWriter, reader: TwitterDataReader
+):
+    message = generate_messages(
+        1,
+        random_2000s_datestring(),
+        random_2010s_datestring(),
+        "escapedconvo",
+        MAIN_USER_ID,
+        AMAZINGPHIL,
+    )[0]
+    message["text"] = "<img src=x onerror=alert(1)> tom &amp; jerry <b>cartoon</b>"
+    writer.add_message(message)
+    await writer.finalize()
+
+    highlight = reader.search_by_relevance("cartoon")["highlights"][0]
+    for text in (highlight.snippet, highlight.highlighted_content):
+        assert "<mark>cartoon</mark>" in text
+        unmarked = text.replace("<mark>", "").replace("</mark>", "")
+        assert "<" not in unmarked and ">" not in unmarked
+        assert "&lt;img" in unmarked and "tom &amp; jerry" in unmarked
+
+
 @mark.asyncio
 async def test_get_message(writer: TwitterDataWriter, reader: TwitterDataReader):
     message_with_media = {
@@ -872,5 +1321,53 @@ async def test_get_message(writer: TwitterDataWriter, reader: TwitterDataReader)
     )
 
 
+@mark.asyncio
+async def test_traverse_messages_statement_count(
+    writer: TwitterDataWriter, reader: TwitterDataReader
+):
+    """makes sure that the number of sql statements it takes to load a page of
+    messages doesn't grow with the number of messages on the page."""
+    messages = generate_conversation(
+        (DBRead.MESSAGES_PER_PAGE, DBRead.MESSAGES_PER_PAGE),
+        [random_2000s_datestring()] * 2,
+        [random_2010s_datestring()] * 2,
+        "busy-conversation",
+        (OBAMA, AMAZINGPHIL),
+    )
+    for message in messages:
+        message["reactions"] = [
+            {
+                "senderId": str(DOG_RATES),
+                "reactionKey": "funny",
+                "eventId": next(unique_id),
+                "createdAt": message["createdAt"],
+            }
+        ]
+        message["urls"] = [
+            {
+                "url": "https://t.co/somenonsense",
+                "expanded": "https://youtu.be/dQw4w9WgXcQ",
+                "display": "youtu.be/dQw4w9WgXcQ",
+            }
+        ]
+        message["text"] += " https://t.co/somenonsense"
+        writer.add_message(message, True)
+    await writer.finalize()
+
+    statements = []
+    reader.set_trace_callback(statements.append)
+    results = reader.traverse_messages(
+        conversation="busy-conversation", after="beginning"
+    )["results"]
+
+    assert len(results) == DBRead.MESSAGES_PER_PAGE
+    assert all(len(x.reactions) == 1 for x in results)
+    assert all("youtu.be/dQw4w9WgXcQ</a>" in x.html_content for x in results)
+    for table in ("timeline", "reactions", "media"):
+        assert len([x for x in statements if f"from {table}" in x]) == 1
+    assert not [x for x in statements if "from links" in x]
+    assert len(statements) <= 12
+
+
 # TODO: also, have a test that makes sure that the different user objects are
 # constructed correctly. and should probably go through and check conversation names
@@ -5,7 +5,7 @@ users obtained from the twitter api or final stats about conversations or
 participants calculated in cache_conversation_stats.sql are assumed to be absent
 here"""
 
-from ArchiveAccess.DBWrite import TwitterDataWriter
+from ArchiveAccess.DBWrite import TwitterDataWriter, render_html_content
 from pytest import fixture, mark
 from collections import deque
 from typing import Final
@@ -254,6 +254,28 @@ def test_add_message_with_link(writer: TwitterDataWriter, messages: deque[dict])
     )
 
 
+def test_render_html_content():
+    links = [
+        {
+            "url": "https://t.co/abc",
+            "expanded": "https://example.com/?a=1&b=2",
+            "display": "example.com/?a=1&b=2",
+        },
+        {
+            "url": "https://t.co/def",
+            "expanded": "https://twitter.com/messages/media/1",
+            "display": "pic.twitter.com/def",
+        },
+    ]
+    assert (
+        render_html_content(
+            "<b>fish</b> &amp; chips\nhttps://t.co/abc https://t.co/def", links
+        )
+        == "&lt;b&gt;fish&lt;/b&gt; &amp; chips<br />"
+        + '<a href="https://example.com/?a=1&amp;b=2">example.com/?a=1&amp;b=2</a>'
+    )
+
+
 def test_add_message_with_media(writer: TwitterDataWriter, messages: deque[dict]):
     image_message = messages.popleft()
     message_add_with_checks(writer, image_message)
@@ -415,13 +437,14 @@ def test_self_being_added(writer: TwitterDataWriter, messages: deque[dict]):
         None,
         None,
         None,
-        None,
         message["createdAt"],
         None,
         0,
         int(message["initiatingUserId"]),
         None,
         None,
+        None,
+        None,
     )
     check_user(writer, message["initiatingUserId"])
     check_participant(writer, message["initiatingUserId"], message["conversationId"])
@@ -488,7 +511,6 @@ def check_conversation(writer: TwitterDataWriter, message: dict, group_dm: bool)
         "group" if group_dm else "individual",
         None,
         None,
-        None,
         other_person,
         None,
         None,
@@ -496,6 +518,8 @@ def check_conversation(writer: TwitterDataWriter, message: dict, group_dm: bool)
         None,
         None,
         None,
+        None,
+        None,
     )
     check_participant(writer, MAIN_USER_ID, message["conversationId"])
 
@@ -515,8 +539,6 @@ def check_user(writer: TwitterDataWriter, user_id: str):
         None,
         None,
         None,
-        None,
-        None,
     )
 
 
@@ -0,0 +1,66 @@
+"""tests for the cache that the reader keeps users and conversations in."""
+
+from ArchiveAccess.LRUCache import LRUCache, approximate_size
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.get("b") is None
+    assert cache.stats() | {"bytes": 0} == {
+        "entries": 2,
+        "bytes": 0,
+        "max_entries": 2,
+        "max_bytes": None,
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+    }
+
+
+def test_byte_limit():
+    cache = LRUCache(max_bytes=approximate_size("x" * 100) * 2)
+    cache.put(1, "x" * 100)
+    cache.put(2, "y" * 100)
+    assert len(cache) == 2
+    cache.put(3, "z" * 100)
+    assert 1 not in cache and len(cache) == 2
+    assert cache.bytes <= cache.max_bytes
+    # values too big to ever fit aren't stored
+    cache.put(4, "w" * 1000)
+    assert 4 not in cache and len(cache) == 2
+    assert cache.pop(2) == "y" * 100
+    assert cache.bytes == approximate_size("z" * 100)
+
+
+def test_pop_where():
+    cache = LRUCache(max_bytes=10_000)
+    for i in range(10):
+        cache.put(i, {"even": i % 2 == 0})
+    assert cache.pop_where(lambda x: x["even"]) == 5
+    assert sorted(cache.entries) == [1, 3, 5, 7, 9]
+    assert cache.bytes == sum(size for _, size in cache.entries.values())
+
+
+def test_stale_puts():
+    cache = LRUCache(max_entries=10)
+    # a value read before an invalidation isn't stored, even if the key that was
+    # invalidated wasn't cached yet
+    generation = cache.generation
+    cache.pop("a")
+    cache.put("a", "stale", generation)
+    assert "a" not in cache
+    generation = cache.generation
+    cache.put("a", "fresh", generation)
+    cache.put("b", "also fresh", generation)
+    assert cache.get("a") == "fresh" and cache.get("b") == "also fresh"
+    for invalidate in (lambda: cache.pop_where(lambda x: False), cache.clear):
+        generation = cache.generation
+        invalidate()
+        cache.put("c", "stale", generation)
+        assert "c" not in cache
@@ -0,0 +1,79 @@
+"""tests for the handler that streams media files, which has to support range and
+conditional requests for videos to be seekable and for browsers' caches to work."""
+
+from ArchiveAccess.APIServer import parse_range
+from tests.message_utils import serve, media_handler, fetch as fetch_async
+from tornado.httpclient import HTTPResponse
+from tornado.ioloop import IOLoop
+from pathlib import Path
+from pytest import fixture, raises
+
+CONTENTS = bytes(range(256)) * 1000
+
+
+@fixture
+def server(tmp_path: Path):
+    media = tmp_path / "media"
+    media.mkdir()
+    (media / "1-video.mp4").write_bytes(CONTENTS)
+    (tmp_path / "secret.txt").write_text("not media")
+    http_server, url = serve([media_handler(media)])
+    yield url + "media/individual/"
+    http_server.stop()
+
+
+def fetch(url: str, method: str = "GET", **headers) -> HTTPResponse:
+    return IOLoop.current().run_sync(lambda: fetch_async(url, method, **headers))
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-499", 1000) == (0, 500)
+    assert parse_range("bytes=500-", 1000) == (500, 1000)
+    assert parse_range("bytes=-100", 1000) == (900, 1000)
+    assert parse_range("bytes=900-5000", 1000) == (900, 1000)
+    assert parse_range("bytes=0-1,5-6", 1000) is None
+    assert parse_range("bytes=-", 1000) is None
+    with raises(ValueError):
+        parse_range("bytes=1000-", 1000)
+
+
+def test_whole_file(server: str):
+    response = fetch(server + "1-video.mp4")
+    assert response.code == 200
+    assert response.body == CONTENTS
+    assert response.headers["Content-Type"] == "video/mp4"
+    assert response.headers["Content-Length"] == str(len(CONTENTS))
+    assert response.headers["Accept-Ranges"] == "bytes"
+    head = fetch(server + "1-video.mp4", "HEAD")
+    assert head.headers["Content-Length"] == str(len(CONTENTS))
+    assert head.body == b""
+
+
+def test_ranges(server: str):
+    response = fetch(server + "1-video.mp4", Range="bytes=100000-199999")
+    assert response.code == 206
+    assert response.body == CONTENTS[100000:200000]
+    assert response.headers["Content-Range"] == f"bytes 100000-199999/{len(CONTENTS)}"
+    response = fetch(server + "1-video.mp4", Range="bytes=-10")
+    assert response.body == CONTENTS[-10:]
+    response = fetch(server + "1-video.mp4", Range=f"bytes={len(CONTENTS)}-")
+    assert response.code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(CONTENTS)}"
+
+
+def test_conditional_requests(server: str):
+    response = fetch(server + "1-video.mp4")
+    etag, modified = response.headers["Etag"], response.headers["Last-Modified"]
+    response = fetch(server + "1-video.mp4", **{"If-None-Match": etag})
+    assert response.code == 304
+    assert response.body == b""
+    response = fetch(server + "1-video.mp4", **{"If-Modified-Since": modified})
+    assert response.code == 304
+    response = fetch(server + "1-video.mp4", **{"If-None-Match": '"different"'})
+    assert response.code == 200
+
+
+def test_missing_files(server: str):
+    assert fetch(server + "2-missing.jpg").code == 404
+    # files outside of the media folder can't be reached
+    assert fetch(server + "..%2Fsecret.txt").code == 404
@@ -0,0 +1,76 @@
+"""these tests make sure that probe_dimensions reads the sizes of the kinds of media
+files found in twitter archives from their headers correctly."""
+
+from ArchiveAccess.MediaProbe import probe_dimensions
+import struct
+import numpy
+import cv2
+
+
+def jpeg_bytes(width: int, height: int, orientation: int = None) -> bytes:
+    """creates the beginning of a jpeg file: a start of image marker, an optional
+    exif segment containing an orientation, and a baseline start of frame segment."""
+    data = b"\xff\xd8"
+    if orientation:
+        tiff = b"MM\x00\x2a" + struct.pack(">I", 8)
+        tiff += struct.pack(">H", 1) + struct.pack(
+            ">HHIHH", 0x0112, 3, 1, orientation, 0
+        )
+        tiff += struct.pack(">I", 0)
+        exif = b"Exif\x00\x00" + tiff
+        data += b"\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif
+    data += (
+        b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 1) + b"\x01\x11\x00"
+    )
+    return data + b"\xff\xd9"
+
+
+def test_jpeg(tmp_path):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(jpeg_bytes(640, 480))
+    assert probe_dimensions(path) == (640, 480)
+
+
+def test_rotated_jpeg(tmp_path):
+    path = tmp_path / "a.jpg"
+    path.write_bytes(jpeg_bytes(640, 480, orientation=6))
+    assert probe_dimensions(path) == (480, 640)
+    path.write_bytes(jpeg_bytes(640, 480, orientation=3))
+    assert probe_dimensions(path) == (640, 480)
+
+
+def test_png(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(
+        b"\x89PNG\r\n\x1a\n"
+        + struct.pack(">I4sII", 13, b"IHDR", 1200, 675)
+        + b"\x08\x06\x00\x00\x00"
+    )
+    assert probe_dimensions(path) == (1200, 675)
+
+
+def test_gif(tmp_path):
+    path = tmp_path / "a.gif"
+    path.write_bytes(b"GIF89a" + struct.pack("<HH", 320, 200) + b"\x00" * 10)
+    assert probe_dimensions(path) == (320, 200)
+
+
+def test_mp4():
+    # this file's moov box comes after its mdat box
+    assert probe_dimensions("DemoData/media/1000000000000-seth.mp4") == (498, 280)
+
+
+def test_unsupported(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("not an image")
+    assert probe_dimensions(path) is None
+    assert probe_dimensions(tmp_path / "missing.jpg") is None
+
+
+def test_agrees_with_cv2(tmp_path):
+    image = numpy.zeros((123, 321, 3), numpy.uint8)
+    for extension in ("jpg", "png"):
+        path = tmp_path / f"a.{extension}"
+        cv2.imwrite(str(path), image)
+        decoded = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        assert probe_dimensions(path) == (decoded.shape[1], decoded.shape[0])
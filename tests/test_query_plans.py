@@ -0,0 +1,24 @@
+"""makes sure that none of the queries in DBRead.READ_QUERIES have to read through
+an entire large table, which would make them slow on big archives."""
+
+from ArchiveAccess.DBWrite import SQL_SCRIPTS_PATH, create_text_search_index
+from ArchiveAccess.DBRead import READ_QUERIES, attach_annotations
+import sqlite3
+
+
+def test_no_full_scans():
+    # without any statistics from analyze, sqlite plans queries as if every table
+    # is big, which is what we want to check; an archive with a few test messages in
+    # it would have statistics that make scanning every table look like a good idea
+    db = sqlite3.connect(":memory:")
+    attach_annotations(db, ":memory:")
+    with open(SQL_SCRIPTS_PATH / "setup.sql") as setup:
+        db.executescript(setup.read())
+    create_text_search_index(db)
+    with open(SQL_SCRIPTS_PATH / "indexes.sql") as indexes:
+        db.executescript(indexes.read())
+    # the optional substring search index, which some of the search queries use
+    with open(SQL_SCRIPTS_PATH / "substring_search.sql") as substring_search:
+        db.executescript(substring_search.read())
+
+    assert READ_QUERIES.find_scans(db) == []
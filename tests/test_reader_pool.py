@@ -0,0 +1,119 @@
+"""tests for the pool of reader connections that the server runs queries with."""
+
+from tests.message_utils import generate_messages, MAIN_USER_ID, OBAMA
+from ArchiveAccess.DBWrite import TwitterDataWriter
+from ArchiveAccess.ReaderPool import ReaderPool
+from concurrent.futures import ThreadPoolExecutor
+from pytest import fixture, raises
+from tornado.ioloop import IOLoop
+from pathlib import Path
+import asyncio
+import sqlite3
+
+
+def create_archive(db_path: Path):
+    writer = TwitterDataWriter(db_path, "test", MAIN_USER_ID, None)
+    for i in range(20):
+        for message in generate_messages(
+            5,
+            "2010-01-01T10:00:00.100Z",
+            "2010-02-01T10:00:00.100Z",
+            f"{1000 + i}-{MAIN_USER_ID}",
+            1000 + i,
+            MAIN_USER_ID,
+        ):
+            writer.add_message(message)
+    IOLoop.current().run_sync(writer.finalize)
+    writer.close()
+
+
+@fixture
+def pool(tmp_path: Path):
+    db_path = tmp_path / "test.db"
+    create_archive(db_path)
+    pool = ReaderPool(db_path, Path(), Path(), size=3)
+    yield pool
+    pool.close()
+
+
+def test_readers_are_read_only(pool: ReaderPool):
+    assert pool.writer.execute("pragma journal_mode;").fetchone()[0] == "wal"
+    with pool.reader() as reader:
+        with raises(sqlite3.OperationalError):
+            reader.execute("update users set bio='no';")
+
+
+def test_parallel_reads(pool: ReaderPool):
+    def read(_):
+        return [x.id for x in pool.get_conversations_by_time(1)]
+
+    expected = read(None)
+    with ThreadPoolExecutor(6) as executor:
+        assert list(executor.map(read, range(30))) == [expected] * 30
+    # threads that aren't the pool's share one reader instead of opening their own
+    assert len(pool.connections) == 2
+
+
+def test_run_in_threads(pool: ReaderPool):
+    async def check():
+        # the event loop keeps running while a slow query runs in a pool thread
+        slow = pool.run(
+            "execute",
+            """with recursive n(x) as (select 1 union all select x+1 from n
+                where x < 1000000) select count() from n;""",
+        )
+        ticks = 0
+        while not slow.done():
+            await asyncio.sleep(0.001)
+            ticks += 1
+        assert ticks > 0
+        await slow
+        pages = await asyncio.gather(
+            *(pool.run("get_conversations_by_time", 1) for _ in range(12))
+        )
+        assert all(x == pages[0] for x in pages)
+        assert await pool.run("set_user_nickname", 1000, "pal") == [
+            f"1000-{MAIN_USER_ID}"
+        ]
+
+    IOLoop.current().run_sync(check)
+    # each of the pool's three threads opened one reader, at most
+    assert len(pool.connections) <= 4
+    assert pool.shared_reader is None
+
+
+def test_writes_invalidate_shared_caches(pool: ReaderPool):
+    conversation = f"1000-{MAIN_USER_ID}"
+    assert pool.get_conversation_by_id(conversation).name == "Mystery User (@1000)"
+    assert pool.set_user_nickname(1000, "pal") == [conversation]
+    # every reader shares the writer's caches, so none of them has a stale copy
+    for _ in range(3):
+        with pool.reader() as reader:
+            assert reader.get_conversation_by_id(conversation).name == "pal"
+
+
+def test_immutable_archive(tmp_path: Path):
+    db_path = tmp_path / "test.db"
+    create_archive(db_path)
+    archive = db_path.read_bytes()
+    conversation = f"1001-{MAIN_USER_ID}"
+
+    pool = ReaderPool(db_path, Path(), Path(), size=2, immutable=True)
+    assert pool.writer.execute("pragma journal_mode;").fetchone()[0] != "wal"
+    assert pool.set_user_nickname(1001, "buddy") == [conversation]
+    pool.set_user_notes(1001, "met at the park")
+    pool.set_conversation_notes(conversation, "about the park")
+    with pool.reader() as reader:
+        assert reader.get_conversation_by_id(conversation).name == "buddy"
+    pool.close()
+
+    # the annotations went into their own database and survive reopening, and the
+    # archive wasn't touched
+    assert (tmp_path / "test.annotations.db").exists()
+    assert db_path.read_bytes() == archive
+    assert not Path(str(db_path) + "-wal").exists()
+    pool = ReaderPool(db_path, Path(), Path(), size=1, immutable=True)
+    user = pool.get_users_by_id([1001], False)[0]
+    assert (user.nickname, user.notes) == ("buddy", "met at the park")
+    assert pool.get_conversation_by_id(conversation).notes == "about the park"
+    pool.close()
@@ -0,0 +1,126 @@
+"""tests for the cache that the api server keeps responses in, which has to drop
+exactly the responses that a nickname or notes change makes out of date."""
+
+from ArchiveAccess.APIServer import ArchiveAPIServer, ResponseCache
+from ArchiveAccess.DBRead import TwitterDataReader
+from ArchiveAccess.DBWrite import TwitterDataWriter
+from tests.message_utils import (
+    writer,
+    reader,
+    generate_conversation,
+    random_2000s_datestring,
+    random_2010s_datestring,
+    serve,
+    fetch,
+    MAIN_USER_ID,
+    DOG_RATES,
+)
+from pytest import mark
+import gzip
+import json
+
+
+def test_invalidation_by_tag():
+    cache = ResponseCache(1_000_000)
+    for key, tags in (
+        ("users", ("user names",)),
+        ("user 1", (("user", 1),)),
+        ("user 2", (("user", 2),)),
+        ("stats", ()),
+    ):
+        cache.put(key, "application/json", b"{}", tags, cache.generation)
+    assert cache.invalidate(("user", 1), "conversation notes") == 1
+    assert [x for x in ("users", "user 1", "user 2", "stats") if cache.get(x)] == [
+        "users",
+        "user 2",
+        "stats",
+    ]
+    # responses made before an invalidation aren't stored, since they might have
+    # been made from the old data
+    generation = cache.generation
+    cache.invalidate("user names")
+    response = cache.put("users", "application/json", b"{}", (), generation)
+    assert response.body == b"{}" and cache.get("users") is None
+
+
+def test_compression():
+    cache = ResponseCache(1_000_000)
+    body = json.dumps(list(range(1000))).encode()
+    response = cache.put("long", "application/json", body, (), 0)
+    assert response.compressed and gzip.decompress(response.body) == body
+    assert not cache.put("short", "application/json", b"[]", (), 0).compressed
+    assert cache.stats()["bytes"] == len(response.body) + 2
+
+
+@mark.asyncio
+async def test_cached_responses(writer: TwitterDataWriter, reader: TwitterDataReader):
+    for message in generate_conversation(
+        (10, 10),
+        (random_2000s_datestring(), random_2000s_datestring()),
+        (random_2010s_datestring(), random_2010s_datestring()),
+        f"{DOG_RATES}-{MAIN_USER_ID}",
+        (DOG_RATES, MAIN_USER_ID),
+        group=False,
+    ):
+        writer.add_message(message, False)
+    await writer.finalize()
+    cache = ResponseCache(1_000_000)
+    initializer = {
+        "reader": reader,
+        "group_media": "",
+        "individual_media": "",
+        "require_password": False,
+        "response_cache": cache,
+    }
+    http_server, url = serve(
+        [x + (initializer,) for x in ArchiveAPIServer.handlers],
+        compress_response=True,
+    )
+
+    async def get(path: str, **headers) -> dict:
+        response = await fetch(url + path, **headers)
+        assert response.code == 200
+        return json.loads(response.body)
+
+    async def post(path: str, body: str):
+        assert (await fetch(url + path, "POST", body)).code == 200
+
+    conversation = f"{DOG_RATES}-{MAIN_USER_ID}"
+    conversations = "conversations?types=individual&first=newest"
+    messages = f"messages?conversation={conversation}&after=beginning"
+    await get(messages)
+    users = await get("users")
+    assert await get("users") == users
+    await get(conversations)
+    # the order of query arguments doesn't matter
+    await get("conversations?first=newest&types=individual")
+    await get(f"user?id={DOG_RATES}")
+    await get(f"conversation?id={conversation}")
+    assert cache.stats()["hits"] == 2 and cache.stats()["entries"] == 5
+
+    # clients that don't accept gzip get the same response
+    assert await get("users", **{"Accept-Encoding": "identity"}) == users
+
+    def user_notes(users: dict) -> str:
+        return next(x for x in users["results"] if x["id"] == str(DOG_RATES))["notes"]
+
+    await post(f"user/notes?id={DOG_RATES}", "new notes")
+    # the user listing and the user's own response show their notes
+    assert cache.stats()["entries"] == 3
+    assert (await get(f"user?id={DOG_RATES}"))["notes"] == "new notes"
+    assert user_notes(await get("users")) == "new notes"
+    assert (await get(messages))["conversations"][0]["notes"] == ""
+
+    await post(f"conversation/notes?id={conversation}", "conversation notes")
+    assert (await get(f"conversation?id={conversation}"))["notes"] == (
+        "conversation notes"
+    )
+    assert (await get(conversations))["results"][0]["notes"] == "conversation notes"
+    assert (await get(messages))["conversations"][0]["notes"] == "conversation notes"
+    assert user_notes(await get("users")) == "new notes"
+
+    await post(f"user/nickname?id={DOG_RATES}", "doggo")
+    assert (await get(f"user?id={DOG_RATES}"))["nickname"] == "doggo"
+    assert "doggo" in json.dumps(await get("users"))
+    assert "doggo" in json.dumps(await get(conversations))
+    http_server.stop()
@@ -0,0 +1,196 @@
+"""makes sure that the generated DBRow encoders produce exactly what
+dataclasses.asdict would, and that the json that the database builds for some
+responses matches them, since the frontend depends on the shape of the json."""
+
+from ArchiveAccess.DBRead import (
+    ArchivedUserSummary,
+    ArchivedUser,
+    ArchivedParticipant,
+    Conversation,
+    NameUpdate,
+    ParticipantJoin,
+    ParticipantLeave,
+    Reaction,
+    Media,
+    Message,
+    SearchHighlight,
+    Page,
+    TwitterDataReader,
+    CONVERSATION_SORTS,
+)
+from ArchiveAccess.DBWrite import TwitterDataWriter
+from ArchiveAccess.APIServer import APIRequestHandler
+from tests.message_utils import (
+    writer,
+    reader,
+    generate_conversation,
+    generate_name_update,
+    get_random_text,
+    random_2000s_datestring,
+    random_2010s_datestring,
+    MAIN_USER_ID,
+    DOG_RATES,
+    OBAMA,
+)
+from dataclasses import asdict
+from pytest import fixture, mark
+from tornado.ioloop import IOLoop
+from random import choice
+import json
+
+summary = ArchivedUserSummary("1", "", "someone", "Some One", "/a.png", True, False)
+rows = [
+    summary,
+    ArchivedUser(*asdict(summary).values(), 10, "bio", "", "2010", "2011"),
+    ArchivedParticipant(*asdict(summary).values(), "1-2", 5, None, None),
+    Conversation(
+        "1-2",
+        "individual",
+        3,
+        1,
+        "2010",
+        "2011",
+        2,
+        0,
+        True,
+        summary,
+        None,
+        "a",
+        "/a.png",
+        "",
+    ),
+    NameUpdate("update1", "2010", "1", "a name", "group"),
+    ParticipantJoin("1join", "1", "2", "group", "2010"),
+    ParticipantLeave("1leave", "1", "group", "2010"),
+    Message(
+        "2010",
+        "1-2",
+        "hi",
+        "1",
+        "100",
+        [Reaction(1, "funny", "2010", "2"), Reaction(2, "like", "2011", "1")],
+        [Media("5", "image", "/api/media/individual/100-a.jpg", 640, None)],
+        "hi",
+    ),
+    Message("2010", "1-2", "", "1", "101", [], [], ""),
+    SearchHighlight("100", -1.5, "<mark>hi</mark>", "<mark>hi</mark>"),
+]
+
+
+@mark.parametrize("row", rows, ids=lambda x: type(x).__name__)
+def test_matches_asdict(row):
+    assert row.to_dict() == asdict(row)
+    serialized = row.serialize()
+    assert serialized == asdict(row) | {"schema": type(row).__name__}
+    assert list(serialized) == list(asdict(row)) + ["schema"]
+
+
+def test_response_json():
+    page = Page(rows, "cursor")
+    expected = {
+        "results": [asdict(x) | {"schema": type(x).__name__} for x in rows],
+        "cursor": "cursor",
+    }
+    assert json.dumps(APIRequestHandler.process_chunk(page)) == json.dumps(expected)
+
+
+@fixture(scope="module")
+def event_loop():
+    return IOLoop.current().asyncio_loop
+
+
+def as_response(chunk) -> str:
+    """the json that the api server sends for a chunk that it's given."""
+    return json.dumps(APIRequestHandler.process_chunk(chunk))
+
+
+def reformatted(json_text: str) -> str:
+    """sqlite leaves out the spaces that json.dumps puts in; this puts them back
+    while keeping the order of the keys, so that it's also compared."""
+    return json.dumps(json.loads(json_text))
+
+
+@mark.asyncio
+async def test_json_from_database(writer: TwitterDataWriter, reader: TwitterDataReader):
+    """checks that the json that the database builds for conversations, users, and
+    conversation names is the same as the json made from the objects that the other
+    reader methods return."""
+    messages = generate_conversation(
+        (25, 10),
+        (random_2000s_datestring(), random_2000s_datestring()),
+        (random_2010s_datestring(), random_2010s_datestring()),
+        "json-group",
+        (DOG_RATES, MAIN_USER_ID),
+    )
+    individual_messages = []
+    for user in (*range(1, 30), DOG_RATES):
+        individual_messages += generate_conversation(
+            (user % 40, 1),
+            (random_2000s_datestring(), random_2000s_datestring()),
+            (random_2010s_datestring(), random_2010s_datestring()),
+            f"{user}-{MAIN_USER_ID}",
+            (user, MAIN_USER_ID),
+            group=False,
+        )
+    messages += [
+        generate_name_update(
+            choice((MAIN_USER_ID, DOG_RATES, OBAMA)),
+            get_random_text(),
+            random_2010s_datestring(),
+            "json-group",
+        )
+        for _ in range(60)
+    ]
+    for message in messages:
+        writer.add_message(message, True)
+    for message in individual_messages:
+        writer.add_message(message, False)
+    await writer.finalize()
+    reader.set_user_nickname(3, "</script> ünïcode")
+    reader.set_user_notes(DOG_RATES, 'notes with "quotes"')
+    reader.set_conversation_notes("json-group", "some notes")
+
+    for group, individual in ((True, True), (True, False), (False, True)):
+        for sort in CONVERSATION_SORTS:
+            user_id = 3 if sort == "messages_from_user" else None
+            arguments = (group, individual, sort)
+            page = reader.get_conversations(*arguments, user_id=user_id)
+            assert reformatted(
+                reader.get_conversations_json(*arguments, user_id=user_id)
+            ) == as_response(page)
+            assert reformatted(
+                reader.get_conversations_json(
+                    *arguments, cursor=page.cursor, user_id=user_id
+                )
+            ) == as_response(
+                reader.get_conversations(
+                    *arguments, cursor=page.cursor, user_id=user_id
+                )
+            )
+
+    for conversation in (None, "json-group"):
+        page = reader.get_users_by_message_count(1, conversation)
+        assert reformatted(
+            reader.get_users_by_message_count_json(1, conversation)
+        ) == as_response(page)
+        assert reformatted(
+            reader.get_users_by_message_count_json(1, conversation, page.cursor)
+        ) == as_response(
+            reader.get_users_by_message_count(1, conversation, page.cursor)
+        )
+
+    for oldest_first in (True, False):
+        for page_number in (1, 2):
+            from_objects = APIRequestHandler.process_chunk(
+                reader.get_conversation_names("json-group", oldest_first, page_number)
+            )
+            from_database = json.loads(
+                reader.get_conversation_names_json(
+                    "json-group", oldest_first, page_number
+                )
+            )
+            assert from_database["results"] == from_objects["results"]
+            # the users come out of the cache in a different order
+            assert sorted(from_database["users"], key=lambda x: x["id"]) == sorted(
+                from_objects["users"], key=lambda x: x["id"]
+            )